@@ -0,0 +1,509 @@
+"""
+Бенчмарк кодирования: воспроизводимые синтетические источники (lavfi testsrc2 /
+mandelbrot) прогоняются через те же аргументы, что строит build_video_args,
+по матрице энкодеров, пресетов, режимов и разрешений.
+
+Для каждого прогона записываются время, fps, процессорное время, пиковая память
+и размер результата; отчёт сохраняется в CSV/JSON и может сравниваться
+с сохранённым ранее отчётом (baseline).
+
+Отдельно замеряются способы тонмаппинга HDR→SDR (TONEMAPPERS): скорость
+цепочки фильтров на синтетическом HDR10-источнике и SSIM относительно
+эталонной цепочки zscale.
+"""
+
+import csv
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from dataclasses import dataclass
+from itertools import product
+
+from engine import (
+    CREATE_NO_WINDOW,
+    DEFAULT_BUFSIZE,
+    DEFAULT_TONEMAPPER,
+    build_video_args,
+    encoder_input_args,
+    get_app_data_dir,
+    get_ffmpeg_version,
+    human_size,
+    parse_quality_score,
+    tonemap_filter,
+    tonemap_input_args,
+)
+from procstats import ProcessMonitor
+
+RESOLUTIONS = {
+    "480p": (854, 480),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "1440p": (2560, 1440),
+    "2160p": (3840, 2160),
+}
+PATTERNS = ("testsrc2", "mandelbrot")
+# короткие имена для командной строки -> энкодер из engine.ENCODERS
+ENCODERS = {
+    "x264": "libx264",
+    "nvenc": "h264_nvenc",
+    "qsv": "h264_qsv",
+    "vaapi": "h264_vaapi",
+    "amf": "h264_amf",
+    "x265": "libx265",
+    "nvenc_hevc": "hevc_nvenc",
+    "svtav1": "libsvtav1",
+    "nvenc_av1": "av1_nvenc",
+}
+DEFAULT_PRESET = "default"  # пресет энкодера по умолчанию (как при обычной конвертации)
+
+# поля, по которым прогон сопоставляется с baseline
+CASE_KEY_FIELDS = ("pattern", "resolution", "duration", "fps", "encoder", "preset", "mode", "quality", "bufsize")
+REPORT_FIELDS = (
+    *CASE_KEY_FIELDS,
+    "run",
+    "ok",
+    "wall_s",
+    "encode_fps",
+    "speed",
+    "cpu_s",
+    "cpu_percent",
+    "peak_rss_mb",
+    "size_bytes",
+    "bitrate_kbps",
+    "error",
+)
+
+
+def parse_resolution(value: str) -> tuple[str, int, int]:
+    """'1080p' или '1920x1080' -> (имя, ширина, высота)."""
+    name = value.strip().lower()
+    if name in RESOLUTIONS:
+        return name, *RESOLUTIONS[name]
+    w, sep, h = name.partition("x")
+    if not sep or not w.isdigit() or not h.isdigit():
+        raise ValueError(f"неизвестное разрешение: {value}")
+    return name, int(w), int(h)
+
+
+def parse_mode(value: str) -> tuple[str, int]:
+    """'qp:22' / 'cbr:8' (Мбит/с) -> (режим, значение)."""
+    mode, _, quality = value.strip().lower().partition(":")
+    if mode not in ("qp", "cbr") or not quality.isdigit():
+        raise ValueError(f"неверный режим: {value} (ожидается qp:N или cbr:N)")
+    return mode, int(quality)
+
+
+@dataclass(frozen=True)
+class BenchCase:
+    pattern: str
+    resolution: str
+    width: int
+    height: int
+    duration: float
+    fps: int
+    encoder: str
+    preset: str
+    mode: str
+    quality: int
+    bufsize: str
+
+    @property
+    def key(self) -> tuple:
+        return tuple(str(getattr(self, name)) for name in CASE_KEY_FIELDS)
+
+    @property
+    def label(self) -> str:
+        rc = f"QP {self.quality}" if self.mode == "qp" else f"CBR {self.quality} Мбит/с, bufsize {self.bufsize}"
+        return f"{self.pattern} {self.resolution} · {self.encoder} {self.preset} · {rc}"
+
+
+def build_matrix(
+    patterns: list[str],
+    resolutions: list[str],
+    encoders: dict[str, list[str]],
+    modes: list[str],
+    bufsizes: list[str],
+    duration: float,
+    fps: int,
+) -> list[BenchCase]:
+    """
+    Декартово произведение параметров. encoders: имя энкодера -> его пресеты.
+    bufsize варьируется только для CBR (в режиме QP не используется).
+    """
+    cases = []
+    for pattern, res in product(patterns, resolutions):
+        res_name, width, height = parse_resolution(res)
+        for encoder, presets in encoders.items():
+            for preset, mode_spec in product(presets, modes):
+                mode, quality = parse_mode(mode_spec)
+                for bufsize in bufsizes if mode == "cbr" else [DEFAULT_BUFSIZE]:
+                    cases.append(BenchCase(pattern, res_name, width, height, duration, fps, encoder, preset, mode, quality, bufsize))
+    return cases
+
+
+def ensure_source(ffmpeg_path: str, case: BenchCase, cache_dir: str, log=print) -> str:
+    """
+    Синтетический источник для прогона. Генерируется один раз (H.264 lossless,
+    быстрое декодирование) и переиспользуется, пока совпадают параметры.
+    """
+    name = f"{case.pattern}_{case.width}x{case.height}_{case.fps}fps_{case.duration:g}s.mkv"
+    lavfi = f"{case.pattern}=size={case.width}x{case.height}:rate={case.fps}"
+    return _generate_source(ffmpeg_path, os.path.join(cache_dir, name), lavfi, case.duration, ["-pix_fmt", "yuv420p"], log)
+
+
+def _generate_source(ffmpeg_path: str, path: str, lavfi: str, duration: float, extra_args: list[str], log=print) -> str:
+    """Кодирует источник lavfi в H.264 без потерь, если файла ещё нет."""
+    if os.path.isfile(path):
+        return path
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    log(f"🧪 Генерация источника: {os.path.basename(path)}\n")
+    tmp_path = f"{path}.tmp.mkv"
+    cmd = [
+        ffmpeg_path,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-y",
+        "-f",
+        "lavfi",
+        "-i",
+        lavfi,
+        "-t",
+        f"{duration:g}",
+        "-c:v",
+        "libx264",
+        "-preset",
+        "ultrafast",
+        "-qp",
+        "0",
+        *extra_args,
+        tmp_path,
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, errors="replace", creationflags=CREATE_NO_WINDOW)
+    if result.returncode != 0:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise RuntimeError(result.stderr.strip() or f"ffmpeg завершился с кодом {result.returncode}")
+    os.replace(tmp_path, path)
+    return path
+
+
+def case_video_args(case: BenchCase) -> list[str]:
+    """Ровно те аргументы, которые получила бы задача конвертации с такими настройками."""
+    return build_video_args(
+        input_path="",
+        video_info={"requires_tonemap": False, "hdr_type": "SDR", "width": case.width, "height": case.height},
+        skip_video=False,
+        encode_mode=0 if case.mode == "qp" else 1,
+        qp_slider=case.quality,
+        limit_res=False,
+        tonemap_mode=2,
+        encoder=ENCODERS[case.encoder],
+        preset=None if case.preset == DEFAULT_PRESET else case.preset,
+        bufsize=case.bufsize,
+    )
+
+
+def run_case(ffmpeg_path: str, case: BenchCase, source: str, work_dir: str, run: int = 0) -> dict:
+    """Один прогон кодирования; возвращает строку отчёта."""
+    result = {name: getattr(case, name) for name in CASE_KEY_FIELDS}
+    result.update(run=run, ok=False, error="")
+    output = os.path.join(work_dir, "bench_out.mp4")
+    cmd = [
+        ffmpeg_path,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-nostats",
+        "-y",
+        *encoder_input_args(ENCODERS[case.encoder]),
+        "-i",
+        source,
+        "-map",
+        "0:v:0",
+        *case_video_args(case),
+        "-an",
+        output,
+    ]
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=stderr, creationflags=CREATE_NO_WINDOW)
+        stats = ProcessMonitor(proc, interval=0.2).finish()
+        stderr.seek(0)
+        error = stderr.read().decode("utf-8", errors="replace").strip()
+
+    frames = round(case.duration * case.fps)
+    size = os.path.getsize(output) if os.path.exists(output) else 0
+    result.update(
+        ok=proc.returncode == 0 and size > 0,
+        wall_s=round(stats.wall_time, 3),
+        encode_fps=round(frames / stats.wall_time, 2) if stats.wall_time > 0 else 0.0,
+        speed=round(case.duration / stats.wall_time, 3) if stats.wall_time > 0 else 0.0,
+        cpu_s=round(stats.cpu_time, 3),
+        cpu_percent=round(stats.cpu_percent, 1),
+        peak_rss_mb=round(stats.peak_rss / 1024**2, 1),
+        size_bytes=size,
+        bitrate_kbps=round(size * 8 / 1000 / case.duration, 1) if case.duration else 0.0,
+    )
+    if not result["ok"]:
+        result["error"] = (error.splitlines() or [f"ffmpeg завершился с кодом {proc.returncode}"])[-1]
+    if os.path.exists(output):
+        os.remove(output)
+    return result
+
+
+def run_benchmark(ffmpeg_path: str, cases: list[BenchCase], repeat: int = 1, cache_dir: str | None = None, log=print) -> list[dict]:
+    """
+    Прогоняет матрицу последовательно (параллельные прогоны искажают замеры).
+    Каждый случай повторяется repeat раз, в отчёт попадают все повторы.
+    """
+    cache_dir = cache_dir or os.path.join(get_app_data_dir(), "bench")
+    work_dir = tempfile.mkdtemp(prefix=".vc_bench_")
+    results = []
+    try:
+        for i, case in enumerate(cases, 1):
+            try:
+                source = ensure_source(ffmpeg_path, case, cache_dir, log)
+            except Exception as e:
+                log(f"❌ [{i}/{len(cases)}] {case.label}: источник не создан: {e}\n")
+                results.append({**{name: getattr(case, name) for name in CASE_KEY_FIELDS}, "run": 0, "ok": False, "error": str(e)})
+                continue
+            for run in range(repeat):
+                row = run_case(ffmpeg_path, case, source, work_dir, run)
+                results.append(row)
+                if row["ok"]:
+                    log(
+                        f"⏱ [{i}/{len(cases)}] {case.label}: {row['encode_fps']:.1f} fps, "
+                        f"CPU {row['cpu_percent']:.0f}%, {row['peak_rss_mb']:.0f} МБ, {human_size(row['size_bytes'])}\n"
+                    )
+                else:
+                    log(f"❌ [{i}/{len(cases)}] {case.label}: {row['error']}\n")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def best_runs(results: list[dict]) -> dict[tuple, dict]:
+    """Лучший (самый быстрый) успешный повтор каждого случая."""
+    best: dict[tuple, dict] = {}
+    for row in results:
+        if not row.get("ok"):
+            continue
+        key = tuple(str(row.get(name)) for name in CASE_KEY_FIELDS)
+        if key not in best or row["wall_s"] < best[key]["wall_s"]:
+            best[key] = row
+    return best
+
+
+def compare_with_baseline(results: list[dict], baseline: list[dict], threshold: float = 5.0) -> list[dict]:
+    """
+    Сравнение с baseline по лучшим повторам. Регрессия — падение fps или рост
+    размера больше чем на threshold процентов.
+    """
+    current, previous = best_runs(results), best_runs(baseline)
+    comparisons = []
+    for key, row in current.items():
+        old = previous.get(key)
+        if old is None:
+            continue
+        fps_delta = 100.0 * (row["encode_fps"] - old["encode_fps"]) / old["encode_fps"] if old["encode_fps"] else 0.0
+        size_delta = 100.0 * (row["size_bytes"] - old["size_bytes"]) / old["size_bytes"] if old["size_bytes"] else 0.0
+        cpu_delta = 100.0 * (row["cpu_s"] - old["cpu_s"]) / old["cpu_s"] if old["cpu_s"] else 0.0
+        comparisons.append({
+            **{name: row[name] for name in CASE_KEY_FIELDS},
+            "fps": row["encode_fps"],
+            "baseline_fps": old["encode_fps"],
+            "fps_delta_pct": round(fps_delta, 1),
+            "size_delta_pct": round(size_delta, 1),
+            "cpu_delta_pct": round(cpu_delta, 1),
+            "regression": fps_delta < -threshold or size_delta > threshold,
+        })
+    return comparisons
+
+
+def report_meta(ffmpeg_path: str) -> dict:
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": get_ffmpeg_version(ffmpeg_path),
+    }
+
+
+def write_report(
+    path: str, results: list[dict], meta: dict, comparisons: list[dict] | None = None, fields: tuple[str, ...] = REPORT_FIELDS
+):
+    """Формат по расширению: .csv — строки прогонов (столбцы fields), иначе JSON с метаданными."""
+    if path.lower().endswith(".csv"):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(results)
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results, "comparison": comparisons or []}, f, ensure_ascii=False, indent=2)
+
+
+def load_report(path: str) -> list[dict]:
+    """Строки прогонов из ранее сохранённого отчёта (JSON или CSV)."""
+    if path.lower().endswith(".csv"):
+        numeric = {"wall_s", "encode_fps", "speed", "cpu_s", "cpu_percent", "peak_rss_mb", "bitrate_kbps"}
+        rows = []
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                row["ok"] = row.get("ok") == "True"
+                for name in numeric:
+                    row[name] = float(row.get(name) or 0.0)
+                row["size_bytes"] = int(row.get("size_bytes") or 0)
+                rows.append(row)
+        return rows
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("results", [])
+
+
+def format_comparison(comparisons: list[dict]) -> str:
+    lines = []
+    for c in comparisons:
+        mark = "⚠" if c["regression"] else "✅"
+        rc = f"QP {c['quality']}" if c["mode"] == "qp" else f"CBR {c['quality']}/{c['bufsize']}"
+        lines.append(
+            f"{mark} {c['pattern']} {c['resolution']} {c['encoder']} {c['preset']} {rc}: "
+            f"{c['baseline_fps']:.1f} → {c['fps']:.1f} fps ({c['fps_delta_pct']:+.1f}%), "
+            f"размер {c['size_delta_pct']:+.1f}%, CPU {c['cpu_delta_pct']:+.1f}%"
+        )
+    return "\n".join(lines) + ("\n" if lines else "")
+
+
+# --- Тонмаппинг ---
+TONEMAP_KEY_FIELDS = ("tonemapper", "pattern", "resolution", "duration", "fps")
+TONEMAP_REPORT_FIELDS = (
+    *TONEMAP_KEY_FIELDS,
+    "run",
+    "ok",
+    "wall_s",
+    "filter_fps",
+    "speed",
+    "cpu_s",
+    "cpu_percent",
+    "peak_rss_mb",
+    "ssim_db",
+    "error",
+)
+# синтетический HDR10: кадры testsrc2 в 10 бит, размеченные как PQ / BT.2020
+HDR10_INFO = {"color_primaries": "bt2020", "color_transfer": "smpte2084", "color_space": "bt2020nc"}
+
+
+def ensure_hdr_source(ffmpeg_path: str, pattern: str, width: int, height: int, duration: float, fps: int, cache_dir: str, log=print) -> str:
+    name = f"hdr10_{pattern}_{width}x{height}_{fps}fps_{duration:g}s.mkv"
+    lavfi = (
+        f"{pattern}=size={width}x{height}:rate={fps},format=yuv420p10le,"
+        "setparams=color_primaries=bt2020:color_trc=smpte2084:colorspace=bt2020nc"
+    )
+    tags = ["-color_primaries", "bt2020", "-color_trc", "smpte2084", "-colorspace", "bt2020nc"]
+    return _generate_source(ffmpeg_path, os.path.join(cache_dir, name), lavfi, duration, ["-pix_fmt", "yuv420p10le", *tags], log)
+
+
+def _run_ffmpeg_quiet(cmd: list[str]) -> tuple[int, str]:
+    result = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True, text=True, errors="replace", creationflags=CREATE_NO_WINDOW)
+    return result.returncode, result.stderr
+
+
+def tonemap_ssim(ffmpeg_path: str, tonemapper: str, source: str) -> float | None:
+    """SSIM (дБ) результата тонмаппинга относительно эталонной цепочки zscale на тех же кадрах."""
+    # эталон переводится в yuv420p через 16-битный RGB: прямое преобразование
+    # gbrpf32le → yuv420p в swscale заметно сдвигает яркость (зависит от версии
+    # ffmpeg), и сравнивались бы уже не способы тонмаппинга
+    reference = tonemap_filter(DEFAULT_TONEMAPPER, HDR10_INFO).replace(",format=yuv420p", ",format=gbrp16le,format=yuv420p")
+    graph = (
+        f"[0:v]split[a][b];[a]{reference}[ref];"
+        f"[b]{tonemap_filter(tonemapper, HDR10_INFO)}[out];[out][ref]ssim"
+    )
+    cmd = [ffmpeg_path, "-hide_banner", "-nostats", *tonemap_input_args(tonemapper), "-i", source, "-filter_complex", graph, "-f", "null", "-"]
+    code, stderr = _run_ffmpeg_quiet(cmd)
+    return parse_quality_score("ssim", stderr) if code == 0 else None
+
+
+def run_tonemap_case(ffmpeg_path: str, tonemapper: str, source: str, key: dict, run: int = 0) -> dict:
+    """Скорость цепочки тонмаппинга (декодирование + фильтры, без кодирования)."""
+    result = {**key, "tonemapper": tonemapper, "run": run, "ok": False, "error": ""}
+    cmd = [
+        ffmpeg_path,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-nostats",
+        *tonemap_input_args(tonemapper),
+        "-i",
+        source,
+        "-vf",
+        tonemap_filter(tonemapper, HDR10_INFO),
+        "-f",
+        "null",
+        "-",
+    ]
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=stderr, creationflags=CREATE_NO_WINDOW)
+        stats = ProcessMonitor(proc, interval=0.2).finish()
+        stderr.seek(0)
+        error = stderr.read().decode("utf-8", errors="replace").strip()
+
+    frames = round(key["duration"] * key["fps"])
+    result.update(
+        ok=proc.returncode == 0,
+        wall_s=round(stats.wall_time, 3),
+        filter_fps=round(frames / stats.wall_time, 2) if stats.wall_time > 0 else 0.0,
+        speed=round(key["duration"] / stats.wall_time, 3) if stats.wall_time > 0 else 0.0,
+        cpu_s=round(stats.cpu_time, 3),
+        cpu_percent=round(stats.cpu_percent, 1),
+        peak_rss_mb=round(stats.peak_rss / 1024**2, 1),
+    )
+    if not result["ok"]:
+        result["error"] = (error.splitlines() or [f"ffmpeg завершился с кодом {proc.returncode}"])[-1]
+    return result
+
+
+def run_tonemap_benchmark(
+    ffmpeg_path: str,
+    tonemappers: list[str],
+    resolutions: list[str],
+    duration: float = 5.0,
+    fps: int = 30,
+    pattern: str = "testsrc2",
+    repeat: int = 1,
+    cache_dir: str | None = None,
+    log=print,
+) -> list[dict]:
+    """
+    Для каждого разрешения и способа тонмаппинга: repeat замеров скорости
+    и одна оценка SSIM относительно zscale (у самого эталона — пусто).
+    """
+    cache_dir = cache_dir or os.path.join(get_app_data_dir(), "bench")
+    results = []
+    for res_name, width, height in (parse_resolution(value) for value in resolutions):
+        key = {"pattern": pattern, "resolution": res_name, "duration": duration, "fps": fps}
+        try:
+            source = ensure_hdr_source(ffmpeg_path, pattern, width, height, duration, fps, cache_dir, log)
+        except Exception as e:
+            log(f"❌ {res_name}: источник не создан: {e}\n")
+            results.extend({**key, "tonemapper": name, "run": 0, "ok": False, "error": str(e)} for name in tonemappers)
+            continue
+        for name in tonemappers:
+            ssim = None if name == DEFAULT_TONEMAPPER else tonemap_ssim(ffmpeg_path, name, source)
+            for run in range(repeat):
+                row = run_tonemap_case(ffmpeg_path, name, source, key, run)
+                row["ssim_db"] = round(ssim, 2) if ssim is not None else None
+                results.append(row)
+                if row["ok"]:
+                    quality = "эталон" if name == DEFAULT_TONEMAPPER else f"SSIM {ssim:.2f} дБ" if ssim is not None else "SSIM ?"
+                    log(
+                        f"⏱ {res_name} · {name}: {row['filter_fps']:.1f} fps, CPU {row['cpu_percent']:.0f}%, "
+                        f"{row['peak_rss_mb']:.0f} МБ, {quality}\n"
+                    )
+                else:
+                    log(f"❌ {res_name} · {name}: {row['error']}\n")
+    return results
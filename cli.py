@@ -0,0 +1,713 @@
+"""
+Командная строка (headless-режим) поверх движка engine.py. wxPython не импортируется,
+поэтому режим подходит для серверов без графики (cron, systemd). Команда
+video-converter ставится вместе с пакетом (pip install .); без установки —
+python cli.py с теми же аргументами.
+
+    video-converter convert --qp 22 --limit-res --jobs 4 --json files...
+    video-converter convert --ladder 1080p,720p:24,audio files...
+    video-converter watch --settle 15 -o /mnt/out /mnt/ingest
+    video-converter benchmark --resolutions 720p,1080p --modes qp:22,cbr:8 -o report.json
+    video-converter tonemap-benchmark --resolutions 2160p -o tonemap.csv
+
+Коды выхода: 0 — все файлы сконвертированы, 1 — часть задач завершилась ошибкой,
+2 — неверные аргументы, 130 — прервано (Ctrl+C / SIGTERM).
+"""
+
+import argparse
+import json
+import os
+import queue
+import signal
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+
+import engine
+import watcher
+from engine import (
+    JOB_CANCELLED,
+    JOB_DONE,
+    ConversionEngine,
+    ConversionJob,
+    JobStore,
+    Rendition,
+    RowSettings,
+    detect_capabilities,
+    format_time,
+    parse_audio_streams,
+    parse_audio_tracks,
+    parse_subtitle_tracks,
+    parse_video_info,
+    probe_media,
+    select_encoder,
+)
+from watcher import FolderWatcher
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_CANCELLED = 130
+
+TONEMAP_MODES = {name: mode for mode, name in enumerate(engine.TONEMAP_MODES)}
+
+
+class Reporter:
+    """
+    Вывод хода работы. В режиме --json stdout содержит только JSON-строки
+    событий (status/progress/summary), а лог уходит в stderr.
+    """
+
+    def __init__(self, as_json: bool, quiet: bool = False):
+        self.as_json = as_json
+        self.quiet = quiet
+        self._lock = threading.Lock()
+        self._tty = sys.stderr.isatty()
+
+    def log(self, text: str):
+        if self.quiet:
+            return
+        with self._lock:
+            stream = sys.stderr if self.as_json else sys.stdout
+            stream.write(text)
+            stream.flush()
+
+    def event(self, **payload):
+        with self._lock:
+            sys.stdout.write(json.dumps(payload, ensure_ascii=False) + "\n")
+            sys.stdout.flush()
+
+    def on_status(self, job: ConversionJob):
+        if self.as_json:
+            extra = {"outputs": job.output_paths} if job.renditions else {}
+            self.event(event="status", job=job.key, file=job.input_path, status=job.status, output=job.output_path, **extra)
+
+    def on_progress(self, job: ConversionJob, progress: dict):
+        if self.as_json:
+            self.event(
+                event="progress",
+                job=job.key,
+                file=job.input_path,
+                percent=progress["row_progress"],
+                time=progress["time"],
+                fps=progress["fps"],
+                speed=progress["speed"],
+                size=progress["size"],
+                bitrate_kbps=progress["bitrate"],
+                overall_percent=progress["overall_progress"],
+                remaining=progress["remaining"],
+                **({"outputs": progress["outputs"]} if "outputs" in progress else {}),
+            )
+        elif self._tty and not self.quiet:
+            remaining = format_time(progress["remaining"]) if progress["remaining"] is not None else "?"
+            with self._lock:
+                sys.stderr.write(
+                    f"\rОчередь: {progress['overall_progress']:3d}% │ задач: {progress['active_jobs']} │ "
+                    f"⚡ {progress['total_speed']:.2f}x │ ⏲ {remaining}   "
+                )
+                sys.stderr.flush()
+
+
+def settings_from_args(args) -> RowSettings:
+    if args.target_quality is not None:
+        encode_mode, quality = 2, args.target_quality
+    elif args.cbr is not None:
+        encode_mode, quality = 1, args.cbr
+    else:
+        encode_mode, quality = 0, args.qp
+    return RowSettings(
+        is_global=False,
+        encode_mode=encode_mode,
+        quality=quality,
+        limit_res=args.limit_res,
+        tonemapping=TONEMAP_MODES[args.tonemap],
+        skip_video=args.skip_video,
+        skip_audio=args.skip_audio,
+        smart_copy=not args.no_smart_copy,
+        quality_metric=args.metric,
+        codec=output_codec(args),
+        tonemapper=args.tonemapper,
+    )
+
+
+def output_codec(args) -> str:
+    """--codec, а без него — кодек явно выбранного --encoder (по умолчанию h264)."""
+    if args.codec:
+        return args.codec
+    return engine.ENCODERS[args.encoder].codec if args.encoder != "auto" else "h264"
+
+
+def _select_subtitles(tracks: list[dict], spec: str) -> list[dict]:
+    """spec: none | all | список номеров s:N через запятую. Берутся только дорожки, допустимые в MP4."""
+    if spec == "none":
+        return []
+    if spec == "all":
+        wanted = None
+    else:
+        wanted = {int(x) for x in spec.split(",") if x.strip().isdigit()}
+    return [t for t in tracks if t.get("supported") and (wanted is None or t["order"] in wanted)]
+
+
+def make_job(key: int, path: str, args, settings: RowSettings, renditions: list[Rendition] | None = None) -> ConversionJob:
+    """Анализирует файл (через кэш ffprobe) и собирает задачу движка."""
+    probe = probe_media(path)
+    audio_tracks = parse_audio_tracks(probe)
+    info = parse_video_info(probe)
+    audio_track = args.audio_track if args.audio_track < len(audio_tracks) else None
+    return ConversionJob(
+        key=key,
+        input_path=path,
+        settings=settings,
+        audio_track=audio_track,
+        subtitles=_select_subtitles(parse_subtitle_tracks(probe), args.subtitles),
+        duration=float(info["duration"] or 0.0),
+        video_info=info,
+        audio_streams=parse_audio_streams(probe),
+        save_folder=args.output_dir,
+        add_suffix=not args.no_suffix,
+        copy_tags=args.copy_tags,
+        chunked=args.chunked,
+        renditions=list(renditions or []),
+    )
+
+
+def pick_encoder(args, reporter: Reporter, codec: str) -> str:
+    """--cpu / --encoder NAME / auto (самый быстрый рабочий энкодер кодека по результатам проверки)."""
+    if args.cpu:
+        encoder = engine.CPU_ENCODERS[codec]
+        reporter.log(f"Энкодер: {encoder} (CPU)\n")
+        return encoder
+    capabilities = detect_capabilities(engine.FFMPEG_PATH)
+    preferred = None if args.encoder == "auto" else args.encoder
+    encoder, fps = select_encoder(capabilities, codec, preferred)
+    if preferred and encoder != preferred:
+        reporter.log(f"⚠ Энкодер {preferred} не работает на этой машине\n")
+    speed = f", {fps:.0f} fps в тесте" if fps else ""
+    reporter.log(f"Энкодер: {encoder}{speed}\n")
+    return encoder
+
+
+def cmd_encoders(args) -> int:
+    if args.ffmpeg:
+        engine.FFMPEG_PATH = args.ffmpeg
+    capabilities = detect_capabilities(engine.FFMPEG_PATH, use_cache=not args.refresh)
+    if args.json:
+        print(json.dumps(capabilities, ensure_ascii=False))
+        return EXIT_OK
+    version = capabilities.get("version") or {}
+    print(f"FFmpeg: {version.get('ffmpeg', '?')}{' (из кэша)' if capabilities.get('cached') else ''}")
+    print(f"Аппаратное ускорение: {', '.join(capabilities.get('hwaccels') or []) or 'нет'}")
+    for entry in capabilities.get("encoders") or []:
+        print(f"  {entry['name']:<12} {entry['codec']:<5} {entry['kind']:<6} {entry['fps']:>8.1f} fps")
+    defaults = (f"{codec}: {select_encoder(capabilities, codec)[0]}" for codec in engine.CODECS)
+    print(f"Выбор по умолчанию: {', '.join(defaults)}")
+    return EXIT_OK
+
+
+def prepare_conversion(args) -> tuple[RowSettings, list[Rendition]] | int:
+    """Общая часть convert и watch: пути к ffmpeg, проверка аргументов, настройки и выходы лесенки (или код выхода)."""
+    if args.ffmpeg:
+        engine.FFMPEG_PATH = args.ffmpeg
+    if args.ffprobe:
+        engine.FFPROBE_PATH = args.ffprobe
+    if args.output_dir and not os.path.isdir(args.output_dir):
+        print(f"Папка не найдена: {args.output_dir}", file=sys.stderr)
+        return EXIT_USAGE
+
+    settings = settings_from_args(args)
+    if args.encoder != "auto" and engine.ENCODERS[args.encoder].codec != settings.codec:
+        print(f"Энкодер {args.encoder} не кодирует в {settings.codec}", file=sys.stderr)
+        return EXIT_USAGE
+
+    renditions = []
+    if args.ladder:
+        try:
+            renditions = engine.parse_ladder(args.ladder)
+        except ValueError as e:
+            print(f"--ladder: {e}", file=sys.stderr)
+            return EXIT_USAGE
+        if settings.skip_video:
+            print("--ladder несовместим с --skip-video", file=sys.stderr)
+            return EXIT_USAGE
+    return settings, renditions
+
+
+def make_engine(
+    args, reporter: Reporter, settings: RowSettings, on_status=None, store: JobStore | None = None
+) -> tuple[ConversionEngine, RowSettings, str]:
+    """Выбор энкодера и способа тонмаппинга и движок с обратными вызовами reporter."""
+    encoder = pick_encoder(args, reporter, settings.codec)
+    if settings.tonemapper != engine.DEFAULT_TONEMAPPER:
+        if settings.tonemapper not in detect_capabilities(engine.FFMPEG_PATH).get("tonemappers", []):
+            reporter.log(f"⚠ Тонмаппинг {settings.tonemapper} недоступен, используется {engine.DEFAULT_TONEMAPPER}\n")
+            settings = replace(settings, tonemapper=engine.DEFAULT_TONEMAPPER)
+
+    conv = ConversionEngine(
+        encoders={settings.codec: encoder},
+        max_jobs=args.jobs,
+        log=reporter.log,
+        on_status=on_status or reporter.on_status,
+        on_progress=reporter.on_progress,
+        debug=args.debug,
+        ffmpeg_path=engine.FFMPEG_PATH,
+        chunk_seconds=args.chunk_seconds,
+        chunk_workers=args.chunk_workers,
+        store=store,
+    )
+    return conv, settings, encoder
+
+
+def write_reports(args, reporter: Reporter, jobs: list[ConversionJob], encoder: str, report_rows: list[dict] | None = None):
+    """
+    Сводка ресурсов в лог по jobs и отчёты --report: по report_rows (строки
+    job_report_rows всех задач запуска), по умолчанию — по jobs.
+    """
+    reporter.log(engine.summarize_jobs(jobs))
+    rows = engine.job_report_rows(jobs) if report_rows is None else report_rows
+    for path in args.report or []:
+        try:
+            engine.write_report_rows(path, rows, {"encoder": encoder, "jobs": args.jobs, "ffmpeg": engine.FFMPEG_PATH})
+            reporter.log(f"💾 Отчёт: {path}\n")
+        except OSError as e:
+            reporter.log(f"⚠ Не удалось сохранить отчёт {path}: {e}\n")
+
+
+def open_state(args, reporter: Reporter) -> tuple[JobStore | None, list[ConversionJob]]:
+    """
+    --state: постоянная очередь. Задачи, прерванные сбоем, приводятся в порядок
+    (неполные файлы удаляются); возвращаются уже выполненные задачи.
+    """
+    if not args.state:
+        return None, []
+    store = JobStore(args.state)
+    if not store.available:
+        reporter.log(f"⚠ Не удалось открыть очередь {args.state}, продолжаем без неё\n")
+        return None, []
+    done = [job for job in store.recover(reporter.log) if engine.job_already_done(job)]
+    return store, done
+
+
+def _path_key(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+def cmd_convert(args) -> int:
+    prepared = prepare_conversion(args)
+    if isinstance(prepared, int):
+        return prepared
+    settings, renditions = prepared
+
+    reporter = Reporter(args.json, args.quiet)
+    store, done_before = open_state(args, reporter)
+    conv, settings, encoder = make_engine(args, reporter, settings, store=store)
+
+    paths = [os.path.abspath(p) for p in args.files]
+    finished = {_path_key(job.input_path) for job in done_before}
+    skipped = [p for p in paths if _path_key(p) in finished]
+    if skipped:
+        reporter.log(f"⏭ Уже сконвертированы ранее (--state): {len(skipped)}\n")
+        paths = [p for p in paths if _path_key(p) not in finished]
+    first_key = len(done_before)
+    with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as pool:
+        jobs = list(pool.map(lambda item: make_job(first_key + item[0], item[1], args, settings, renditions), enumerate(paths)))
+    engine.PROBE_CACHE.flush()
+    if store is not None:
+        for key, job in enumerate(done_before):
+            job.key = key
+        store.replace_all([*done_before, *jobs])
+
+    def on_signal(signum, frame):
+        # cancel() ждёт завершения процессов — не блокируем обработчик сигнала
+        threading.Thread(target=conv.cancel, daemon=True).start()
+
+    signal.signal(signal.SIGINT, on_signal)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, on_signal)
+
+    conv.run(jobs)
+    write_reports(args, reporter, jobs, encoder)
+
+    done = sum(1 for job in jobs if job.status == JOB_DONE)
+    cancelled = conv.cancel_event.is_set() or any(job.status == JOB_CANCELLED for job in jobs)
+    failed = len(jobs) - done - sum(1 for job in jobs if job.status == JOB_CANCELLED)
+    if args.json:
+        reporter.event(event="summary", total=len(jobs), done=done, failed=failed, cancelled=cancelled)
+    else:
+        reporter.log(f"\nГотово: {done} из {len(jobs)}, ошибок: {failed}{', прервано' if cancelled else ''}\n")
+
+    if cancelled:
+        return EXIT_CANCELLED
+    return EXIT_FAILED if failed else EXIT_OK
+
+
+class WatchIgnore:
+    """
+    Фильтр слежения (ignore для FolderWatcher): временные *.vcpart.*, исходники,
+    уже сконвертированные по --state, и собственные результаты. Пути сравниваются
+    через _path_key: выходы строятся от -o как есть (может быть относительным),
+    а наблюдатель отдаёт абсолютные пути, на Windows ещё и в другом регистре.
+    """
+
+    def __init__(self, finished=()):
+        self.finished = {_path_key(path) for path in finished}
+        self._produced: set[str] = set()
+        self._lock = threading.Lock()
+
+    def add_outputs(self, paths: list[str]):
+        """Выходы задачи; вызывается из рабочих потоков движка."""
+        keys = {_path_key(path) for path in paths}
+        with self._lock:
+            self._produced.update(keys)
+
+    def __call__(self, path: str) -> bool:
+        if engine.PART_MARKER in os.path.basename(path):
+            return True
+        key = _path_key(path)
+        if key in self.finished:
+            return True
+        with self._lock:
+            return key in self._produced
+
+
+def cmd_watch(args) -> int:
+    missing = [folder for folder in args.folders if not os.path.isdir(folder)]
+    if missing:
+        print(f"Папка не найдена: {', '.join(missing)}", file=sys.stderr)
+        return EXIT_USAGE
+    extensions = tuple(f".{ext.strip().lstrip('.').lower()}" for ext in args.extensions.split(",") if ext.strip())
+    if not extensions:
+        print("--extensions: не задано ни одного расширения", file=sys.stderr)
+        return EXIT_USAGE
+    prepared = prepare_conversion(args)
+    if isinstance(prepared, int):
+        return prepared
+    settings, renditions = prepared
+
+    reporter = Reporter(args.json, args.quiet)
+    store, done_before = open_state(args, reporter)
+    # результаты, если они пишутся в наблюдаемую папку, не должны снова попасть в очередь
+    skip = WatchIgnore(job.input_path for job in done_before)
+
+    def on_status(job: ConversionJob):
+        skip.add_outputs(job.output_paths)
+        reporter.on_status(job)
+
+    if store is not None:
+        # очередь сжимается до выполненных задач один раз; дальше партии только дописываются
+        for key, job in enumerate(done_before):
+            job.key = key
+        store.replace_all(done_before)
+    next_key = len(done_before)
+    done_before.clear()
+    conv, settings, encoder = make_engine(args, reporter, settings, on_status, store)
+    folder_watcher = FolderWatcher(
+        args.folders,
+        extensions=extensions,
+        settle=args.settle,
+        recursive=args.recursive,
+        include_existing=args.existing,
+        ignore=skip,
+        use_inotify=not args.poll,
+        poll_interval=args.poll_interval,
+    )
+    folders = ", ".join(folder_watcher.folders)
+    reporter.log(f"👀 Слежение ({folder_watcher.mode}): {folders}; файл берётся после {args.settle:g} с без изменений\n")
+
+    stop = threading.Event()
+    ready: queue.Queue[str] = queue.Queue()
+
+    def watch_loop():
+        try:
+            while not stop.is_set():
+                for path in folder_watcher.poll(timeout=1.0):
+                    ready.put(path)
+        except Exception as e:
+            reporter.log(f"❌ Ошибка слежения: {e}\n")
+            stop.set()
+        finally:
+            folder_watcher.close()
+
+    def on_signal(signum, frame):
+        stop.set()
+        threading.Thread(target=conv.cancel, daemon=True).start()
+
+    signal.signal(signal.SIGINT, on_signal)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, on_signal)
+
+    watch_thread = threading.Thread(target=watch_loop, daemon=True, name="watch")
+    watch_thread.start()
+
+    # Сами задачи после партии не хранятся: демон работает неделями, а для
+    # итога и --report хватает счётчиков и строк отчёта.
+    report_rows: list[dict] = []
+    total = done = failed = 0
+    interrupted = False
+    while not stop.is_set():
+        try:
+            paths = [ready.get(timeout=1.0)]
+        except queue.Empty:
+            continue
+        # всё, что успело стать готовым, — одной партией на -j задач
+        while True:
+            try:
+                paths.append(ready.get_nowait())
+            except queue.Empty:
+                break
+        batch = []
+        for path in paths:
+            reporter.log(f"📥 Новый файл: {path}\n")
+            try:
+                batch.append(make_job(next_key, path, args, settings, renditions))
+                next_key += 1
+            except Exception as e:
+                reporter.log(f"❌ Не удалось разобрать {path}: {e}\n")
+        engine.PROBE_CACHE.flush()
+        if store is not None:
+            # только новая партия; статусы дальше пишет движок (set_status)
+            store.append(batch)
+        if stop.is_set():
+            # сигнал пришёл, пока партия разбиралась: не запускаем её
+            break
+        conv.run(batch)
+        total += len(batch)
+        done += sum(1 for job in batch if job.status == JOB_DONE)
+        failed += sum(1 for job in batch if job.status not in (JOB_DONE, JOB_CANCELLED))
+        interrupted = interrupted or any(job.status == JOB_CANCELLED for job in batch)
+        report_rows.extend(engine.job_report_rows(batch))
+        write_reports(args, reporter, batch, encoder, report_rows=report_rows)
+
+    watch_thread.join(timeout=5)
+    if args.json:
+        reporter.event(event="summary", total=total, done=done, failed=failed, cancelled=interrupted)
+    else:
+        reporter.log(f"\nСлежение остановлено. Сконвертировано: {done} из {total}, ошибок: {failed}\n")
+    return EXIT_CANCELLED if interrupted else EXIT_OK
+
+
+def _split(value: str) -> list[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def cmd_benchmark(args) -> int:
+    import bench
+
+    if args.ffmpeg:
+        engine.FFMPEG_PATH = args.ffmpeg
+    reporter = Reporter(as_json=False, quiet=args.quiet)
+
+    encoder_names = _split(args.encoders)
+    if encoder_names == ["auto"]:
+        working = {e["name"] for e in detect_capabilities(engine.FFMPEG_PATH)["encoders"]}
+        encoder_names = [alias for alias, name in bench.ENCODERS.items() if name in working] or ["x264"]
+    presets = {"x264": _split(args.x264_presets), "nvenc": _split(args.nvenc_presets)}
+    try:
+        unknown = [name for name in encoder_names if name not in bench.ENCODERS]
+        if unknown:
+            raise ValueError(f"неизвестный энкодер: {', '.join(unknown)}")
+        cases = bench.build_matrix(
+            patterns=_split(args.patterns),
+            resolutions=_split(args.resolutions),
+            encoders={name: presets.get(name) or [bench.DEFAULT_PRESET] for name in encoder_names},
+            modes=_split(args.modes),
+            bufsizes=_split(args.bufsizes),
+            duration=args.duration,
+            fps=args.fps,
+        )
+        baseline = bench.load_report(args.baseline) if args.baseline else None
+    except (ValueError, OSError) as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return EXIT_USAGE
+
+    reporter.log(f"🧪 Бенчмарк: {len(cases)} вариантов × {args.repeat} повтор(ов)\n")
+    results = bench.run_benchmark(engine.FFMPEG_PATH, cases, repeat=args.repeat, log=reporter.log)
+
+    comparisons = bench.compare_with_baseline(results, baseline, args.threshold) if baseline is not None else []
+    if comparisons:
+        reporter.log("\nСравнение с baseline (лучшие повторы):\n" + bench.format_comparison(comparisons))
+
+    meta = bench.report_meta(engine.FFMPEG_PATH)
+    for path in args.output or []:
+        bench.write_report(path, results, meta, comparisons)
+        reporter.log(f"💾 Отчёт: {path}\n")
+
+    if any(not row["ok"] for row in results):
+        return EXIT_FAILED
+    if args.fail_on_regression and any(c["regression"] for c in comparisons):
+        return EXIT_FAILED
+    return EXIT_OK
+
+
+def cmd_tonemap_benchmark(args) -> int:
+    import bench
+
+    if args.ffmpeg:
+        engine.FFMPEG_PATH = args.ffmpeg
+    reporter = Reporter(as_json=False, quiet=args.quiet)
+
+    tonemappers = _split(args.tonemappers)
+    if tonemappers == ["auto"]:
+        tonemappers = detect_capabilities(engine.FFMPEG_PATH).get("tonemappers") or [engine.DEFAULT_TONEMAPPER]
+    unknown = [name for name in tonemappers if name not in engine.TONEMAPPERS]
+    resolutions = _split(args.resolutions)
+    try:
+        if unknown:
+            raise ValueError(f"неизвестный способ тонмаппинга: {', '.join(unknown)}")
+        for value in resolutions:
+            bench.parse_resolution(value)
+    except ValueError as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return EXIT_USAGE
+
+    reporter.log(f"🧪 Тонмаппинг: {', '.join(tonemappers)} × {', '.join(resolutions)}\n")
+    results = bench.run_tonemap_benchmark(
+        engine.FFMPEG_PATH,
+        tonemappers,
+        resolutions,
+        duration=args.duration,
+        fps=args.fps,
+        repeat=args.repeat,
+        log=reporter.log,
+    )
+    meta = bench.report_meta(engine.FFMPEG_PATH)
+    for path in args.output or []:
+        bench.write_report(path, results, meta, fields=bench.TONEMAP_REPORT_FIELDS)
+        reporter.log(f"💾 Отчёт: {path}\n")
+    return EXIT_OK if all(row["ok"] for row in results) else EXIT_FAILED
+
+
+def add_conversion_options(p: argparse.ArgumentParser):
+    """Настройки конвертации: общие для convert и watch."""
+    rc = p.add_mutually_exclusive_group()
+    rc.add_argument("--qp", type=int, default=22, help="постоянное качество QP/CRF (по умолчанию 22)")
+    rc.add_argument("--cbr", type=int, metavar="MBPS", help="постоянный битрейт видео, Мбит/с")
+    rc.add_argument(
+        "--target-quality",
+        type=int,
+        metavar="SCORE",
+        help="подобрать CRF под целевую оценку: VMAF 0–100 или SSIM в дБ (17 ≈ 0.98, 20 = 0.99)",
+    )
+    p.add_argument("--metric", choices=engine.QUALITY_METRICS, default="vmaf", help="метрика для --target-quality")
+    p.add_argument("--limit-res", action="store_true", help="ограничить разрешение до 1920×1080")
+    p.add_argument("--tonemap", choices=TONEMAP_MODES, default="auto", help="HDR→SDR: auto, on, off или keep — сохранить HDR (HEVC/AV1, 10 бит)")
+    p.add_argument(
+        "--tonemapper",
+        choices=list(engine.TONEMAPPERS),
+        default=engine.DEFAULT_TONEMAPPER,
+        help="способ тонмаппинга: zscale (эталон), lut (3D LUT, быстрее на CPU), libplacebo, opencl",
+    )
+    p.add_argument("--skip-video", action="store_true", help="не конвертировать видео (copy)")
+    p.add_argument("--skip-audio", action="store_true", help="не конвертировать аудио (copy)")
+    p.add_argument("--no-smart-copy", action="store_true", help="всегда перекодировать, даже подходящие потоки")
+    p.add_argument("--audio-track", type=int, default=0, metavar="N", help="номер аудио-дорожки a:N (по умолчанию 0)")
+    p.add_argument("--subtitles", default="none", metavar="none|all|N,M", help="сохранить текстовые субтитры")
+    p.add_argument("-o", "--output-dir", help="папка для сохранения (по умолчанию рядом с исходным)")
+    p.add_argument("--no-suffix", action="store_true", help="не добавлять суффикс _conv")
+    p.add_argument("--copy-tags", action="store_true", help="копировать MP4-теги исходного файла")
+    p.add_argument("-j", "--jobs", type=int, default=1, help="число одновременных задач")
+    p.add_argument(
+        "--chunked",
+        action="store_true",
+        help="кодировать длинные файлы частями параллельно; прерванное кодирование продолжается с готовых частей",
+    )
+    p.add_argument(
+        "--ladder",
+        metavar="1080p,720p:24,audio",
+        help="несколько выходов за одно декодирование: высоты (source — исходная), :N — своё качество, audio — только звук (.m4a)",
+    )
+    p.add_argument("--chunk-seconds", type=float, default=60.0, help="длина части в секундах (по умолчанию 60)")
+    p.add_argument("--chunk-workers", type=int, help="число одновременно кодируемых частей")
+    p.add_argument(
+        "--encoder",
+        choices=["auto", *engine.ENCODERS],
+        default="auto",
+        help="видеоэнкодер (по умолчанию auto — самый быстрый рабочий)",
+    )
+    p.add_argument(
+        "--codec",
+        choices=list(engine.CODECS),
+        help="выходной видеокодек (по умолчанию h264 или кодек, заданный --encoder)",
+    )
+    p.add_argument("--cpu", action="store_true", help="не проверять аппаратные энкодеры, кодировать на CPU")
+    p.add_argument(
+        "--state",
+        metavar="FILE",
+        help="постоянная очередь (SQLite): после сбоя повторный запуск пропускает готовые файлы и удаляет неполные",
+    )
+    p.add_argument(
+        "--report", action="append", metavar="FILE", help="отчёт о ресурсах задач (.json или .csv), можно несколько"
+    )
+    p.add_argument("--json", action="store_true", help="события прогресса в stdout в формате JSON Lines")
+    p.add_argument("--quiet", action="store_true", help="не выводить лог")
+    p.add_argument("--debug", action="store_true", help="выводить stderr ffmpeg")
+    p.add_argument("--ffmpeg", help="путь к ffmpeg")
+    p.add_argument("--ffprobe", help="путь к ffprobe")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="video-converter", description="Video Converter: headless-режим")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("convert", help="конвертировать файлы в MP4 (H.264/HEVC/AV1 + AAC)")
+    p.add_argument("files", nargs="+", help="исходные файлы")
+    add_conversion_options(p)
+    p.set_defaults(func=cmd_convert)
+
+    w = sub.add_parser("watch", help="следить за папками и конвертировать новые файлы, когда их запись закончена")
+    w.add_argument("folders", nargs="+", help="наблюдаемые папки")
+    w.add_argument("--settle", type=float, default=watcher.DEFAULT_SETTLE_SECONDS, help="сколько секунд файл не должен меняться (по умолчанию 10)")
+    w.add_argument("--recursive", action="store_true", help="следить и за вложенными папками")
+    w.add_argument("--existing", action="store_true", help="конвертировать и файлы, лежащие в папках до запуска")
+    w.add_argument("--extensions", default=",".join(ext.lstrip(".") for ext in watcher.DEFAULT_EXTENSIONS), help="расширения файлов через запятую")
+    w.add_argument("--poll", action="store_true", help="опрос вместо inotify (сетевые папки SMB/NFS, смонтированные на этой машине)")
+    w.add_argument("--poll-interval", type=float, default=watcher.DEFAULT_POLL_INTERVAL, help="период опроса, с (по умолчанию 5)")
+    add_conversion_options(w)
+    w.set_defaults(func=cmd_watch)
+
+    e = sub.add_parser("encoders", help="проверить доступные видеоэнкодеры и их скорость")
+    e.add_argument("--refresh", action="store_true", help="проверить заново, не используя кэш")
+    e.add_argument("--json", action="store_true", help="вывести результат в JSON")
+    e.add_argument("--ffmpeg", help="путь к ffmpeg")
+    e.set_defaults(func=cmd_encoders)
+
+    b = sub.add_parser("benchmark", help="замер скорости кодирования на синтетических источниках")
+    b.add_argument("--patterns", default="testsrc2,mandelbrot", help="источники lavfi (по умолчанию testsrc2,mandelbrot)")
+    b.add_argument("--resolutions", default="720p,1080p", help="разрешения: 480p…2160p или WxH")
+    b.add_argument("--duration", type=float, default=10.0, help="длительность источника, с (по умолчанию 10)")
+    b.add_argument("--fps", type=int, default=30, help="частота кадров источника (по умолчанию 30)")
+    b.add_argument("--encoders", default="auto", help="x264,nvenc,qsv,vaapi,amf,x265,nvenc_hevc,svtav1,nvenc_av1 или auto (все рабочие)")
+    b.add_argument("--x264-presets", default="veryfast,medium,slow", help="пресеты libx264")
+    b.add_argument("--nvenc-presets", default="p1,p4,p7", help="пресеты h264_nvenc")
+    b.add_argument("--modes", default="qp:22,cbr:8", help="режимы: qp:N (QP/CRF) и cbr:N (Мбит/с)")
+    b.add_argument("--bufsizes", default="2M", help="значения -bufsize для CBR")
+    b.add_argument("--repeat", type=int, default=1, help="повторов каждого варианта (в сравнении берётся лучший)")
+    b.add_argument("-o", "--output", action="append", metavar="FILE", help="сохранить отчёт (.json или .csv), можно несколько")
+    b.add_argument("--baseline", metavar="FILE", help="сравнить с ранее сохранённым отчётом")
+    b.add_argument("--threshold", type=float, default=5.0, help="порог регрессии, %% (по умолчанию 5)")
+    b.add_argument("--fail-on-regression", action="store_true", help="код выхода 1 при регрессии относительно baseline")
+    b.add_argument("--quiet", action="store_true", help="не выводить лог")
+    b.add_argument("--ffmpeg", help="путь к ffmpeg")
+    b.set_defaults(func=cmd_benchmark)
+
+    t = sub.add_parser("tonemap-benchmark", help="сравнить способы тонмаппинга HDR→SDR по скорости и SSIM")
+    t.add_argument("--tonemappers", default="auto", help="zscale,lut,libplacebo,opencl или auto (все доступные)")
+    t.add_argument("--resolutions", default="1080p,2160p", help="разрешения: 480p…2160p или WxH")
+    t.add_argument("--duration", type=float, default=5.0, help="длительность источника, с (по умолчанию 5)")
+    t.add_argument("--fps", type=int, default=30, help="частота кадров источника (по умолчанию 30)")
+    t.add_argument("--repeat", type=int, default=1, help="повторов каждого замера скорости")
+    t.add_argument("-o", "--output", action="append", metavar="FILE", help="сохранить отчёт (.json или .csv), можно несколько")
+    t.add_argument("--quiet", action="store_true", help="не выводить лог")
+    t.add_argument("--ffmpeg", help="путь к ffmpeg")
+    t.set_defaults(func=cmd_tonemap_benchmark)
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
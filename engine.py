@@ -0,0 +1,3428 @@
+"""
+Движок конвертации без зависимости от wxPython: анализ файлов (ffprobe),
+сборка аргументов ffmpeg, запуск задач с прогрессом и пул параллельных задач.
+Используется и GUI (main.py), и командной строкой (cli.py).
+"""
+
+import atexit
+import csv
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field, fields, replace
+from fractions import Fraction
+
+from mutagen.mp4 import MP4
+
+from procstats import ProcessMonitor, ProcessStats
+
+
+def get_resource_path(relative_path: str) -> str:
+    """
+    PyInstaller создает временную папку, путь в sys._MEIPASS.
+    В обычном запуске берем текущую папку.
+    """
+    base_path = getattr(sys, "_MEIPASS", os.path.abspath("."))
+    return os.path.join(base_path, relative_path)
+
+
+def find_tool(name: str) -> str:
+    """
+    Путь к внешней программе: сначала копия рядом с программой (name.exe,
+    как в сборке PyInstaller), затем поиск в PATH (headless-узлы Linux).
+    """
+    bundled = get_resource_path(f"{name}.exe")
+    if os.path.isfile(bundled):
+        return bundled
+    return shutil.which(name) or bundled
+
+
+FFMPEG_PATH = find_tool("ffmpeg")
+FFPROBE_PATH = find_tool("ffprobe")
+MPV_PATH = find_tool("mpv")
+
+# Флаг скрытия консоли дочерних процессов существует только в Windows.
+CREATE_NO_WINDOW = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+
+
+def get_ffmpeg_version(ffmpeg_path: str) -> dict:
+    try:
+        result = subprocess.run(
+            [ffmpeg_path, "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, creationflags=CREATE_NO_WINDOW
+        )
+        output = result.stdout
+
+        if not output:
+            output = result.stderr
+
+        ffmpeg_version_match = re.search(r"ffmpeg version ([\w.-]+)", output)
+        ffmpeg_version = ffmpeg_version_match.group(1) if ffmpeg_version_match else "Unknown"
+
+        libavcodec_match = re.search(r"libavcodec\s+(\d+\.\s*\d+\.\s*\d+)", output)
+        libavcodec_version = libavcodec_match.group(1).replace(" ", "") if libavcodec_match else "Unknown"
+
+        return {"ffmpeg": ffmpeg_version, "libavcodec": libavcodec_version}
+    except FileNotFoundError:
+        return "FFmpeg не установлен"
+
+
+def _ffmpeg_listing(ffmpeg_path: str, option: str) -> str:
+    try:
+        result = subprocess.run(
+            [ffmpeg_path, "-hide_banner", option],
+            capture_output=True,
+            text=True,
+            errors="replace",
+            creationflags=CREATE_NO_WINDOW,
+            timeout=20,
+        )
+        return result.stdout
+    except Exception:
+        return ""
+
+
+def list_ffmpeg_encoders(ffmpeg_path: str) -> set[str]:
+    """Имена видеоэнкодеров из `ffmpeg -encoders` (только заявленные сборкой, без проверки железа)."""
+    names = set()
+    for line in _ffmpeg_listing(ffmpeg_path, "-encoders").splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and len(parts[0]) == 6 and parts[0].startswith("V") and parts[1] != "=":
+            names.add(parts[1])
+    return names
+
+
+def list_ffmpeg_hwaccels(ffmpeg_path: str) -> list[str]:
+    """Методы аппаратного ускорения из `ffmpeg -hwaccels`."""
+    lines = _ffmpeg_listing(ffmpeg_path, "-hwaccels").splitlines()
+    return [line.strip() for line in lines[1:] if line.strip()]
+
+
+def encoder_candidates(encoders: set[str], hwaccels: list[str]) -> list["EncoderSpec"]:
+    """Энкодеры из ENCODERS, которые есть в сборке и могут работать на этой ОС."""
+    candidates = []
+    for spec in ENCODERS.values():
+        if spec.name not in encoders:
+            continue
+        if spec.platforms and not sys.platform.startswith(spec.platforms):
+            continue
+        if spec.hwaccel and spec.hwaccel not in hwaccels:
+            continue
+        if spec.kind == "vaapi" and not os.path.exists(VAAPI_DEVICE):
+            continue
+        candidates.append(spec)
+    return candidates
+
+
+def benchmark_encoder(ffmpeg_path: str, encoder: str, seconds: float = 2.0, size: str = "1280x720") -> float | None:
+    """
+    Тестовый прогон энкодера на синтетическом источнике с обычными настройками
+    (QP 23). Возвращает скорость в кадрах/с или None, если энкодер не работает
+    (нет видеокарты, драйвера, сессий NVENC и т. п.).
+    """
+    rate = 30
+    cmd = [
+        ffmpeg_path,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        *encoder_input_args(encoder),
+        "-f",
+        "lavfi",
+        "-i",
+        f"testsrc2=size={size}:rate={rate}",
+        "-t",
+        f"{seconds:g}",
+        *build_video_args("", {"requires_tonemap": False, "hdr_type": "SDR"}, False, 0, 23, False, 2, encoder),
+        "-f",
+        "null",
+        "-",
+    ]
+    started = time.monotonic()
+    try:
+        result = subprocess.run(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            creationflags=CREATE_NO_WINDOW,
+            timeout=60,
+        )
+    except Exception:
+        return None
+    elapsed = time.monotonic() - started
+    if result.returncode != 0 or elapsed <= 0:
+        return None
+    return round(seconds * rate / elapsed, 1)
+
+
+def copy_mp4_tags(source_path: str, dest_path: str) -> tuple[bool, str]:
+    """
+    Копирует MP4-теги из исходного файла в выходной.
+    Возвращает (успех, текст_ошибки); текст ошибки пустой при успехе.
+    """
+    try:
+        video = MP4(source_path)
+        new_video = MP4(dest_path)
+        for tag in video.tags:
+            new_video.tags[tag] = video.tags[tag]
+        new_video.save()
+        return True, ""
+    except Exception as e:
+        return False, str(e)
+
+
+def fix_text_encoding(text: str) -> str:
+    """
+    Чинит частый случай mojibake: текст в UTF-8, ошибочно прочитанный как cp1251.
+    Возвращает исходную строку, если перекодировка не нужна или невозможна.
+    """
+    try:
+        repaired = text.encode("cp1251").decode("utf-8")
+    except Exception:
+        return text
+    if any(marker in text for marker in ("Ð", "Ñ", "Â", "Ã")) and repaired:
+        return repaired
+    return text
+
+
+def format_time(seconds: float) -> str:
+    m, s = divmod(int(seconds), 60)
+    h, m = divmod(m, 60)
+    return f"{h:02d}:{m:02d}:{s:02d}"
+
+
+def human_size(num_bytes: int) -> str:
+    try:
+        num = float(num_bytes)
+    except Exception:
+        return "?"
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if num < 1024.0:
+            return f"{num:.1f} {unit}" if unit != "B" else f"{int(num)} {unit}"
+        num /= 1024.0
+    return f"{num:.1f} PB"
+
+
+# --- Определение битрейта по количеству каналов ---
+def get_audio_bitrate(channels: int) -> str:
+    if channels <= 1:
+        return "128k"
+    if channels == 2:
+        return "192k"
+    if channels <= 6:
+        return "384k"
+    if channels >= 8:
+        return "512k"
+    return "256k"
+
+
+def get_app_data_dir() -> str:
+    """
+    Папка для служебных файлов приложения (кэши и т.п.) в профиле пользователя:
+    %LOCALAPPDATA%\\video_converter в Windows, ~/.cache/video_converter в остальных ОС.
+    """
+    if sys.platform.startswith("win"):
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    path = os.path.join(base, "video_converter")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class ProbeCache:
+    """
+    Постоянный кэш результатов ffprobe (SQLite в профиле пользователя).
+
+    Запись действительна, пока у файла не изменились абсолютный путь, размер
+    и mtime_ns. При превышении max_entries вытесняются давно не использованные
+    записи (LRU). Любая ошибка базы отключает кэш, но не ломает анализ файлов.
+    Последние memory_entries результатов дополнительно держатся в памяти,
+    чтобы повторный разбор при запуске задачи не обращался ни к базе, ни к ffprobe.
+
+    База открывается при первом обращении (db_path=None — probe_cache.sqlite3
+    в папке приложения), так что импорт модуля не создаёт ни папок, ни файлов.
+    Отметки last_used у попаданий копятся в памяти и пишутся пачкой (flush()):
+    иначе каждое попадание стоило бы отдельной транзакции.
+    """
+
+    TOUCH_BATCH = 256
+
+    def __init__(self, db_path: str | None = None, max_entries: int = 20000, memory_entries: int = 512):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory: OrderedDict[tuple[str, int, int], dict] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._opened = False
+        # путь → время последнего попадания, ещё не записанное в базу
+        self._touched: dict[str, float] = {}
+
+    def _open(self) -> sqlite3.Connection | None:
+        """Соединение с базой, при первом вызове — открытие (только под _lock)."""
+        if self._opened:
+            return self._conn
+        self._opened = True
+        try:
+            if self.db_path is None:
+                self.db_path = os.path.join(get_app_data_dir(), "probe_cache.sqlite3")
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5)
+            # кэш можно потерять: при сбое питания достаточно целостности базы, без fsync на каждый commit
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS probe_cache ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, data TEXT, last_used REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS probe_cache_last_used ON probe_cache(last_used)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS quality_cache ("
+                "path TEXT, params TEXT, size INTEGER, mtime_ns INTEGER, data TEXT, last_used REAL, "
+                "PRIMARY KEY (path, params))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS capability_cache ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, data TEXT, created REAL)"
+            )
+            self._conn.commit()
+            atexit.register(self.flush)
+        except Exception:
+            self._conn = None
+        return self._conn
+
+    def _write_touched(self):
+        """Записывает накопленные last_used (под _lock, без commit)."""
+        if self._touched:
+            touched, self._touched = self._touched, {}
+            self._conn.executemany("UPDATE probe_cache SET last_used=? WHERE path=?", [(t, p) for p, t in touched.items()])
+
+    def flush(self):
+        """Сохраняет накопленные отметки использования (после пачки анализов и при выходе)."""
+        with self._lock:
+            if not self._touched or self._conn is None:
+                return
+            try:
+                self._write_touched()
+                self._conn.commit()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _file_key(filepath: str) -> tuple[str, int, int] | None:
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return None
+        return os.path.normcase(os.path.abspath(filepath)), st.st_size, st.st_mtime_ns
+
+    def _remember(self, key: tuple[str, int, int], probe: dict):
+        self._memory[key] = probe
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, filepath: str) -> dict | None:
+        key = self._file_key(filepath)
+        with self._lock:
+            if key is not None and key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+            if key is None or self._open() is None:
+                self.misses += 1
+                return None
+            try:
+                row = self._conn.execute(
+                    "SELECT data FROM probe_cache WHERE path=? AND size=? AND mtime_ns=?", key
+                ).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                self._touched[key[0]] = time.time()
+                if len(self._touched) >= self.TOUCH_BATCH:
+                    self._write_touched()
+                    self._conn.commit()
+                self.hits += 1
+                probe = json.loads(row[0])
+                self._remember(key, probe)
+                return probe
+            except Exception:
+                self.misses += 1
+                return None
+
+    def put(self, filepath: str, probe: dict):
+        key = self._file_key(filepath)
+        if not probe or key is None:
+            return
+        with self._lock:
+            self._remember(key, probe)
+            if self._open() is None:
+                return
+            try:
+                # до вытеснения: свежие попадания не должны выглядеть давно не использованными
+                self._write_touched()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO probe_cache (path, size, mtime_ns, data, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (*key, json.dumps(probe, ensure_ascii=False), time.time()),
+                )
+                self._conn.execute(
+                    "DELETE FROM probe_cache WHERE path IN ("
+                    "SELECT path FROM probe_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                self._conn.commit()
+            except Exception:
+                pass
+
+    def stats(self) -> tuple[int, int]:
+        """(попадания, промахи) с момента запуска."""
+        with self._lock:
+            return self.hits, self.misses
+
+    def get_capabilities(self, tool_path: str, max_age: float) -> dict | None:
+        """Сохранённые возможности ffmpeg (см. detect_capabilities), если бинарник не менялся и запись не старше max_age."""
+        key = self._file_key(tool_path)
+        with self._lock:
+            if key is None or self._open() is None:
+                return None
+            try:
+                row = self._conn.execute(
+                    "SELECT data FROM capability_cache WHERE path=? AND size=? AND mtime_ns=? AND created>=?",
+                    (*key, time.time() - max_age),
+                ).fetchone()
+                return json.loads(row[0]) if row else None
+            except Exception:
+                return None
+
+    def put_capabilities(self, tool_path: str, capabilities: dict):
+        key = self._file_key(tool_path)
+        if key is None:
+            return
+        with self._lock:
+            if self._open() is None:
+                return
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO capability_cache (path, size, mtime_ns, data, created) VALUES (?, ?, ?, ?, ?)",
+                    (*key, json.dumps(capabilities, ensure_ascii=False), time.time()),
+                )
+                self._conn.commit()
+            except Exception:
+                pass
+
+    def get_quality(self, filepath: str, params: str) -> dict | None:
+        """Результат подбора качества для файла и набора параметров (см. quality_search_params)."""
+        key = self._file_key(filepath)
+        with self._lock:
+            if key is None or self._open() is None:
+                return None
+            try:
+                row = self._conn.execute(
+                    "SELECT data FROM quality_cache WHERE path=? AND params=? AND size=? AND mtime_ns=?",
+                    (key[0], params, key[1], key[2]),
+                ).fetchone()
+                if row is None:
+                    return None
+                self._conn.execute(
+                    "UPDATE quality_cache SET last_used=? WHERE path=? AND params=?", (time.time(), key[0], params)
+                )
+                self._conn.commit()
+                return json.loads(row[0])
+            except Exception:
+                return None
+
+    def put_quality(self, filepath: str, params: str, result: dict):
+        key = self._file_key(filepath)
+        if key is None:
+            return
+        with self._lock:
+            if self._open() is None:
+                return
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO quality_cache (path, params, size, mtime_ns, data, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key[0], params, key[1], key[2], json.dumps(result), time.time()),
+                )
+                self._conn.execute(
+                    "DELETE FROM quality_cache WHERE rowid IN ("
+                    "SELECT rowid FROM quality_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                self._conn.commit()
+            except Exception:
+                pass
+
+
+PROBE_CACHE = ProbeCache()
+
+# Наличие NVENC зависит ещё и от видеокарты/драйвера, поэтому кэш не вечный.
+CAPABILITIES_MAX_AGE = 7 * 24 * 3600
+
+
+def detect_capabilities(ffmpeg_path: str, use_cache: bool = True) -> dict:
+    """
+    Возможности ffmpeg:
+        {"version": {...} или None, "hwaccels": [...],
+         "encoders": [{"name", "codec", "kind", "fps"}, ...] — только рабочие, быстрые первыми,
+         "codecs": [...] — проверенные кодеки, "tonemappers": [...] — доступные способы
+         тонмаппинга (TONEMAPPERS), "nvenc": bool, "cached": bool}.
+
+    Кандидаты берутся из `ffmpeg -encoders` / `-hwaccels`, каждый проверяется
+    коротким тестовым кодированием с замером скорости (по очереди, чтобы прогоны
+    не мешали друг другу). Результат запоминается в PROBE_CACHE по пути, размеру
+    и mtime бинарника, так что повторный запуск обходится без дочерних процессов.
+    Вызывать из фонового потока: холодная проверка занимает несколько секунд.
+    """
+    if use_cache and PROBE_CACHE is not None:
+        cached = PROBE_CACHE.get_capabilities(ffmpeg_path, CAPABILITIES_MAX_AGE)
+        # записи, сделанные до появления новых кодеков, проверяются заново
+        if cached is not None and cached.get("codecs") == list(CODECS) and "tonemappers" in cached:
+            return {**cached, "cached": True}
+
+    with ThreadPoolExecutor(max_workers=3, thread_name_prefix="caps") as pool:
+        version_future = pool.submit(get_ffmpeg_version, ffmpeg_path)
+        encoders_future = pool.submit(list_ffmpeg_encoders, ffmpeg_path)
+        hwaccels_future = pool.submit(list_ffmpeg_hwaccels, ffmpeg_path)
+        version = version_future.result()
+        hwaccels = hwaccels_future.result()
+        candidates = encoder_candidates(encoders_future.result(), hwaccels)
+
+    working = []
+    for spec in candidates:
+        fps = benchmark_encoder(ffmpeg_path, spec.name)
+        if fps is not None:
+            working.append({"name": spec.name, "codec": spec.codec, "kind": spec.kind, "fps": fps})
+    working.sort(key=lambda e: e["fps"], reverse=True)
+
+    capabilities = {
+        "version": version if isinstance(version, dict) else None,
+        "hwaccels": hwaccels,
+        "encoders": working,
+        "codecs": list(CODECS),
+        "tonemappers": detect_tonemappers(ffmpeg_path),
+        "nvenc": any(e["kind"] == "nvenc" for e in working),
+    }
+    if capabilities["version"] is not None and PROBE_CACHE is not None:
+        PROBE_CACHE.put_capabilities(ffmpeg_path, capabilities)
+    return {**capabilities, "cached": False}
+
+
+def select_encoder(capabilities: dict, codec: str = "h264", preferred: str | None = None) -> tuple[str, float | None]:
+    """
+    Энкодер для кодека: preferred, если он рабочий, иначе самый быстрый
+    из проверенных, иначе программный (CPU_ENCODERS). Возвращает (имя, fps теста или None).
+    """
+    working = [e for e in capabilities.get("encoders") or [] if e["codec"] == codec]
+    for entry in working:
+        if preferred and entry["name"] == preferred:
+            return entry["name"], entry["fps"]
+    if working:
+        fastest = max(working, key=lambda e: e["fps"])
+        return fastest["name"], fastest["fps"]
+    return CPU_ENCODERS[codec], None
+
+
+def describe_encoders(capabilities: dict) -> str:
+    """Строка для лога: рабочие энкодеры и их скорость в тесте."""
+    entries = capabilities.get("encoders") or []
+    if not entries:
+        return "нет рабочих энкодеров"
+    return ", ".join(f"{e['name']} {e['fps']:.0f} fps" for e in entries)
+
+
+def run_ffprobe_json(args: list[str]) -> dict:
+    """
+    Унифицированный вызов ffprobe, возвращает JSON dict (или {}).
+    Консоль НЕ скрываем.
+    """
+    try:
+        p = subprocess.run(
+            args,
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            check=True,
+            creationflags=CREATE_NO_WINDOW,
+        )
+        if not p.stdout.strip():
+            return {}
+        return json.loads(p.stdout)
+    except Exception:
+        return {}
+
+
+def probe_media(filepath: str) -> dict:
+    """
+    Один вызов ffprobe со всеми потоками и форматом.
+    Возвращает полный JSON (или {}); результат можно разобрать
+    функциями parse_* без повторных запусков ffprobe.
+    Сначала проверяется постоянный кэш PROBE_CACHE.
+    """
+    if PROBE_CACHE is not None:
+        cached = PROBE_CACHE.get(filepath)
+        if cached is not None:
+            return cached
+
+    probe = run_ffprobe_json([
+        FFPROBE_PATH,
+        "-v",
+        "error",
+        "-show_streams",
+        "-show_format",
+        "-of",
+        "json",
+        filepath,
+    ])
+    if PROBE_CACHE is not None:
+        PROBE_CACHE.put(filepath, probe)
+    return probe
+
+
+def _streams_of_type(probe: dict, codec_type: str) -> list[dict]:
+    """Потоки заданного типа (audio/video/subtitle) в порядке контейнера."""
+    return [s for s in (probe.get("streams") or []) if s.get("codec_type") == codec_type]
+
+
+def parse_audio_streams(probe: dict) -> list[dict]:
+    """
+    Структурированные описания аудио-стримов в порядке a:0, a:1...:
+    order, index, codec, channels, bit_rate (бит/с или None), language, title.
+    """
+    streams: list[dict] = []
+    for order, stream in enumerate(_streams_of_type(probe, "audio")):
+        tags = stream.get("tags", {}) or {}
+        try:
+            channels = int(stream.get("channels")) if stream.get("channels") else None
+        except (TypeError, ValueError):
+            channels = None
+        try:
+            bit_rate = int(stream.get("bit_rate")) if stream.get("bit_rate") else None
+        except (TypeError, ValueError):
+            bit_rate = None
+        streams.append({
+            "order": order,
+            "index": stream.get("index", "?"),
+            "codec": stream.get("codec_name", "?"),
+            "channels": channels,
+            "bit_rate": bit_rate,
+            "language": tags.get("language", "und"),
+            "title": fix_text_encoding((tags.get("title") or "").strip()),
+        })
+    return streams
+
+
+def parse_audio_tracks(probe: dict) -> list[str]:
+    """
+    Возвращает список строк для Choice по разобранному ffprobe-JSON.
+    Важно: stream.index у ffprobe — это индекс потока в контейнере (может быть 1,2,3...),
+    а выбор у пользователя будет 0..N-1 (порядок аудио-стримов).
+    Мы показываем stream.index в тексте, но мапим по порядку (a:0, a:1...).
+    """
+    tracks: list[str] = []
+    for stream in parse_audio_streams(probe):
+        ch = stream["channels"] if stream["channels"] is not None else "?"
+        br_kbps = int(stream["bit_rate"] / 1000) if stream["bit_rate"] else "?"
+
+        desc_parts = [f"{stream['index']}: {stream['codec']}", f"{ch}ch", f"{br_kbps} kbps", stream["language"]]
+        if stream["title"]:
+            desc_parts.append(f"«{stream['title']}»")
+
+        desc = " (" + ", ".join(desc_parts[1:]) + ")"
+        tracks.append(f"{desc_parts[0]}{desc}")
+
+    return tracks
+
+
+def get_audio_tracks(filepath: str) -> list[str]:
+    return parse_audio_tracks(probe_media(filepath))
+
+
+def parse_subtitle_tracks(probe: dict) -> list[dict]:
+    """
+    Возвращает субтитры в порядке s:0, s:1... по разобранному ffprobe-JSON.
+    Для MP4 сохраняем только текстовые дорожки, которые ffmpeg умеет
+    перекодировать в mov_text.
+    """
+    text_codecs = {
+        "subrip",
+        "ass",
+        "ssa",
+        "webvtt",
+        "mov_text",
+        "text",
+    }
+
+    tracks: list[dict] = []
+    for subtitle_order, stream in enumerate(_streams_of_type(probe, "subtitle")):
+        idx = stream.get("index", "?")
+        codec = stream.get("codec_name", "?")
+        tags = stream.get("tags", {}) or {}
+        lang = tags.get("language", "und")
+        title_raw = (tags.get("title") or "").strip()
+        title = fix_text_encoding(title_raw)
+        supported = str(codec).lower() in text_codecs
+
+        desc_parts = [f"{idx}: {codec}", lang]
+        if title:
+            desc_parts.append(f"«{title}»")
+        if not supported:
+            desc_parts.append("не для MP4")
+
+        tracks.append({
+            "order": subtitle_order,
+            "codec": codec,
+            "language": lang,
+            "title": title,
+            "supported": supported,
+            "display": f"{desc_parts[0]} (" + ", ".join(desc_parts[1:]) + ")",
+        })
+
+    return tracks
+
+
+def get_subtitle_tracks(filepath: str) -> list[dict]:
+    return parse_subtitle_tracks(probe_media(filepath))
+
+
+def get_audio_channels(input_file: str, selected_track: int) -> int:
+    """
+    selected_track — это порядковый номер аудио-стрима среди аудио (a:0, a:1...),
+    то есть именно то, что Choice.GetSelection() возвращает.
+    Берётся из общего (кэшируемого) анализа файла, отдельный ffprobe не запускается.
+    """
+    streams = parse_audio_streams(probe_media(input_file))
+    if 0 <= selected_track < len(streams):
+        return streams[selected_track]["channels"] or 2
+    return 2
+
+
+def _side_data(side_data: list, kind: str) -> dict | None:
+    for item in side_data:
+        if isinstance(item, dict) and kind in str(item.get("side_data_type", "")).lower():
+            return item
+    return None
+
+
+def _fraction(value) -> float | None:
+    """ffprobe пишет координаты и яркость дробями ("35400/50000")."""
+    try:
+        return float(Fraction(str(value)))
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def _parse_mastering_display(side_data: list) -> dict | None:
+    """Mastering display (SMPTE ST 2086): координаты цветности основных цветов и белой точки, яркость в кд/м²."""
+    item = _side_data(side_data, "mastering display")
+    if item is None:
+        return None
+    keys = ("red_x", "red_y", "green_x", "green_y", "blue_x", "blue_y", "white_point_x", "white_point_y", "min_luminance", "max_luminance")
+    values = {key: _fraction(item.get(key)) for key in keys}
+    if any(value is None for value in values.values()):
+        return None
+    return values
+
+
+def _parse_content_light(side_data: list) -> dict | None:
+    """Content light level (CTA-861.3): MaxCLL и MaxFALL в кд/м²."""
+    item = _side_data(side_data, "content light level")
+    if item is None:
+        return None
+    try:
+        return {"max_content": int(item.get("max_content") or 0), "max_average": int(item.get("max_average") or 0)}
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_hdr_info(probe: dict) -> dict:
+    """
+    Упрощённый HDR анализ по первому видеопотоку из разобранного ffprobe-JSON.
+    """
+    result = {
+        "is_hdr": False,
+        "type": "SDR",
+        "requires_tonemap": False,
+        "pix_fmt": "?",
+        "color_transfer": "",
+        "color_primaries": "",
+        "color_space": "",
+        "dolby_profile": None,
+        "mastering_display": None,
+        "content_light": None,
+    }
+
+    streams = _streams_of_type(probe, "video")
+    if not streams:
+        return result
+
+    stream = streams[0]
+    tags = stream.get("tags", {}) or {}
+
+    color_primaries = (stream.get("color_primaries") or "").lower()
+    color_transfer = (stream.get("color_transfer") or "").lower()
+    color_space = (stream.get("color_space") or "").lower()
+    pix_fmt = stream.get("pix_fmt") or "?"
+
+    side_data = stream.get("side_data_list", []) or []
+    result.update({
+        "pix_fmt": pix_fmt,
+        "color_transfer": color_transfer,
+        "color_primaries": color_primaries,
+        "color_space": color_space,
+        "mastering_display": _parse_mastering_display(side_data),
+        "content_light": _parse_content_light(side_data),
+    })
+
+    # Dolby Vision (очень приблизительно)
+    dv_profile = None
+    for k, v in tags.items():
+        ks = str(k).lower()
+        vs = str(v).lower()
+        if "dolby" in ks or "dv" in ks:
+            if "profile" in vs or vs.isdigit():
+                dv_profile = v
+                break
+
+    if dv_profile:
+        result["is_hdr"] = True
+        result["type"] = f"Dolby Vision (P{dv_profile})"
+        result["dolby_profile"] = dv_profile
+        result["requires_tonemap"] = True
+        return result
+
+    if any("hdr10plus" in str(d).lower() for d in side_data):
+        result["is_hdr"] = True
+        result["type"] = "HDR10+"
+        result["requires_tonemap"] = True
+        return result
+
+    if "smpte2084" in color_transfer:
+        result["is_hdr"] = True
+        result["type"] = "HDR10 / PQ"
+        result["requires_tonemap"] = True
+    elif "arib-std-b67" in color_transfer or "hlg" in color_transfer:
+        result["is_hdr"] = True
+        result["type"] = "HLG"
+        result["requires_tonemap"] = False
+    elif "bt2020" in color_primaries:
+        result["is_hdr"] = True
+        result["type"] = "BT.2020 SDR"
+        result["requires_tonemap"] = False
+    else:
+        result["is_hdr"] = False
+        result["type"] = "SDR"
+        result["requires_tonemap"] = False
+
+    return result
+
+
+def get_hdr_info(file_path: str) -> dict:
+    return parse_hdr_info(probe_media(file_path))
+
+
+def parse_video_info(probe: dict) -> dict:
+    """Сводная информация о первом видеопотоке и контейнере из разобранного ffprobe-JSON."""
+    info = {
+        "codec": "?",
+        "width": "?",
+        "height": "?",
+        "fps": "?",
+        "aspect": "?",
+        "bitrate": "?",
+        "hdr_type": "SDR",
+        "requires_tonemap": False,
+        "duration": 0.0,
+        "size": 0,
+        "pix_fmt": "?",
+        "bit_rate": None,
+    }
+
+    videos = _streams_of_type(probe, "video")
+    stream = videos[0] if videos else {}
+    fmt = probe.get("format") or {}
+
+    info["codec"] = stream.get("codec_name", "?")
+    info["width"] = stream.get("width", "?")
+    info["height"] = stream.get("height", "?")
+    info["aspect"] = stream.get("display_aspect_ratio", "?")
+    info["size"] = int(fmt.get("size") or 0)
+    info["pix_fmt"] = stream.get("pix_fmt") or "?"
+
+    # FPS
+    fps_raw = stream.get("r_frame_rate", "0/0")
+    try:
+        num, den = fps_raw.split("/")
+        info["fps"] = round(float(num) / float(den), 2) if float(den) != 0 else "?"
+    except Exception:
+        info["fps"] = "?"
+
+    # bitrate
+    br = stream.get("bit_rate") or fmt.get("bit_rate")
+    if br:
+        try:
+            info["bit_rate"] = int(br)
+            info["bitrate"] = f"{int(br) / 1_000_000:.2f} Мбит/с"
+        except Exception:
+            info["bitrate"] = "?"
+    else:
+        info["bitrate"] = "?"
+
+    # duration
+    try:
+        info["duration"] = float(fmt.get("duration") or 0.0)
+    except Exception:
+        info["duration"] = 0.0
+
+    hdr = parse_hdr_info(probe)
+    info["hdr_type"] = hdr["type"]
+    info["requires_tonemap"] = bool(hdr["requires_tonemap"])
+    # сигнализация цвета и метаданные HDR — для режима сохранения HDR
+    for key in ("color_primaries", "color_transfer", "color_space", "mastering_display", "content_light"):
+        info[key] = hdr[key]
+
+    return info
+
+
+def get_video_info(filepath: str) -> dict:
+    return parse_video_info(probe_media(filepath))
+
+
+def _no_log(text: str):
+    pass
+
+
+def output_dir_for(save_folder: str | None, input_path: str) -> str:
+    """Папка результата: save_folder, если она существует, иначе папка исходного файла."""
+    return save_folder if save_folder and os.path.isdir(save_folder) else os.path.dirname(input_path)
+
+
+def unique_output_path(
+    save_folder: str,
+    input_path: str,
+    add_conv_suffix: bool = True,
+    output_ext: str = ".mp4",
+    reserved: set[str] | None = None,
+    name_suffix: str = "",
+) -> str:
+    """
+    Возвращает уникальный путь для выходного файла.
+
+    :param save_folder: Папка для сохранения. Если не существует или пустая,
+                        файл создаётся рядом с input_path.
+    :param input_path: Путь к исходному файлу.
+    :param add_conv_suffix: Добавлять ли суффикс "_conv" к имени файла.
+    :param output_ext: Расширение выходного файла, по умолчанию ".mp4".
+    :param reserved: Пути, уже занятые параллельными задачами (файлы ещё не созданы).
+    :param name_suffix: Дополнительный суффикс имени (выход лесенки: "720p", "audio").
+    :return: Уникальный путь к выходному файлу.
+    """
+    reserved = reserved or set()
+    input_name = os.path.splitext(os.path.basename(input_path))[0]
+    target_dir = output_dir_for(save_folder, input_path)
+
+    base_name = f"{input_name}_conv" if add_conv_suffix else input_name
+    if name_suffix:
+        base_name = f"{base_name}_{name_suffix}"
+    out_path = os.path.join(target_dir, f"{base_name}{output_ext}")
+
+    if not os.path.exists(out_path) and out_path not in reserved:
+        return out_path
+
+    n = 2
+    while True:
+        candidate = os.path.join(target_dir, f"{base_name}_{n}{output_ext}")
+        if not os.path.exists(candidate) and candidate not in reserved:
+            return candidate
+        n += 1
+
+
+PART_MARKER = ".vcpart"
+CHUNKS_PREFIX = ".vc_chunks_"
+STALE_PART_SECONDS = 6 * 3600
+# рабочие папки режима «по частям» — контрольные точки для продолжения, живут дольше
+STALE_CHUNKS_SECONDS = 7 * 24 * 3600
+
+
+def part_path_for(output_path: str) -> str:
+    """Временный файл, в который пишет ffmpeg: name.vcpart.mp4 рядом с итоговым."""
+    root, ext = os.path.splitext(output_path)
+    return f"{root}{PART_MARKER}{ext}"
+
+
+def reserve_output_path(
+    save_folder: str | None,
+    input_path: str,
+    add_conv_suffix: bool = True,
+    output_ext: str = ".mp4",
+    name_suffix: str = "",
+) -> str:
+    """
+    Как unique_output_path, но имя занимается атомарно: временный файл
+    part_path_for(имя) создаётся пустым с O_CREAT | O_EXCL. Такой файл может
+    создать только один процесс, поэтому задачи в соседних потоках, процессах и
+    на других машинах (общая сетевая папка) не получат одно и то же имя. Под
+    итоговым именем ничего не появляется, пока готовый файл не заменит
+    временный через os.replace.
+    """
+    taken: set[str] = set()
+    while True:
+        candidate = unique_output_path(save_folder, input_path, add_conv_suffix, output_ext, reserved=taken, name_suffix=name_suffix)
+        part = part_path_for(candidate)
+        try:
+            fd = os.open(part, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            taken.add(candidate)
+            continue
+        os.close(fd)
+        if os.path.exists(candidate):
+            # другая задача успела закончить под этим именем между проверкой и созданием
+            os.remove(part)
+            taken.add(candidate)
+            continue
+        return candidate
+
+
+def discard_output(output_path: str) -> bool:
+    """
+    Удаляет временный файл задачи, а вместе с ним и резервирование имени.
+    True — файл был и удалён.
+    """
+    part = part_path_for(output_path)
+    if not os.path.exists(part):
+        return False
+    os.remove(part)
+    return True
+
+
+def checkpoint_key(input_path: str, encode_args: list[str], chunk_seconds: float) -> str:
+    """
+    Имя контрольной точки кодирования частями: исходный файл (путь, размер,
+    mtime) и всё, что влияет на результат частей. Другие настройки или
+    изменённый исходник дают другую папку, и чужие части не подхватываются.
+    """
+    try:
+        st = os.stat(input_path)
+        signature = [st.st_size, st.st_mtime_ns]
+    except OSError:
+        signature = []
+    data = json.dumps([os.path.normcase(os.path.abspath(input_path)), *signature, encode_args, chunk_seconds])
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]
+
+
+def cleanup_orphaned_parts(
+    folder: str, max_age: float = STALE_PART_SECONDS, log=_no_log, chunks_max_age: float = STALE_CHUNKS_SECONDS
+) -> int:
+    """
+    Удаляет остатки прерванных запусков (сбой, выключение питания): временные
+    *.vcpart.* старше max_age (в общей папке их может прямо сейчас писать другой
+    процесс) и рабочие папки .vc_chunks_* старше chunks_max_age (по ним
+    продолжается прерванное кодирование частями). Пустой *.vcpart.* — это
+    резервирование имени, которое держится весь подбор качества и кодирование
+    частями, поэтому для него срок тоже chunks_max_age.
+    Возвращает число удалённых объектов.
+    """
+    removed = 0
+    now = time.time()
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        age = chunks_max_age if entry.name.startswith(CHUNKS_PREFIX) or st.st_size == 0 else max_age
+        if st.st_mtime > now - age:
+            continue
+        try:
+            if entry.name.startswith(CHUNKS_PREFIX) and entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
+            elif PART_MARKER in entry.name and entry.is_file():
+                root, ext = os.path.splitext(entry.path)
+                if not root.endswith(PART_MARKER):
+                    continue
+                discard_output(root[: -len(PART_MARKER)] + ext)
+            else:
+                continue
+            removed += 1
+            log(f"🗑 Удалён брошенный временный файл: {entry.name}\n")
+        except OSError as e:
+            log(f"⚠ Не удалось удалить {entry.path}: {e}\n")
+    return removed
+
+
+class FfmpegProgressParser:
+    """
+    Разбор машиночитаемого прогресса ffmpeg (-progress pipe:1).
+
+    ffmpeg пишет блоки строк key=value; каждый блок заканчивается строкой
+    progress=continue или progress=end. feed() копит строки и на последней
+    строке блока возвращает разобранный словарь:
+    time (сек), frame, fps, speed, size (байт), bitrate (кбит/с), end.
+    Неизвестные или «N/A» значения возвращаются как None.
+    """
+
+    def __init__(self):
+        self._block: dict[str, str] = {}
+
+    def feed(self, line: str) -> dict | None:
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            return None
+        self._block[key] = value.strip()
+        if key != "progress":
+            return None
+        block, self._block = self._block, {}
+        return self.parse_block(block)
+
+    @staticmethod
+    def _number(value: str | None, suffix: str = "") -> float | None:
+        if not value:
+            return None
+        if suffix and value.endswith(suffix):
+            value = value[: -len(suffix)]
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+    @classmethod
+    def parse_block(cls, block: dict[str, str]) -> dict:
+        # out_time_ms исторически тоже в микросекундах
+        out_time_us = cls._number(block.get("out_time_us"))
+        if out_time_us is None:
+            out_time_us = cls._number(block.get("out_time_ms"))
+        size = cls._number(block.get("total_size"))
+        frame = cls._number(block.get("frame"))
+        return {
+            "time": out_time_us / 1_000_000 if out_time_us is not None else None,
+            "frame": int(frame) if frame is not None else None,
+            "fps": cls._number(block.get("fps")),
+            "speed": cls._number(block.get("speed"), "x"),
+            "size": int(size) if size is not None else None,
+            "bitrate": cls._number(block.get("bitrate"), "kbits/s"),
+            "end": block.get("progress") == "end",
+        }
+
+
+@dataclass
+class RowSettings:
+    """
+    Настройки кодирования строки.
+
+    is_global=True означает «использовать текущие настройки панели управления»;
+    в этом случае остальные поля игнорируются. Поле quality — значение слайдера:
+    QP (encode_mode=0), битрейт в Мбит/с (encode_mode=1) или целевая оценка
+    качества (encode_mode=2): VMAF 0–100 либо SSIM в дБ, по quality_metric.
+    smart_copy разрешает автоматически копировать потоки, которые уже
+    соответствуют выходному формату. codec — выходной видеокодек (см. CODECS),
+    tonemapping — режим HDR→SDR (см. TONEMAP_MODES и decide_tonemap),
+    tonemapper — способ тонмаппинга (см. TONEMAPPERS).
+    """
+
+    is_global: bool = True
+    encode_mode: int = 0
+    quality: int = 22
+    limit_res: bool = False
+    tonemapping: int = 0
+    skip_video: bool = False
+    skip_audio: bool = False
+    smart_copy: bool = True
+    quality_metric: str = "vmaf"
+    codec: str = "h264"
+    tonemapper: str = "zscale"
+
+
+# --- Видеокодеки и энкодеры ---
+DEFAULT_NVENC_PRESET = "p4"
+DEFAULT_X264_PRESET = "medium"
+DEFAULT_SVTAV1_PRESET = "8"
+DEFAULT_BUFSIZE = "2M"
+VAAPI_DEVICE = "/dev/dri/renderD128"
+
+
+@dataclass(frozen=True)
+class CodecSpec:
+    """
+    Выходной видеокодек.
+
+    profile / profile_10bit — значение -profile:v для 8- и 10-битного кодирования
+    (None — профиль выбирает энкодер); max_bit_depth=10 разрешает сохранять
+    10-битный исходник без понижения до 8 бит. tag — -tag:v в MP4 (hvc1 нужен
+    плеерам Apple). strip_captions — удалять SEI со скрытыми субтитрами: только
+    для H.264, в HEVC тот же тип NAL-блока означает совсем другое.
+    """
+
+    name: str
+    label: str
+    profile: str | None = None
+    profile_10bit: str | None = None
+    max_bit_depth: int = 8
+    tag: str | None = None
+    strip_captions: bool = False
+
+
+CODECS: dict[str, CodecSpec] = {
+    spec.name: spec
+    for spec in (
+        CodecSpec("h264", "H.264", profile="high", strip_captions=True),
+        CodecSpec("hevc", "HEVC", profile="main", profile_10bit="main10", max_bit_depth=10, tag="hvc1"),
+        CodecSpec("av1", "AV1", max_bit_depth=10),
+    )
+}
+
+
+def get_codec_spec(codec: str) -> CodecSpec:
+    try:
+        return CODECS[codec]
+    except KeyError:
+        raise ValueError(f"неизвестный кодек: {codec}") from None
+
+
+@dataclass(frozen=True)
+class EncoderSpec:
+    """
+    Видеоэнкодер ffmpeg и условия его запуска.
+
+    hwaccel — метод из `ffmpeg -hwaccels`, без которого энкодер не заработает;
+    platforms — префиксы sys.platform (пусто — любая ОС). global_args ставятся
+    перед -i, upload_filter дописывается в конец -vf; pix_fmt=None означает,
+    что формат кадров задаёт сам фильтр (кадры уже в памяти GPU). Поля *_10bit —
+    то же для 10-битного кодирования. qp_max — верхняя граница шкалы QP/CRF
+    энкодера: значение слайдера (шкала H.264, 0–51) пересчитывается в неё.
+    """
+
+    name: str
+    codec: str
+    kind: str
+    label: str
+    hwaccel: str | None = None
+    platforms: tuple[str, ...] = ()
+    global_args: tuple[str, ...] = ()
+    upload_filter: str = ""
+    upload_filter_10bit: str = ""
+    pix_fmt: str | None = "yuv420p"
+    pix_fmt_10bit: str | None = "yuv420p10le"
+    default_preset: str | None = None
+    qp_max: int = 51
+
+
+def _hardware_encoders(codec: str, vaapi_qp_max: int = 51) -> tuple[EncoderSpec, ...]:
+    """Аппаратные энкодеры кодека: у NVENC, QSV, AMF и VAAPI одинаковая схема имён h264_/hevc_/av1_."""
+    return (
+        EncoderSpec(f"{codec}_nvenc", codec, "nvenc", "NVENC", default_preset=DEFAULT_NVENC_PRESET, pix_fmt_10bit="p010le"),
+        EncoderSpec(f"{codec}_qsv", codec, "qsv", "Intel QSV", hwaccel="qsv", default_preset="medium", pix_fmt_10bit="p010le"),
+        EncoderSpec(
+            f"{codec}_amf", codec, "amf", "AMD AMF", platforms=("win",), default_preset="balanced", pix_fmt_10bit="p010le"
+        ),
+        EncoderSpec(
+            f"{codec}_vaapi",
+            codec,
+            "vaapi",
+            "VAAPI",
+            hwaccel="vaapi",
+            platforms=("linux",),
+            global_args=("-vaapi_device", VAAPI_DEVICE),
+            upload_filter="format=nv12,hwupload",
+            upload_filter_10bit="format=p010,hwupload",
+            pix_fmt=None,
+            pix_fmt_10bit=None,
+            qp_max=vaapi_qp_max,
+        ),
+    )
+
+
+ENCODERS: dict[str, EncoderSpec] = {
+    spec.name: spec
+    for spec in (
+        *_hardware_encoders("h264"),
+        EncoderSpec("libx264", "h264", "cpu", "CPU (libx264)", default_preset=DEFAULT_X264_PRESET),
+        *_hardware_encoders("hevc"),
+        EncoderSpec("libx265", "hevc", "cpu", "CPU (libx265)", default_preset=DEFAULT_X264_PRESET),
+        # у av1_vaapi QP — индекс квантователя AV1 (0–255)
+        *_hardware_encoders("av1", vaapi_qp_max=255),
+        EncoderSpec("libsvtav1", "av1", "cpu", "CPU (SVT-AV1)", default_preset=DEFAULT_SVTAV1_PRESET, qp_max=63),
+    )
+}
+# программный энкодер каждого кодека: используется, когда аппаратных нет
+CPU_ENCODERS = {"h264": "libx264", "hevc": "libx265", "av1": "libsvtav1"}
+
+
+def get_encoder_spec(encoder: str) -> EncoderSpec:
+    try:
+        return ENCODERS[encoder]
+    except KeyError:
+        raise ValueError(f"неизвестный энкодер: {encoder}") from None
+
+
+def encoder_input_args(encoder: str | None) -> list[str]:
+    """Аргументы, которые энкодеру нужны перед -i (инициализация устройства)."""
+    return list(ENCODERS[encoder].global_args) if encoder in ENCODERS else []
+
+
+# --- Аргументы ffmpeg ---
+
+def build_audio_args(skip_audio: bool, audio_channels: int, bitrate: str, log=_no_log) -> list[str]:
+    if skip_audio:
+        log("🎵 Аудио: copy\n")
+        return ["-c:a", "copy"]
+    log(f"🎵 Аудио: AAC, {audio_channels}ch, {bitrate}\n")
+    return ["-c:a", "aac", "-ac", str(audio_channels), "-b:a", bitrate]
+
+
+def build_subtitle_args(
+    selected_subtitles: list[dict], log=_no_log, input_index: int = 0
+) -> tuple[list[str], list[str], list[str]]:
+    """Возвращает (map_args, codec_args, metadata_args) для субтитров из входа input_index."""
+    subtitle_map_args: list[str] = []
+    subtitle_codec_args: list[str] = ["-sn"]
+    subtitle_metadata_args: list[str] = []
+    if selected_subtitles:
+        for output_subtitle_index, track in enumerate(selected_subtitles):
+            subtitle_map_args.extend(["-map", f"{input_index}:s:{track['order']}"])
+            language = str(track.get("language") or "und")
+            title = str(track.get("title") or "").strip()
+            if language:
+                subtitle_metadata_args.extend([f"-metadata:s:s:{output_subtitle_index}", f"language={language}"])
+            if title:
+                subtitle_metadata_args.extend([f"-metadata:s:s:{output_subtitle_index}", f"title={title}"])
+                subtitle_metadata_args.extend([f"-metadata:s:s:{output_subtitle_index}", f"handler_name={title}"])
+        subtitle_codec_args = ["-c:s", "mov_text"]
+        log(f"💬 Субтитры: {len(selected_subtitles)} дорожк(и), mov_text\n")
+    else:
+        log("💬 Субтитры: нет\n")
+    return subtitle_map_args, subtitle_codec_args, subtitle_metadata_args
+
+
+TONEMAP_MODES = ("auto", "on", "off", "keep")  # значения RowSettings.tonemapping: 0, 1, 2, 3
+
+
+def _hdr_source(input_path: str, video_info: dict) -> dict:
+    """Сведения о видео для решений по HDR: собранные при добавлении файла (кэш) или разобранные заново."""
+    if "requires_tonemap" in video_info:
+        return video_info
+    return get_video_info(input_path)
+
+
+def can_keep_hdr(hdr_type: str, codec: str) -> bool:
+    """HDR10/HDR10+/HLG (и BT.2020) сохраняются в 10-битном HEVC/AV1; Dolby Vision и H.264 — нет."""
+    if hdr_type == "SDR" or hdr_type.startswith("Dolby Vision"):
+        return False
+    return get_codec_spec(codec).max_bit_depth >= 10
+
+
+def decide_tonemap(input_path: str, video_info: dict, tonemap_mode: int, codec: str = "h264") -> tuple[str, bool]:
+    """
+    Тип HDR исходника и нужен ли тонмаппинг HDR→SDR. tonemap_mode (см. TONEMAP_MODES):
+    0 — авто (по типу HDR), 1 — всегда, 2 — никогда, 3 — сохранить HDR: тонмаппинга
+    нет, если выходной кодек может нести HDR, иначе — как в авто.
+    """
+    source = _hdr_source(input_path, video_info)
+    hdr_type = source.get("hdr_type") or "SDR"
+    auto_tonemap = bool(source.get("requires_tonemap"))
+
+    if tonemap_mode == 2:
+        return hdr_type, False
+    if tonemap_mode == 1:
+        return hdr_type, True
+    if tonemap_mode == 3 and can_keep_hdr(hdr_type, codec):
+        return hdr_type, False
+    return hdr_type, auto_tonemap
+
+
+def pix_fmt_bit_depth(pix_fmt: str | None) -> int:
+    """Разрядность компоненты по имени формата ffmpeg: yuv420p → 8, yuv420p10le / p010le → 10."""
+    match = re.search(r"(\d{2})(?:le|be)$", str(pix_fmt or ""))
+    return int(match.group(1)) if match else 8
+
+
+def output_bit_depth(codec: str, video_info: dict, needs_tonemap: bool) -> int:
+    """
+    10 бит, если кодек это позволяет, тонмаппинг не нужен и исходник 10-битный
+    (или больше) либо HDR; иначе 8.
+    """
+    if needs_tonemap or get_codec_spec(codec).max_bit_depth < 10:
+        return 8
+    if (video_info.get("hdr_type") or "SDR") != "SDR":
+        return 10
+    return 10 if pix_fmt_bit_depth(video_info.get("pix_fmt")) >= 10 else 8
+
+
+def hdr_color_args(video_info: dict) -> list[str]:
+    """Сигнализация цвета исходника (основные цвета, передаточная функция, матрица) для выходного потока."""
+    args = []
+    for option, key in (("-color_primaries", "color_primaries"), ("-color_trc", "color_transfer"), ("-colorspace", "color_space")):
+        value = video_info.get(key)
+        if value and value != "unknown":
+            args += [option, value]
+    return args
+
+
+def _mastering_display_string(md: dict, chroma_scale: int | None, luma_scale: int | None) -> str:
+    """G(x,y)B(x,y)R(x,y)WP(x,y)L(max,min): целые в единицах энкодера (x265) или дробные (SVT-AV1) при scale=None."""
+
+    def number(value: float, scale: int | None) -> str:
+        return str(round(value * scale)) if scale else f"{value:.4f}"
+
+    def point(name: str) -> str:
+        return f"({number(md[name + '_x'], chroma_scale)},{number(md[name + '_y'], chroma_scale)})"
+
+    luminance = f"({number(md['max_luminance'], luma_scale)},{number(md['min_luminance'], luma_scale)})"
+    return f"G{point('green')}B{point('blue')}R{point('red')}WP{point('white_point')}L{luminance}"
+
+
+def hdr_encoder_params(encoder: str, video_info: dict) -> list[str]:
+    """
+    Метаданные HDR10 (mastering display, MaxCLL/MaxFALL) в параметрах программных
+    энкодеров: x265 (-x265-params) и SVT-AV1 (-svtav1-params). Аппаратные энкодеры
+    получают их из side data кадров — это делает сам ffmpeg.
+    """
+    md = video_info.get("mastering_display")
+    cll = video_info.get("content_light")
+    pq = "smpte2084" in str(video_info.get("color_transfer") or "")
+    params = []
+    if encoder == "libx265":
+        if pq:
+            params += ["hdr10=1", "hdr10-opt=1"]
+        if md:
+            # x265: цветность в единицах 0.00002, яркость — 0.0001 кд/м²
+            params.append(f"master-display={_mastering_display_string(md, 50000, 10000)}")
+        if cll:
+            params.append(f"max-cll={cll['max_content']},{cll['max_average']}")
+        if params:
+            params.append("repeat-headers=1")
+    elif encoder == "libsvtav1":
+        if md:
+            params.append(f"mastering-display={_mastering_display_string(md, None, None)}")
+        if cll:
+            params.append(f"content-light={cll['max_content']},{cll['max_average']}")
+    return params
+
+
+# --- Тонмаппинг HDR→SDR ---
+TONEMAP_LUT_SIZE = 64  # узлов 3D LUT на канал (haldclutsrc level=8)
+
+
+@dataclass(frozen=True)
+class TonemapSpec:
+    """
+    Способ тонмаппинга HDR→SDR. filters — фильтры ffmpeg, без которых он
+    недоступен; global_args ставятся перед -i (инициализация устройства);
+    gpu=True — доступность проверяется тестовым прогоном, а не только по списку фильтров.
+    """
+
+    name: str
+    label: str
+    filters: tuple[str, ...]
+    global_args: tuple[str, ...] = ()
+    gpu: bool = False
+
+
+TONEMAPPERS: dict[str, TonemapSpec] = {
+    spec.name: spec
+    for spec in (
+        TonemapSpec("zscale", "zscale (эталон)", ("zscale", "tonemap")),
+        TonemapSpec("lut", "3D LUT (CPU, быстрый)", ("zscale", "lut3d", "haldclutsrc")),
+        TonemapSpec("libplacebo", "libplacebo (Vulkan)", ("libplacebo",), gpu=True),
+        TonemapSpec(
+            "opencl",
+            "OpenCL",
+            ("tonemap_opencl",),
+            global_args=("-init_hw_device", "opencl=ocl", "-filter_hw_device", "ocl"),
+            gpu=True,
+        ),
+    )
+}
+DEFAULT_TONEMAPPER = "zscale"
+
+# Эталонная цепочка: линейный свет во float, тонмаппинг hable, BT.709.
+_ZSCALE_TONEMAP = "zscale=t=linear:npl=30,format=gbrpf32le,zscale=p=bt709,tonemap=hable:param=1.5:desat=0,zscale=t=bt709:m=bt709:r=pc"
+
+
+def tonemap_input_args(tonemapper: str | None) -> list[str]:
+    """Аргументы, которые способу тонмаппинга нужны перед -i."""
+    return list(TONEMAPPERS[tonemapper].global_args) if tonemapper in TONEMAPPERS else []
+
+
+def _filter_path(path: str) -> str:
+    """Путь к файлу как значение опции фильтра (в том числе путь Windows с буквой диска)."""
+    escaped = path.replace("\\", "/").replace("'", "\\'").replace(":", "\\:")
+    return f"'{escaped}'"
+
+
+def _lut_source_props(video_info: dict) -> tuple[str, str]:
+    """Основные цвета и передаточная функция, для которых строится LUT (по умолчанию HDR10)."""
+    primaries = video_info.get("color_primaries") or "bt2020"
+    transfer = video_info.get("color_transfer") or "smpte2084"
+    return primaries, transfer
+
+
+def ensure_tonemap_lut(ffmpeg_path: str, primaries: str, transfer: str, cache_dir: str | None = None) -> str:
+    """
+    3D LUT (.cube) эталонной цепочки zscale для исходника primaries/transfer.
+    Эталонная цепочка один раз прогоняется по единичной Hald-таблице
+    (haldclutsrc), результат сохраняется в папке данных программы и дальше
+    применяется фильтром lut3d — целочисленная интерполяция вместо float на каждом кадре.
+    """
+    cache_dir = cache_dir or os.path.join(get_app_data_dir(), "luts")
+    path = os.path.join(cache_dir, f"tonemap_{primaries}_{transfer}_{TONEMAP_LUT_SIZE}.cube")
+    if os.path.isfile(path):
+        return path
+
+    level = round(TONEMAP_LUT_SIZE ** (1 / 2))
+    cmd = [
+        ffmpeg_path,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-f",
+        "lavfi",
+        "-i",
+        f"haldclutsrc=level={level},format=rgb48le,"
+        f"setparams=color_primaries={primaries}:color_trc={transfer}:colorspace=gbr:range=pc,"
+        f"{_ZSCALE_TONEMAP},format=rgb48le",
+        "-frames:v",
+        "1",
+        "-f",
+        "rawvideo",
+        "-",
+    ]
+    result = subprocess.run(cmd, capture_output=True, creationflags=CREATE_NO_WINDOW, timeout=120)
+    expected = TONEMAP_LUT_SIZE**3 * 6
+    if result.returncode != 0 or len(result.stdout) < expected:
+        message = result.stderr.decode("utf-8", errors="replace").strip()
+        raise RuntimeError(message or "не удалось построить LUT")
+
+    # Hald: красный меняется быстрее всего, затем зелёный, затем синий — как в .cube
+    values = memoryview(result.stdout[:expected]).cast("H")
+    lines = [f"LUT_3D_SIZE {TONEMAP_LUT_SIZE}"]
+    lines += [
+        f"{values[i] / 65535:.6f} {values[i + 1] / 65535:.6f} {values[i + 2] / 65535:.6f}"
+        for i in range(0, len(values), 3)
+    ]
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="ascii") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+    return path
+
+
+def tonemap_filter(tonemapper: str, video_info: dict, log=_no_log) -> str:
+    """
+    Цепочка тонмаппинга HDR→SDR выбранным способом; на выходе — BT.709 yuv420p
+    полного диапазона, как у эталонной цепочки zscale. Если LUT построить
+    не удалось, используется эталонная цепочка.
+    """
+    if tonemapper == "lut":
+        primaries, transfer = _lut_source_props(video_info)
+        try:
+            lut_path = ensure_tonemap_lut(FFMPEG_PATH, primaries, transfer)
+        except Exception as e:
+            log(f"⚠ 3D LUT недоступен ({e}), тонмаппинг через zscale\n")
+        else:
+            return (
+                "zscale,format=gbrp16le,"
+                f"lut3d=file={_filter_path(lut_path)}:interp=tetrahedral,"
+                "setparams=color_primaries=bt709:color_trc=bt709:colorspace=gbr:range=pc,"
+                "zscale=m=bt709:r=pc,format=yuv420p"
+            )
+    elif tonemapper == "libplacebo":
+        return (
+            "libplacebo=tonemapping=hable:colorspace=bt709:color_primaries=bt709:"
+            "color_trc=bt709:range=pc:format=yuv420p"
+        )
+    elif tonemapper == "opencl":
+        return (
+            "format=p010,hwupload,"
+            "tonemap_opencl=tonemap=hable:param=1.5:desat=0:t=bt709:m=bt709:p=bt709:r=pc:format=nv12,"
+            "hwdownload,format=nv12,format=yuv420p"
+        )
+    return f"{_ZSCALE_TONEMAP},format=yuv420p"
+
+
+def _tonemapper_works(ffmpeg_path: str, spec: TonemapSpec) -> bool:
+    """Тестовый прогон GPU-тонмаппинга на маленьком синтетическом HDR10-кадре."""
+    cmd = [
+        ffmpeg_path,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        *spec.global_args,
+        "-f",
+        "lavfi",
+        "-i",
+        "testsrc2=size=256x144:rate=5",
+        "-t",
+        "0.4",
+        "-vf",
+        "format=yuv420p10le,setparams=color_primaries=bt2020:color_trc=smpte2084:colorspace=bt2020nc,"
+        + tonemap_filter(spec.name, {}),
+        "-f",
+        "null",
+        "-",
+    ]
+    try:
+        result = subprocess.run(
+            cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, creationflags=CREATE_NO_WINDOW, timeout=60
+        )
+    except Exception:
+        return False
+    return result.returncode == 0
+
+
+def detect_tonemappers(ffmpeg_path: str) -> list[str]:
+    """Доступные способы тонмаппинга: все фильтры есть в сборке, GPU-способы ещё и проходят тестовый прогон."""
+    available = []
+    for spec in TONEMAPPERS.values():
+        if not all(ffmpeg_has_filter(ffmpeg_path, name) for name in spec.filters):
+            continue
+        if spec.gpu and not _tonemapper_works(ffmpeg_path, spec):
+            continue
+        available.append(spec.name)
+    return available
+
+
+def split_filter_chain(chain: str) -> list[str]:
+    """Разбивает цепочку -vf на фильтры по запятым вне кавычек и экранирования."""
+    filters, current, quoted, escaped = [], [], False, False
+    for ch in chain:
+        if escaped:
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif ch == "'":
+            quoted = not quoted
+        elif ch == "," and not quoted:
+            filters.append("".join(current))
+            current = []
+            continue
+        current.append(ch)
+    filters.append("".join(current))
+    return [f for f in filters if f]
+
+
+def _is_format(step: str) -> bool:
+    return step.startswith("format=")
+
+
+def optimize_filter_chain(filters: list[str], pix_fmt: str | None = None) -> list[str]:
+    """
+    Убирает лишние преобразования формата кадров:
+      - из нескольких format= подряд остаётся последний (кроме format= сразу
+        после hwdownload — он задаёт формат выгрузки из видеопамяти);
+      - завершающий format= не нужен, если выходной формат задан -pix_fmt:
+        ffmpeg и так приведёт кадры к нему одним преобразованием.
+    """
+    result: list[str] = []
+    for step in filters:
+        if _is_format(step) and result and _is_format(result[-1]) and not (len(result) > 1 and result[-2] == "hwdownload"):
+            result.pop()
+        result.append(step)
+    if pix_fmt and result and _is_format(result[-1]) and not (len(result) > 1 and result[-2] == "hwdownload"):
+        result.pop()
+    return result
+
+
+def build_video_filter(
+    input_path: str,
+    video_info: dict,
+    limit_res: bool,
+    tonemap_mode: int,
+    log=_no_log,
+    bit_depth: int = 8,
+    codec: str = "h264",
+    tonemapper: str = DEFAULT_TONEMAPPER,
+) -> str:
+    """
+    Цепочка -vf: приведение к yuv420p (yuv420p10le при bit_depth=10), при
+    необходимости тонмаппинг HDR→SDR (всегда в 8 бит, способом tonemapper,
+    см. TONEMAPPERS) и ограничение до FullHD. Уменьшение разрешения стоит
+    первым: тонмаппинг и смена формата идут уже по меньшему кадру.
+    """
+    hdr_type, needs_tonemap = decide_tonemap(input_path, video_info, tonemap_mode, codec)
+    depth_str = ", 10 бит" if bit_depth >= 10 and not needs_tonemap else ""
+    method_str = f" ({tonemapper})" if needs_tonemap and tonemapper != DEFAULT_TONEMAPPER else ""
+    log(f"🎨 Видео: {hdr_type}, tonemap={'on' if needs_tonemap else 'off'}{method_str}{depth_str}\n")
+    if tonemap_mode == 3 and hdr_type != "SDR" and not can_keep_hdr(hdr_type, codec):
+        log(f"⚠ {hdr_type} нельзя сохранить в {get_codec_spec(codec).label} — HDR обрабатывается как в режиме «Авто»\n")
+
+    filters = []
+    if limit_res:
+        try:
+            w = int(video_info.get("width") or 0)
+            h = int(video_info.get("height") or 0)
+        except Exception:
+            w, h = 0, 0
+        if not (w and h):
+            vinfo = get_video_info(input_path)
+            try:
+                w = int(vinfo.get("width") or 0)
+                h = int(vinfo.get("height") or 0)
+            except Exception:
+                w, h = 0, 0
+        if w > 1920 or h > 1080:
+            filters.append("scale='if(gt(iw,1920),1920,iw):if(gt(ih,1080),1080,ih):force_original_aspect_ratio=decrease'")
+
+    if needs_tonemap:
+        filters += split_filter_chain(tonemap_filter(tonemapper, _hdr_source(input_path, video_info), log))
+    else:
+        filters.append(f"format={'yuv420p10le' if bit_depth >= 10 else 'yuv420p'}")
+    return ",".join(optimize_filter_chain(filters))
+
+
+def _scale_quality(spec: EncoderSpec, quality: int) -> int:
+    """Значение слайдера (шкала QP/CRF H.264, 0–51) в шкале энкодера."""
+    if spec.qp_max == 51:
+        return quality
+    return min(spec.qp_max, round(quality * spec.qp_max / 51))
+
+
+def _rate_control_args(spec: EncoderSpec, encode_mode: int, quality: int, bufsize: str) -> list[str]:
+    """Режим QP/CRF (0) или CBR (1) в параметрах конкретного энкодера."""
+    if encode_mode != 0:
+        target_bitrate = f"{int(quality * 1000)}k"
+        if spec.name == "libsvtav1":
+            # SVT-AV1 умеет CBR только с низкой задержкой — берём VBR со средним битрейтом
+            return ["-b:v", target_bitrate]
+        cbr_args = ["-b:v", target_bitrate, "-maxrate", target_bitrate, "-bufsize", bufsize]
+        if spec.kind == "vaapi":
+            return ["-rc_mode", "CBR", *cbr_args]
+        if spec.kind == "amf":
+            return ["-rc", "cbr", *cbr_args]
+        return cbr_args
+
+    q = str(_scale_quality(spec, quality))
+    if spec.kind == "nvenc":
+        return ["-rc", "vbr", "-cq", q, "-b:v", "0", "-qmin", "0"]
+    if spec.kind == "qsv":
+        return ["-global_quality", q]
+    if spec.kind == "vaapi":
+        return ["-rc_mode", "CQP", "-qp", q]
+    if spec.kind == "amf":
+        # B-кадры с отдельным QP есть только у h264_amf
+        b_frames = ["-qp_b", q] if spec.codec == "h264" else []
+        return ["-rc", "cqp", "-qp_i", q, "-qp_p", q, *b_frames]
+    return ["-crf", q]
+
+
+def build_encoder_args(
+    encode_mode: int,
+    qp_slider: int,
+    encoder: str,
+    log=_no_log,
+    preset: str | None = None,
+    bufsize: str = DEFAULT_BUFSIZE,
+    bit_depth: int = 8,
+    hdr: dict | None = None,
+) -> list[str]:
+    """
+    Аргументы видеоэнкодера (см. ENCODERS) для режимов QP (0) и CBR (1).
+    hdr — сведения о HDR-исходнике (parse_video_info), если HDR сохраняется:
+    добавляются сигнализация цвета и метаданные HDR10.
+    """
+    spec = get_encoder_spec(encoder)
+    codec = get_codec_spec(spec.codec)
+    rc_args = _rate_control_args(spec, encode_mode, qp_slider, bufsize)
+    if encode_mode == 0:
+        scaled = _scale_quality(spec, qp_slider)
+        scale_str = f" (→{scaled})" if scaled != qp_slider else ""
+        log(f"🎯 Режим: {codec.label} {spec.label}, {'CRF' if spec.kind == 'cpu' else 'QP'}={qp_slider}{scale_str}\n")
+    else:
+        log(f"📦 Режим: {codec.label} {spec.label}, CBR={int(qp_slider * 1000)}k\n")
+
+    args = ["-c:v", spec.name]
+    preset = preset or spec.default_preset
+    if preset:
+        # у AMF роль пресета играет -quality (speed / balanced / quality)
+        args += ["-quality" if spec.kind == "amf" else "-preset", preset]
+    args += rc_args
+    profile = codec.profile_10bit if bit_depth >= 10 else codec.profile
+    if profile:
+        args += ["-profile:v", profile]
+    if spec.kind == "nvenc":
+        args += ["-tune", "hq", "-b_ref_mode", "middle", "-spatial_aq", "1"]
+    hdr_params = hdr_encoder_params(spec.name, hdr) if hdr else []
+    if spec.name == "libx265":
+        # x265 пишет в stderr статистику каждого кадра — оставляем только ошибки
+        args += ["-x265-params", ":".join(["log-level=error", *hdr_params])]
+    elif spec.name == "libsvtav1" and hdr_params:
+        args += ["-svtav1-params", ":".join(hdr_params)]
+    if hdr:
+        color_args = hdr_color_args(hdr)
+        args += color_args
+        extras = [name for name, key in (("mastering display", "mastering_display"), ("CLL", "content_light")) if hdr.get(key)]
+        log(f"🌈 HDR сохраняется: {'/'.join(color_args[1::2]) or 'без сигнализации цвета'}{', ' if extras else ''}{', '.join(extras)}\n")
+    return args
+
+
+def _video_plan(input_path: str, video_info: dict, tonemap_mode: int, encoder: str) -> tuple[EncoderSpec, dict, int, dict | None]:
+    """(энкодер, сведения об исходнике с HDR, разрядность выхода, HDR-метаданные для сохранения или None)."""
+    spec = get_encoder_spec(encoder)
+    source = _hdr_source(input_path, video_info)
+    hdr_type, needs_tonemap = decide_tonemap(input_path, source, tonemap_mode, spec.codec)
+    bit_depth = output_bit_depth(spec.codec, source, needs_tonemap)
+    # HDR без тонмаппинга в 10 битах — сохраняем его сигнализацию и метаданные
+    hdr = source if bit_depth >= 10 and hdr_type != "SDR" else None
+    return spec, source, bit_depth, hdr
+
+
+def build_video_args(
+    input_path: str,
+    video_info: dict,
+    skip_video: bool,
+    encode_mode: int,
+    qp_slider: int,
+    limit_res: bool,
+    tonemap_mode: int,
+    encoder: str,
+    log=_no_log,
+    preset: str | None = None,
+    bufsize: str = DEFAULT_BUFSIZE,
+    tonemapper: str = DEFAULT_TONEMAPPER,
+) -> list[str]:
+    """
+    Возвращает аргументы видео для ffmpeg: либо ["-c:v", "copy"], либо
+    полный набор фильтров/энкодера. Кодек определяется энкодером; 10-битный
+    или HDR-исходник кодируется в 10 бит, если кодек это поддерживает и
+    тонмаппинг не нужен, — тогда HDR сохраняется вместе с метаданными
+    (режим tonemap_mode=3 или 2). Для аппаратных энкодеров, которым нужны
+    кадры в памяти GPU, в конец -vf добавляется выгрузка (hwupload), а перед
+    -i нужно поставить encoder_input_args(encoder) и, если нужен тонмаппинг,
+    tonemap_input_args(tonemapper). preset и bufsize переопределяют значения
+    по умолчанию (для бенчмарка).
+    """
+    if skip_video:
+        log("🎥 Видео: copy\n")
+        return ["-c:v", "copy"]
+
+    spec, source, bit_depth, hdr = _video_plan(input_path, video_info, tonemap_mode, encoder)
+    filters = split_filter_chain(build_video_filter(input_path, source, limit_res, tonemap_mode, log, bit_depth, spec.codec, tonemapper))
+    upload_filter = spec.upload_filter_10bit if bit_depth >= 10 else spec.upload_filter
+    if upload_filter:
+        filters += split_filter_chain(upload_filter)
+    video_encoder_args = build_encoder_args(encode_mode, qp_slider, encoder, log, preset, bufsize, bit_depth, hdr)
+    pix_fmt = spec.pix_fmt_10bit if bit_depth >= 10 else spec.pix_fmt
+    pix_fmt_args = ["-pix_fmt", pix_fmt] if pix_fmt else []
+    filters = optimize_filter_chain(filters, pix_fmt)
+    log(f"🧩 Фильтры: {','.join(filters) or 'нет'}{f' → {pix_fmt}' if pix_fmt else ''}\n")
+    vf_args = ["-vf", ",".join(filters)] if filters else []
+    return [*pix_fmt_args, *vf_args, *video_encoder_args]
+
+
+def video_stream_args(codec: str | None) -> list[str]:
+    """
+    Аргументы выходного видеопотока, зависящие от кодека (в том числе
+    скопированного): тег MP4 и удаление скрытых субтитров из H.264.
+    """
+    spec = CODECS.get(str(codec or "").lower())
+    if spec is None:
+        return []
+    args = ["-tag:v", spec.tag] if spec.tag else []
+    if spec.strip_captions:
+        # удаление скрытых субтитров (Closed captions EIA-608/CEA-608)
+        args += ["-bsf:v", "filter_units=remove_types=6"]
+    return args
+
+
+# --- Лесенка выходов (одно декодирование — несколько файлов) ---
+AUDIO_ONLY_EXT = ".m4a"
+
+
+@dataclass(frozen=True)
+class Rendition:
+    """
+    Один выход лесенки. height — высота кадра (None — исходная; больше исходной
+    не увеличивается), quality — своё значение QP/битрейта вместо настроек задачи,
+    audio_only — только звук (файл .m4a). name становится суффиксом имени файла.
+    """
+
+    name: str
+    height: int | None = None
+    quality: int | None = None
+    audio_only: bool = False
+
+    @property
+    def output_ext(self) -> str:
+        return AUDIO_ONLY_EXT if self.audio_only else ".mp4"
+
+
+def parse_ladder(spec: str) -> list[Rendition]:
+    """
+    Разбирает описание лесенки: "1080p,720p:24,audio" — выходы через запятую,
+    высота с суффиксом p (или source — исходная), после двоеточия — качество.
+    ValueError при ошибке.
+    """
+    renditions: list[Rendition] = []
+    for item in (part.strip().lower() for part in str(spec or "").split(",")):
+        if not item:
+            continue
+        name, _, quality = item.partition(":")
+        if name == "audio":
+            if quality:
+                raise ValueError("у выхода audio нет настройки качества")
+            renditions.append(Rendition("audio", audio_only=True))
+            continue
+        if name == "source":
+            height = None
+        elif re.fullmatch(r"\d{3,4}p", name):
+            height = int(name[:-1])
+        else:
+            raise ValueError(f"неизвестный выход {name!r}: ожидается 720p, 1080p, source или audio")
+        if quality and not quality.isdigit():
+            raise ValueError(f"качество выхода {name} должно быть числом")
+        renditions.append(Rendition(name, height, int(quality) if quality else None))
+    names = [r.name for r in renditions]
+    if len(set(names)) != len(names):
+        raise ValueError("выходы лесенки повторяются")
+    if not any(not r.audio_only for r in renditions):
+        raise ValueError("в лесенке нет ни одного видеовыхода")
+    return renditions
+
+
+def build_ladder_args(
+    input_path: str,
+    video_info: dict,
+    renditions: list[Rendition],
+    encode_mode: int,
+    qp_slider: int,
+    tonemap_mode: int,
+    encoder: str,
+    log=_no_log,
+    tonemapper: str = DEFAULT_TONEMAPPER,
+) -> tuple[list[str], list[list[str]]]:
+    """
+    Граф лесенки: кадр декодируется и проходит тонмаппинг/смену формата один
+    раз — в разрешении самого крупного выхода, затем split раздаёт его выходам,
+    и каждая ветка только уменьшает кадр до своей высоты. Возвращает
+    (["-filter_complex", граф], аргументы видео для каждого выхода по порядку
+    renditions; у выходов audio_only — ["-vn"]).
+    """
+    spec, source, bit_depth, hdr = _video_plan(input_path, video_info, tonemap_mode, encoder)
+    try:
+        source_height = int(source.get("height") or 0)
+    except (TypeError, ValueError):
+        source_height = 0
+    heights = {
+        r.name: min(r.height, source_height) if r.height and source_height else (r.height or source_height)
+        for r in renditions
+        if not r.audio_only
+    }
+    top = max(heights.values())
+
+    common = []
+    if top and source_height and top < source_height:
+        common.append(f"scale=-2:{top}")
+    common += split_filter_chain(build_video_filter(input_path, source, False, tonemap_mode, log, bit_depth, spec.codec, tonemapper))
+    common = optimize_filter_chain(common)
+
+    upload_filter = spec.upload_filter_10bit if bit_depth >= 10 else spec.upload_filter
+    pix_fmt = spec.pix_fmt_10bit if bit_depth >= 10 else spec.pix_fmt
+    branches = []
+    per_output: list[list[str]] = []
+    for rendition in renditions:
+        if rendition.audio_only:
+            per_output.append(["-vn"])
+            continue
+        i = len(branches)
+        height = heights[rendition.name]
+        steps = [f"scale=-2:{height}"] if height and height < top else []
+        steps += split_filter_chain(upload_filter)
+        steps = optimize_filter_chain(steps, pix_fmt)
+        branches.append(f"[s{i}]{','.join(steps) or 'null'}[v{i}]")
+        log(f"🪜 Выход {rendition.name}: {height or '?'}p\n")
+        quality = rendition.quality if rendition.quality is not None else qp_slider
+        encoder_args = build_encoder_args(encode_mode, quality, encoder, log, bit_depth=bit_depth, hdr=hdr)
+        per_output.append(["-map", f"[v{i}]", *(["-pix_fmt", pix_fmt] if pix_fmt else []), *encoder_args])
+
+    split_labels = "".join(f"[s{i}]" for i in range(len(branches)))
+    graph = ";".join([f"[0:v:0]{','.join(common)},split={len(branches)}{split_labels}", *branches])
+    log(f"🧩 Граф: {graph}\n")
+    return ["-filter_complex", graph], per_output
+
+
+def decide_stream_copy(video_info: dict, audio_stream: dict | None, settings: RowSettings) -> tuple[bool, bool, list[str]]:
+    """
+    «Умное копирование»: решает, какие потоки можно скопировать без перекодирования,
+    потому что результат был бы эквивалентен. Возвращает (copy_video, copy_audio, причины).
+
+    Видео копируется, если оно уже в выходном кодеке (settings.codec) и формате
+    (yuv420p SDR; для HEVC/AV1 также 10 бит с HDR, если тонмаппинг выключен
+    или выбрано сохранение HDR), тонмаппинг не включён принудительно, разрешение укладывается
+    в ограничение, а в режиме CBR битрейт не выше заданного.
+    Аудио копируется, если это AAC не более чем в 8 каналах.
+    """
+    reasons: list[str] = []
+    copy_video = settings.skip_video
+    copy_audio = settings.skip_audio
+    if not settings.smart_copy:
+        return copy_video, copy_audio, reasons
+
+    if not copy_video:
+        codec = str(video_info.get("codec") or "?").lower()
+        pix_fmt = str(video_info.get("pix_fmt") or "?")
+        hdr_type = video_info.get("hdr_type") or "?"
+        try:
+            w = int(video_info.get("width") or 0)
+            h = int(video_info.get("height") or 0)
+        except (TypeError, ValueError):
+            w, h = 0, 0
+        bit_rate = video_info.get("bit_rate")
+
+        target = get_codec_spec(settings.codec)
+        ten_bit = target.max_bit_depth >= 10 and pix_fmt == "yuv420p10le"
+        keeps_hdr = settings.tonemapping == 2 or (settings.tonemapping == 3 and can_keep_hdr(hdr_type, target.name))
+        if codec != target.name:
+            reasons.append(f"видео: кодек {codec}, нужен {target.name}")
+        elif pix_fmt != "yuv420p" and not ten_bit:
+            reasons.append(f"видео: {pix_fmt}, нужен yuv420p{' или yuv420p10le' if target.max_bit_depth >= 10 else ''}")
+        elif hdr_type != "SDR" and not (ten_bit and keeps_hdr):
+            reasons.append(f"видео: {hdr_type}")
+        elif settings.tonemapping == 1:
+            reasons.append("видео: тонмаппинг включён принудительно")
+        elif settings.limit_res and not (w and h and w <= 1920 and h <= 1080):
+            reasons.append(f"видео: {w}×{h} больше FullHD")
+        elif settings.encode_mode == 1 and not (bit_rate and bit_rate <= settings.quality * 1_000_000):
+            reasons.append("видео: битрейт выше заданного CBR или неизвестен")
+        else:
+            copy_video = True
+            reasons.append(f"видео: copy — уже {target.label} {pix_fmt} {hdr_type} {w}×{h}")
+
+    if not copy_audio and audio_stream is not None:
+        codec = str(audio_stream.get("codec") or "?").lower()
+        channels = audio_stream.get("channels")
+        if codec != "aac":
+            reasons.append(f"аудио: кодек {codec}, нужен aac")
+        elif not channels or channels > 8:
+            reasons.append("аудио: неизвестное число каналов")
+        else:
+            copy_audio = True
+            reasons.append(f"аудио: copy — уже AAC {channels}ch")
+
+    return copy_video, copy_audio, reasons
+
+
+# --- Подбор качества (encode_mode=2) ---
+QUALITY_METRICS = ("vmaf", "ssim")
+QUALITY_CRF_RANGE = (16, 36)
+QUALITY_SAMPLES = 4
+QUALITY_SAMPLE_SECONDS = 4.0
+QUALITY_FALLBACK_QP = 22
+
+_filter_support: dict[tuple[str, str], bool] = {}
+
+
+def ffmpeg_has_filter(ffmpeg_path: str, name: str) -> bool:
+    """Есть ли фильтр в сборке ffmpeg (ответ запоминается до конца работы программы)."""
+    key = (ffmpeg_path, name)
+    if key not in _filter_support:
+        try:
+            result = subprocess.run(
+                [ffmpeg_path, "-hide_banner", "-filters"],
+                capture_output=True,
+                text=True,
+                errors="replace",
+                creationflags=CREATE_NO_WINDOW,
+                timeout=20,
+            )
+            _filter_support[key] = any(line.split()[1:2] == [name] for line in result.stdout.splitlines())
+        except Exception:
+            _filter_support[key] = False
+    return _filter_support[key]
+
+
+def quality_sample_points(
+    duration: float,
+    samples: int = QUALITY_SAMPLES,
+    seconds: float = QUALITY_SAMPLE_SECONDS,
+) -> list[tuple[float, float]]:
+    """
+    Образцы для подбора качества: (начало, длина), равномерно по файлу без самого
+    начала и конца. Короткий файл (или неизвестной длины) берётся одним образцом.
+    """
+    if duration <= samples * seconds * 2:
+        return [(0.0, min(duration, samples * seconds) if duration > 0 else samples * seconds)]
+    return [(duration * (i + 1) / (samples + 1) - seconds / 2, seconds) for i in range(samples)]
+
+
+def quality_metric_filter(metric: str, threads: int = 1) -> str:
+    """Граф сравнения: вход 0 — закодированный образец, вход 1 — эталон."""
+    compare = f"libvmaf=n_threads={threads}" if metric == "vmaf" else "ssim"
+    return f"[0:v]setpts=PTS-STARTPTS[dist];[1:v]setpts=PTS-STARTPTS[ref];[dist][ref]{compare}"
+
+
+def parse_quality_score(metric: str, text: str) -> float | None:
+    """Итоговая оценка из stderr ffmpeg: VMAF (0–100) или SSIM в дБ."""
+    if metric == "vmaf":
+        m = re.search(r"VMAF score[:=]\s*([\d.]+)", text)
+        return float(m.group(1)) if m else None
+    m = re.search(r"All:([\d.]+) \((inf|[\d.]+)\)", text)
+    if not m:
+        return None
+    # inf — кадры идентичны; для сравнения с целью достаточно «очень много»
+    return 100.0 if m.group(2) == "inf" else float(m.group(2))
+
+
+def quality_search_params(settings: RowSettings, video_filter: str, encoder: str) -> str:
+    """Ключ кэша подбора: всё, от чего зависит найденный CRF, кроме самого файла."""
+    return json.dumps(
+        {
+            "metric": settings.quality_metric,
+            "target": settings.quality,
+            "encoder": encoder,
+            "vf": video_filter,
+            "crf_range": QUALITY_CRF_RANGE,
+            "samples": [QUALITY_SAMPLES, QUALITY_SAMPLE_SECONDS],
+        },
+        sort_keys=True,
+    )
+
+
+# --- Задачи и пул конвертации ---
+JOB_PENDING = "pending"
+JOB_SEARCHING = "searching"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+JOB_MISSING = "missing"
+JOB_NO_AUDIO = "no_audio"
+
+
+@dataclass
+class JobStats:
+    """
+    Затраты ресурсов задачи — сумма по всем её процессам ffmpeg (подбор
+    качества, части файла, основное кодирование). Объёмы — в байтах, время —
+    в секундах. peak_rss — пик одного процесса, а не сумма одновременных.
+    encode_time — время самого кодирования (без подбора качества), по нему и
+    числу кадров считается средний fps; fps_history — мгновенные значения
+    по ходу кодирования (примерно раз в 0,5 с).
+    """
+
+    wall_time: float = 0.0
+    encode_time: float = 0.0
+    cpu_user: float = 0.0
+    cpu_system: float = 0.0
+    peak_rss: int = 0
+    read_bytes: int = 0
+    write_bytes: int = 0
+    processes: int = 0
+    frames: int = 0
+    fps_history: list[float] = field(default_factory=list)
+    input_size: int = 0
+    output_size: int = 0
+
+    def add_process(self, stats: ProcessStats):
+        self.processes += 1
+        self.cpu_user += stats.cpu_user
+        self.cpu_system += stats.cpu_system
+        self.peak_rss = max(self.peak_rss, stats.peak_rss)
+        self.read_bytes += stats.read_bytes
+        self.write_bytes += stats.write_bytes
+
+    @property
+    def cpu_time(self) -> float:
+        return self.cpu_user + self.cpu_system
+
+    @property
+    def cpu_percent(self) -> float:
+        """Загрузка CPU за время задачи: 100% — одно ядро целиком."""
+        return 100.0 * self.cpu_time / self.wall_time if self.wall_time > 0 else 0.0
+
+    @property
+    def avg_fps(self) -> float:
+        return self.frames / self.encode_time if self.encode_time > 0 else 0.0
+
+    @property
+    def min_fps(self) -> float:
+        return min(self.fps_history) if self.fps_history else 0.0
+
+    @property
+    def size_ratio(self) -> float:
+        """Размер результата относительно исходника (0.25 — в 4 раза меньше)."""
+        return self.output_size / self.input_size if self.input_size > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        data = {name: getattr(self, name) for name in JOB_STATS_FIELDS}
+        data = {name: round(value, 3) if isinstance(value, float) else value for name, value in data.items()}
+        data["fps_history"] = [round(fps, 1) for fps in self.fps_history]
+        return data
+
+
+JOB_STATS_FIELDS = (
+    "wall_time",
+    "encode_time",
+    "cpu_user",
+    "cpu_system",
+    "cpu_time",
+    "cpu_percent",
+    "peak_rss",
+    "read_bytes",
+    "write_bytes",
+    "processes",
+    "frames",
+    "avg_fps",
+    "min_fps",
+    "input_size",
+    "output_size",
+    "size_ratio",
+)
+JOB_REPORT_FIELDS = ("key", "input_path", "output_path", "status", *JOB_STATS_FIELDS)
+
+
+def job_report_rows(jobs: list["ConversionJob"]) -> list[dict]:
+    """Строки отчёта о ресурсах: по одной на задачу."""
+    return [
+        {"key": job.key, "input_path": job.input_path, "output_path": job.output_path, "status": job.status, **job.stats.as_dict()}
+        for job in jobs
+    ]
+
+
+def write_job_report(path: str, jobs: list["ConversionJob"], meta: dict | None = None):
+    """Отчёт о ресурсах задач. Формат по расширению: .csv — таблица (без fps_history), иначе JSON."""
+    write_report_rows(path, job_report_rows(jobs), meta)
+
+
+def write_report_rows(path: str, rows: list[dict], meta: dict | None = None):
+    """Как write_job_report, но из готовых строк job_report_rows (задачи можно уже не хранить)."""
+    if path.lower().endswith(".csv"):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=JOB_REPORT_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta or {}, "jobs": rows}, f, ensure_ascii=False, indent=2)
+
+
+def default_report_path() -> str:
+    """Файл отчёта для запуска очереди: reports/run_ГГГГММДД_ЧЧММСС.json в папке приложения."""
+    folder = os.path.join(get_app_data_dir(), "reports")
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, time.strftime("run_%Y%m%d_%H%M%S.json"))
+
+
+def summarize_jobs(jobs: list["ConversionJob"]) -> str:
+    """Итог очереди для лога: где ушло время и ресурсы по каждой задаче и всего."""
+    measured = [job for job in jobs if job.stats.processes]
+    if not measured:
+        return ""
+    lines = ["\n📊 Ресурсы:\n"]
+    for job in measured:
+        st = job.stats
+        fps_str = f", {st.avg_fps:.1f} fps (мин. {st.min_fps:.1f})" if st.frames else ""
+        ratio_str = f", размер {st.size_ratio:.0%} от исходного" if st.output_size else ""
+        lines.append(
+            f"   {os.path.basename(job.input_path or '?')}: {format_time(st.wall_time)}, "
+            f"CPU {st.cpu_time:.1f} с ({st.cpu_percent:.0f}%), пик {human_size(st.peak_rss)}, "
+            f"чтение {human_size(st.read_bytes)}, запись {human_size(st.write_bytes)}{fps_str}{ratio_str}\n"
+        )
+    cpu_total = sum(job.stats.cpu_time for job in measured)
+    read_total = sum(job.stats.read_bytes for job in measured)
+    write_total = sum(job.stats.write_bytes for job in measured)
+    slowest = max(measured, key=lambda job: job.stats.wall_time)
+    lines.append(
+        f"   Всего: CPU {cpu_total:.1f} с, чтение {human_size(read_total)}, запись {human_size(write_total)}; "
+        f"дольше всех — {os.path.basename(slowest.input_path or '?')} ({format_time(slowest.stats.wall_time)})\n"
+    )
+    return "".join(lines)
+
+
+@dataclass
+class ConversionJob:
+    """
+    Входные данные одной задачи конвертации, не зависящие от интерфейса.
+
+    settings — действующие настройки (не «глобальные»). audio_track — порядковый
+    номер аудио-стрима (a:N) или None, если дорожка не выбрана; audio_channels=None
+    означает «взять из audio_streams» (по умолчанию 2). audio_streams — результат parse_audio_streams
+    (для «умного копирования»). renditions — выходы лесенки (см. parse_ladder):
+    если список не пуст, все они пишутся одним процессом ffmpeg. output_path
+    (и output_paths — по одному на выход лесенки) заполняется движком при старте,
+    stats — затраты ресурсов (см. JobStats) — по ходу выполнения.
+    """
+
+    key: int
+    input_path: str
+    settings: RowSettings
+    audio_track: int | None = 0
+    audio_channels: int | None = None
+    subtitles: list[dict] = field(default_factory=list)
+    duration: float = 0.0
+    video_info: dict = field(default_factory=dict)
+    audio_streams: list[dict] = field(default_factory=list)
+    save_folder: str | None = None
+    add_suffix: bool = True
+    copy_tags: bool = False
+    chunked: bool = False
+    renditions: list[Rendition] = field(default_factory=list)
+    output_path: str | None = None
+    output_paths: list[str] = field(default_factory=list)
+    status: str = JOB_PENDING
+    stats: JobStats = field(default_factory=JobStats)
+
+
+# --- Постоянная очередь ---
+JOB_ACTIVE_STATUSES = (JOB_RUNNING, JOB_SEARCHING)
+
+
+def _settings_from_dict(data: dict) -> RowSettings:
+    """RowSettings из сохранённого словаря; неизвестные поля (другая версия программы) отбрасываются."""
+    known = {f.name for f in fields(RowSettings)}
+    return RowSettings(**{k: v for k, v in (data or {}).items() if k in known})
+
+
+class JobStore:
+    """
+    Постоянная очередь задач (SQLite в режиме WAL, synchronous=FULL — каждая
+    запись переживает сбой питания). Хранит определение задачи (путь, настройки,
+    выбранные аудио и субтитры, выходы лесенки), статус и выходные файлы.
+
+    Движок пишет статус до действия: задача помечается running вместе с
+    зарезервированными выходными путями раньше запуска ffmpeg. Поэтому после
+    падения recover() знает, какие неполные файлы удалить, а задачи со
+    статусом done при повторном запуске пропускаются. Ошибки базы отключают
+    хранилище, но не останавливают конвертацию.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        try:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=FULL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "key INTEGER PRIMARY KEY, position INTEGER, input_path TEXT, data TEXT, "
+                "status TEXT, output_paths TEXT, updated REAL)"
+            )
+            self._conn.commit()
+        except Exception:
+            self._conn = None
+
+    @property
+    def available(self) -> bool:
+        return self._conn is not None
+
+    @staticmethod
+    def _job_data(job: ConversionJob) -> str:
+        return json.dumps(
+            {
+                "settings": asdict(job.settings),
+                "audio_track": job.audio_track,
+                "audio_channels": job.audio_channels,
+                "subtitles": job.subtitles,
+                "save_folder": job.save_folder,
+                "add_suffix": job.add_suffix,
+                "copy_tags": job.copy_tags,
+                "chunked": job.chunked,
+                "renditions": [asdict(r) for r in job.renditions],
+            },
+            ensure_ascii=False,
+        )
+
+    @staticmethod
+    def _row_job(row: tuple) -> ConversionJob:
+        key, input_path, data, status, output_paths = row
+        data = json.loads(data or "{}")
+        paths = json.loads(output_paths or "[]")
+        return ConversionJob(
+            key=key,
+            input_path=input_path,
+            settings=_settings_from_dict(data.get("settings")),
+            audio_track=data.get("audio_track"),
+            audio_channels=data.get("audio_channels"),
+            subtitles=data.get("subtitles") or [],
+            save_folder=data.get("save_folder"),
+            add_suffix=data.get("add_suffix", True),
+            copy_tags=data.get("copy_tags", False),
+            chunked=data.get("chunked", False),
+            renditions=[Rendition(**r) for r in data.get("renditions") or []],
+            output_path=paths[0] if paths else None,
+            output_paths=paths,
+            status=status or JOB_PENDING,
+        )
+
+    def replace_all(self, jobs: list[ConversionJob]):
+        """Перезаписывает очередь целиком (одной транзакцией) в порядке jobs."""
+        with self._lock:
+            if self._conn is None:
+                return
+            try:
+                with self._conn:
+                    self._conn.execute("DELETE FROM jobs")
+                    self._conn.executemany(
+                        "INSERT INTO jobs (key, position, input_path, data, status, output_paths, updated) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [
+                            (job.key, i, job.input_path, self._job_data(job), job.status, json.dumps(job.output_paths), time.time())
+                            for i, job in enumerate(jobs)
+                        ],
+                    )
+            except Exception:
+                pass
+
+    def append(self, jobs: list[ConversionJob]):
+        """Добавляет задачи в конец очереди (одной транзакцией), не трогая уже записанные."""
+        with self._lock:
+            if self._conn is None:
+                return
+            try:
+                with self._conn:
+                    (last,) = self._conn.execute("SELECT COALESCE(MAX(position), -1) FROM jobs").fetchone()
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO jobs (key, position, input_path, data, status, output_paths, updated) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [
+                            (job.key, last + 1 + i, job.input_path, self._job_data(job), job.status, json.dumps(job.output_paths), time.time())
+                            for i, job in enumerate(jobs)
+                        ],
+                    )
+            except Exception:
+                pass
+
+    def set_status(self, job: ConversionJob):
+        """Статус и выходные файлы задачи; фиксируется сразу (commit)."""
+        with self._lock:
+            if self._conn is None:
+                return
+            try:
+                with self._conn:
+                    self._conn.execute(
+                        "UPDATE jobs SET status=?, output_paths=?, updated=? WHERE key=?",
+                        (job.status, json.dumps(job.output_paths), time.time(), job.key),
+                    )
+            except Exception:
+                pass
+
+    def load(self) -> list[ConversionJob]:
+        """Сохранённые задачи в порядке очереди (без результатов анализа — их даёт probe_media)."""
+        with self._lock:
+            if self._conn is None:
+                return []
+            try:
+                rows = self._conn.execute(
+                    "SELECT key, input_path, data, status, output_paths FROM jobs ORDER BY position"
+                ).fetchall()
+            except Exception:
+                return []
+        jobs = []
+        for row in rows:
+            try:
+                jobs.append(self._row_job(row))
+            except Exception:
+                continue
+        return jobs
+
+    def recover(self, log=_no_log) -> list[ConversionJob]:
+        """
+        Разбор очереди после перезапуска: у задач, прерванных на середине
+        (running/searching), удаляются неполные выходные файлы (и резервирования имён),
+        а сами задачи снова становятся pending. Возвращает все задачи очереди.
+        """
+        jobs = self.load()
+        for job in jobs:
+            if job.status not in JOB_ACTIVE_STATUSES:
+                continue
+            for output in job.output_paths:
+                try:
+                    if discard_output(output):
+                        log(f"🗑 Удалён неполный файл: {os.path.basename(part_path_for(output))}\n")
+                except OSError as e:
+                    log(f"⚠ Не удалось удалить {part_path_for(output)}: {e}\n")
+            job.status = JOB_PENDING
+            job.output_path, job.output_paths = None, []
+            self.set_status(job)
+        return jobs
+
+
+def job_already_done(job: ConversionJob) -> bool:
+    """Задача из сохранённой очереди завершена, и все её выходные файлы на месте."""
+    return job.status == JOB_DONE and bool(job.output_paths) and all(os.path.isfile(p) for p in job.output_paths)
+
+
+def default_queue_path() -> str:
+    return os.path.join(get_app_data_dir(), "queue.sqlite3")
+
+
+class ConversionEngine:
+    """
+    Пул задач конвертации: до max_jobs процессов ffmpeg одновременно.
+    encoders — видеоэнкодер для каждого кодека (обычно выбранный select_encoder);
+    для кодека, которого нет в словаре, берётся программный из CPU_ENCODERS.
+
+    Обратные вызовы выполняются в рабочих потоках:
+    log(text) — строки лога; on_status(job) — смена job.status;
+    on_progress(job, progress) — прогресс задачи и всей очереди.
+    store — постоянная очередь (JobStore), куда записывается каждая смена статуса.
+    """
+
+    def __init__(
+        self,
+        encoders: dict[str, str] | None = None,
+        max_jobs: int = 1,
+        log=None,
+        on_status=None,
+        on_progress=None,
+        debug: bool = False,
+        ffmpeg_path: str | None = None,
+        chunk_seconds: float = 60.0,
+        chunk_workers: int | None = None,
+        store: JobStore | None = None,
+    ):
+        self.encoders = dict(encoders or {})
+        self.store = store
+        self.max_jobs = max_jobs
+        # Режим «по частям» (job.chunked): длина части и число одновременно кодируемых частей.
+        self.chunk_seconds = chunk_seconds
+        self.chunk_workers = chunk_workers or max(2, (os.cpu_count() or 1) // 4)
+        self.log = log or _no_log
+        self.on_status = on_status
+        self.on_progress = on_progress
+        self.debug = debug
+        self.ffmpeg_path = ffmpeg_path or FFMPEG_PATH
+
+        self.cancel_event = threading.Event()
+        # Состояние параллельных задач (ключ — job.key); доступ — только под lock.
+        self.lock = threading.Lock()
+        self.processes: dict[int, subprocess.Popen] = {}
+        self.job_positions: dict[int, float] = {}
+        self.job_speeds: dict[int, float] = {}
+        self.output_files: dict[int, str] = {}
+        self.all_jobs_duration = 0.0
+        self.done_duration = 0.0
+
+    # --- очередь ---
+    def run(self, jobs: list[ConversionJob]) -> list[ConversionJob]:
+        """
+        Выполняет задачи (блокирующе) и возвращает их с итоговыми статусами.
+        Отмена здесь не сбрасывается: cancel(), пришедшая до запуска (например,
+        по сигналу, пока задачи ещё собирались), останавливает и этот запуск.
+        Перед новым запуском после отмены её сбрасывает владелец движка
+        (cancel_event.clear()).
+        """
+        with self.lock:
+            self.processes.clear()
+            self.job_positions.clear()
+            self.job_speeds.clear()
+            self.output_files.clear()
+            self.all_jobs_duration = sum(float(job.duration or 0.0) for job in jobs)
+            self.done_duration = 0.0
+
+        for folder in {output_dir_for(job.save_folder, job.input_path) for job in jobs if job.input_path}:
+            cleanup_orphaned_parts(folder, log=self.log)
+
+        max_jobs = max(1, min(int(self.max_jobs or 1), len(jobs) or 1))
+        if max_jobs > 1:
+            self.log(f"⚙ Параллельных задач: {max_jobs}\n")
+
+        with ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="convert") as pool:
+            futures = [pool.submit(self.run_job, job) for job in jobs]
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    self.log(f"❌ Ошибка задачи: {e}\n")
+
+        with self.lock:
+            self.processes.clear()
+            self.job_positions.clear()
+            self.job_speeds.clear()
+        return jobs
+
+    def cancel(self):
+        """Останавливает все запущенные ffmpeg и удаляет их неполные выходные файлы."""
+        self.cancel_event.set()
+        with self.lock:
+            processes = [p for p in self.processes.values() if p.poll() is None]
+            output_files = list(self.output_files.values())
+
+        if processes:
+            self.log("\n⏹ Отмена конвертации...\n")
+            for process in processes:
+                try:
+                    process.terminate()
+                except Exception as e:
+                    self.log(f"⚠ Ошибка при завершении процесса: {e}\n")
+            time.sleep(0.5)
+            for process in processes:
+                try:
+                    if process.poll() is None and sys.platform.startswith("win"):
+                        subprocess.run(
+                            ["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL,
+                        )
+                    elif process.poll() is None:
+                        process.kill()
+                except Exception:
+                    pass
+            self.log("⏹ Остановлено.\n")
+
+        # удалить временные файлы всех прерванных задач и освободить их имена
+        for output_file in output_files:
+            try:
+                if discard_output(output_file):
+                    self.log(f"🗑 Удалён неполный файл: {os.path.basename(part_path_for(output_file))}\n")
+            except Exception as e:
+                self.log(f"⚠ Не удалось удалить {part_path_for(output_file)}: {e}\n")
+
+        with self.lock:
+            self.output_files.clear()
+
+    # --- одна задача ---
+    def encoder_for(self, settings: RowSettings) -> str:
+        """Видеоэнкодер для выходного кодека задачи."""
+        codec = get_codec_spec(settings.codec).name
+        return self.encoders.get(codec) or CPU_ENCODERS[codec]
+
+    def _set_status(self, job: ConversionJob, status: str):
+        job.status = status
+        if self.store is not None:
+            # до уведомления и до следующего шага: после сбоя очередь знает, что делалось
+            self.store.set_status(job)
+        if self.on_status:
+            self.on_status(job)
+
+    def _finish_job(self, job: ConversionJob):
+        """Переносит длительность завершённой задачи в done_duration."""
+        with self.lock:
+            self.done_duration += float(job.duration or 0.0)
+            self.job_positions.pop(job.key, None)
+            self.job_speeds.pop(job.key, None)
+            self.processes.pop(job.key, None)
+
+    @staticmethod
+    def _output_key(job: ConversionJob, index: int):
+        """Ключ выходного файла в output_files: job.key, у следующих выходов лесенки — (job.key, N)."""
+        return job.key if index == 0 else (job.key, "output", index)
+
+    def _release_outputs(self, job: ConversionJob, count: int):
+        with self.lock:
+            for i in range(count):
+                self.output_files.pop(self._output_key(job, i), None)
+
+    def run_job(self, job: ConversionJob) -> bool:
+        started = time.monotonic()
+        try:
+            return self._run_job(job)
+        finally:
+            job.stats.wall_time = time.monotonic() - started
+
+    def _run_job(self, job: ConversionJob) -> bool:
+        if self.cancel_event.is_set():
+            return False
+
+        path = job.input_path
+        if not path or not os.path.isfile(path):
+            self.log(f"❌ Нет файла: {path}\n")
+            self._set_status(job, JOB_MISSING)
+            self._finish_job(job)
+            return False
+
+        if job.audio_track is None:
+            self.log(f"❌ Нет аудио: {path}\n")
+            self._set_status(job, JOB_NO_AUDIO)
+            self._finish_job(job)
+            return False
+
+        if not job.video_info or not job.audio_streams:
+            # Задача собрана без результатов анализа — один разбор (из кэша) на всё,
+            # чтобы ниже не понадобились отдельные вызовы ffprobe.
+            probe = probe_media(path)
+            job.video_info = job.video_info or parse_video_info(probe)
+            job.audio_streams = job.audio_streams or parse_audio_streams(probe)
+
+        audio_stream = job.audio_streams[job.audio_track] if job.audio_track < len(job.audio_streams) else None
+        audio_channels = job.audio_channels or (audio_stream or {}).get("channels") or 2
+        bitrate = get_audio_bitrate(audio_channels)
+        outputs: list[str] = []
+        try:
+            # Имя занимается временным .vcpart-файлом (O_EXCL): его не выберут ни
+            # соседние задачи, ни другие экземпляры программы, пишущие в ту же папку.
+            for rendition in job.renditions or [None]:
+                if rendition is None:
+                    outputs.append(reserve_output_path(job.save_folder, path, job.add_suffix))
+                else:
+                    outputs.append(reserve_output_path(job.save_folder, path, job.add_suffix, rendition.output_ext, rendition.name))
+        except OSError as e:
+            self.log(f"❌ Не удалось создать выходной файл: {e}\n")
+            for output in outputs:
+                discard_output(output)
+            self._finish_job(job)
+            self._set_status(job, JOB_FAILED)
+            return False
+        with self.lock:
+            for i, output in enumerate(outputs):
+                self.output_files[self._output_key(job, i)] = output
+        output_file = outputs[0]
+        job.output_path = output_file
+        job.output_paths = outputs
+
+        self._set_status(job, JOB_RUNNING)
+        self.log(f"\n{'-' * 30}\nНачало конвертации...\n🎬 Файл: {path}\n")
+        for output in outputs:
+            self.log(f"➡ Выход: {output}\n")
+
+        copy_video, copy_audio, reasons = decide_stream_copy(job.video_info or {}, audio_stream, job.settings)
+        if job.renditions:
+            # выходы лесенки отличаются разрешением — видео всегда кодируется
+            copy_video = False
+            reasons = [r for r in reasons if not r.startswith("видео")]
+        for reason in reasons:
+            self.log(f"🧠 Умное копирование: {reason}\n")
+        if (copy_video, copy_audio) != (job.settings.skip_video, job.settings.skip_audio):
+            job.settings = replace(job.settings, skip_video=copy_video, skip_audio=copy_audio)
+
+        if job.settings.encode_mode == 2 and not job.settings.skip_video:
+            self._set_status(job, JOB_SEARCHING)
+            crf = self._search_quality(job)
+            if crf is None and not self.cancel_event.is_set():
+                crf = QUALITY_FALLBACK_QP
+                self.log(f"⚠ Подбор качества не удался, используется QP={crf}\n")
+            job.settings = replace(job.settings, encode_mode=0, quality=crf or QUALITY_FALLBACK_QP)
+            self._set_status(job, JOB_RUNNING)
+
+        try:
+            job.stats.input_size = os.path.getsize(path)
+        except OSError:
+            pass
+        encode_started = time.monotonic()
+        if self.cancel_event.is_set():
+            ok = False
+        elif job.renditions:
+            ok = self._run_ladder(job, audio_channels, bitrate)
+        elif job.chunked and not job.settings.skip_video and job.duration >= 2 * self.chunk_seconds:
+            ok = self._run_chunked(job, audio_channels, bitrate)
+        else:
+            cmd = self.build_command(job, audio_channels, bitrate)
+            ok = self._run_ffmpeg(job, cmd)
+        job.stats.encode_time = time.monotonic() - encode_started
+
+        if ok and not self.cancel_event.is_set():
+            for output in outputs:
+                part_file = part_path_for(output)
+                if job.copy_tags and os.path.splitext(path)[1].lower() == ".mp4":
+                    tags_ok, tags_err = copy_mp4_tags(path, part_file)
+                    if tags_ok:
+                        self.log("📌 Теги скопированы\n")
+                    else:
+                        self.log(f"⚠ Не удалось скопировать теги: {tags_err}\n")
+                try:
+                    # файл появляется под итоговым именем только целиком
+                    os.replace(part_file, output)
+                except OSError as e:
+                    ok = False
+                    self.log(f"❌ Не удалось переименовать {os.path.basename(part_file)}: {e}\n")
+                    break
+
+        if ok and not self.cancel_event.is_set():
+            job.stats.output_size = sum(os.path.getsize(output) for output in outputs if os.path.isfile(output))
+            self._release_outputs(job, len(outputs))
+            self._finish_job(job)
+            self._set_status(job, JOB_DONE)
+            self.log(f"\n ✅ Конвертация завершена: {os.path.basename(path)}\n")
+            return True
+
+        if self.cancel_event.is_set():
+            # Задача могла запустить ffmpeg уже после того, как cancel()
+            # удалил неполные файлы, — подчищаем за собой.
+            for output in outputs:
+                try:
+                    discard_output(output)
+                except OSError:
+                    pass
+            self._set_status(job, JOB_CANCELLED)
+            return False
+
+        self._release_outputs(job, len(outputs))
+        for output in outputs:
+            try:
+                discard_output(output)
+            except OSError as e:
+                self.log(f"⚠ Не удалось удалить {os.path.basename(part_path_for(output))}: {e}\n")
+        self._finish_job(job)
+        self._set_status(job, JOB_FAILED)
+        return False
+
+    def build_command(self, job: ConversionJob, audio_channels: int, bitrate: str) -> list[str]:
+        eff = job.settings
+        audio_codec_args = build_audio_args(eff.skip_audio, audio_channels, bitrate, self.log)
+        subtitle_map_args, subtitle_codec_args, subtitle_metadata_args = build_subtitle_args(job.subtitles, self.log)
+        video_args = self._build_job_video_args(job)
+
+        return [
+            self.ffmpeg_path,
+            "-hide_banner",
+            "-nostats",
+            "-progress",
+            "pipe:1",
+            "-y",
+            *self._video_input_args(job),
+            "-i",
+            job.input_path,
+            "-map",
+            "0:v:0",
+            "-map",
+            f"0:a:{job.audio_track}",
+            *subtitle_map_args,
+            *video_args,
+            *audio_codec_args,
+            "-map_metadata",
+            "-1",
+            *subtitle_metadata_args,
+            *video_stream_args(self._output_codec(job)),
+            *subtitle_codec_args,
+            part_path_for(job.output_path),
+        ]
+
+    def _build_job_video_args(self, job: ConversionJob) -> list[str]:
+        eff = job.settings
+        return build_video_args(
+            input_path=job.input_path,
+            video_info=job.video_info or {},
+            skip_video=eff.skip_video,
+            encode_mode=eff.encode_mode,
+            qp_slider=eff.quality,
+            limit_res=eff.limit_res,
+            tonemap_mode=eff.tonemapping,
+            encoder=self.encoder_for(eff),
+            log=self.log,
+            tonemapper=eff.tonemapper,
+        )
+
+    def _video_input_args(self, job: ConversionJob) -> list[str]:
+        """Аргументы перед -i: инициализация устройств видеоэнкодера и способа тонмаппинга задачи."""
+        eff = job.settings
+        if eff.skip_video:
+            return []
+        _, needs_tonemap = decide_tonemap(job.input_path, job.video_info or {}, eff.tonemapping, eff.codec)
+        return [*encoder_input_args(self.encoder_for(eff)), *(tonemap_input_args(eff.tonemapper) if needs_tonemap else [])]
+
+    @staticmethod
+    def _output_codec(job: ConversionJob) -> str | None:
+        """Кодек видео в выходном файле: выбранный в настройках или исходный при копировании."""
+        if job.settings.skip_video:
+            return (job.video_info or {}).get("codec")
+        return job.settings.codec
+
+    def _search_quality(self, job: ConversionJob) -> int | None:
+        """
+        Подбор CRF/CQ под целевую оценку качества (encode_mode=2).
+
+        Из исходника вырезаются несколько коротких образцов и пропускаются через
+        те же фильтры, что и основное кодирование (эталон без потерь). Затем
+        двоичным поиском по CRF образцы параллельно кодируются и сравниваются
+        с эталоном (VMAF или SSIM); берётся наибольший CRF, при котором средняя
+        оценка не ниже цели. Результат кэшируется для файла и набора параметров.
+        Возвращает CRF или None, если подбор не удался или отменён.
+        """
+        eff = job.settings
+        metric = eff.quality_metric if eff.quality_metric in QUALITY_METRICS else "vmaf"
+        if not ffmpeg_has_filter(self.ffmpeg_path, "libvmaf" if metric == "vmaf" else "ssim"):
+            self.log(f"⚠ В сборке ffmpeg нет фильтра {metric} — подбор качества невозможен\n")
+            return None
+
+        encoder = self.encoder_for(eff)
+        video_info = job.video_info or {}
+        _, needs_tonemap = decide_tonemap(job.input_path, video_info, eff.tonemapping, eff.codec)
+        bit_depth = output_bit_depth(eff.codec, video_info, needs_tonemap)
+        video_filter = build_video_filter(
+            job.input_path,
+            video_info,
+            eff.limit_res,
+            eff.tonemapping,
+            bit_depth=bit_depth,
+            codec=eff.codec,
+            tonemapper=eff.tonemapper,
+        )
+        params = quality_search_params(replace(eff, quality_metric=metric), video_filter, encoder)
+        cached = PROBE_CACHE.get_quality(job.input_path, params) if PROBE_CACHE is not None else None
+        if cached:
+            self.log(f"🔎 Качество из кэша: CRF {cached['crf']} ({metric.upper()} {cached['score']:.2f})\n")
+            return int(cached["crf"])
+
+        self.log(f"🔎 Подбор качества: цель {metric.upper()} ≥ {eff.quality}\n")
+        work_dir = tempfile.mkdtemp(prefix=".vc_quality_")
+        try:
+            result = self._search_quality_in(job, metric, video_filter, work_dir, encoder, bit_depth, needs_tonemap)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        if result is None:
+            return None
+
+        self.log(f"🔎 Выбран CRF {result['crf']} ({metric.upper()} {result['score']:.2f})\n")
+        if PROBE_CACHE is not None:
+            PROBE_CACHE.put_quality(job.input_path, params, result)
+        return result["crf"]
+
+    def _search_quality_in(
+        self,
+        job: ConversionJob,
+        metric: str,
+        video_filter: str,
+        work_dir: str,
+        encoder: str,
+        bit_depth: int,
+        needs_tonemap: bool,
+    ) -> dict | None:
+        points = quality_sample_points(float(job.duration or 0.0))
+        # эталон уже прошёл фильтры: кандидатам остаётся только формат кадров
+        reference_info = {
+            "requires_tonemap": False,
+            "hdr_type": "SDR",
+            "pix_fmt": "yuv420p10le" if bit_depth >= 10 else "yuv420p",
+        }
+        workers = max(1, min(len(points), self.chunk_workers))
+        threads = max(1, (os.cpu_count() or 1) // workers)
+
+        def make_reference(i: int, point: tuple[float, float]) -> str | None:
+            start, length = point
+            reference = os.path.join(work_dir, f"ref_{i}.mkv")
+            cmd = [
+                self.ffmpeg_path,
+                "-hide_banner",
+                "-nostats",
+                "-y",
+                "-ss",
+                f"{start:.3f}",
+                "-t",
+                f"{length:.3f}",
+                *(tonemap_input_args(job.settings.tonemapper) if needs_tonemap else []),
+                "-i",
+                job.input_path,
+                "-map",
+                "0:v:0",
+                "-vf",
+                video_filter,
+                "-c:v",
+                "libx264",
+                "-preset",
+                "ultrafast",
+                "-qp",
+                "0",
+                reference,
+            ]
+            ok, _ = self._run_quiet(cmd, (job.key, "reference", i), job)
+            return reference if ok else None
+
+        def measure_sample(crf: int, i: int, reference: str) -> float | None:
+            encoded = os.path.join(work_dir, f"crf{crf}_{i}.mp4")
+            encode_cmd = [
+                self.ffmpeg_path,
+                "-hide_banner",
+                "-nostats",
+                "-y",
+                *encoder_input_args(encoder),
+                "-i",
+                reference,
+                "-map",
+                "0:v:0",
+                *build_video_args("", reference_info, False, 0, crf, False, 2, encoder),
+                encoded,
+            ]
+            ok, _ = self._run_quiet(encode_cmd, (job.key, "encode", crf, i), job)
+            if not ok:
+                return None
+            compare_cmd = [
+                self.ffmpeg_path,
+                "-hide_banner",
+                "-nostats",
+                "-i",
+                encoded,
+                "-i",
+                reference,
+                "-lavfi",
+                quality_metric_filter(metric, threads),
+                "-f",
+                "null",
+                "-",
+            ]
+            ok, stderr = self._run_quiet(compare_cmd, (job.key, "compare", crf, i), job)
+            try:
+                os.remove(encoded)
+            except OSError:
+                pass
+            return parse_quality_score(metric, stderr) if ok else None
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="quality") as pool:
+            references = list(pool.map(make_reference, range(len(points)), points))
+            if not all(references):
+                return None
+
+            scores: dict[int, float] = {}
+
+            def measure(crf: int) -> float | None:
+                values = list(pool.map(lambda item: measure_sample(crf, *item), enumerate(references)))
+                if any(value is None for value in values):
+                    return None
+                scores[crf] = sum(values) / len(values)
+                self.log(f"🔎 CRF {crf}: {metric.upper()} {scores[crf]:.2f}\n")
+                return scores[crf]
+
+            # оценка монотонно падает с ростом CRF: ищем наибольший CRF, ещё дающий цель
+            lo, hi = QUALITY_CRF_RANGE
+            best = None
+            while lo <= hi:
+                crf = (lo + hi) // 2
+                score = measure(crf)
+                if score is None:
+                    return None
+                if score >= job.settings.quality:
+                    best = {"crf": crf, "score": score}
+                    lo = crf + 1
+                else:
+                    hi = crf - 1
+
+        if best is None:
+            crf = QUALITY_CRF_RANGE[0]
+            self.log(f"⚠ Цель не достигнута даже при CRF {crf}, используется он\n")
+            best = {"crf": crf, "score": scores.get(crf, 0.0)}
+        return best
+
+    def _run_quiet(self, cmd: list[str], proc_key, job: ConversionJob | None = None) -> tuple[bool, str]:
+        """
+        Запуск вспомогательного ffmpeg без прогресса; отменяется вместе с очередью.
+        Ресурсы процесса добавляются в job.stats. Возвращает (успех, stderr).
+        """
+        if self.cancel_event.is_set():
+            return False, ""
+        try:
+            process = subprocess.Popen(
+                cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                text=True,
+                encoding="utf-8",
+                errors="replace",
+                creationflags=CREATE_NO_WINDOW,
+            )
+        except Exception as e:
+            self.log(f"❌ Не удалось запустить ffmpeg: {e}\n")
+            return False, ""
+        monitor = ProcessMonitor(process)
+        with self.lock:
+            self.processes[proc_key] = process
+        try:
+            # код возврата забирает монитор (os.wait4), поэтому вместо communicate() —
+            # чтение stderr до конца и finish()
+            stderr = process.stderr.read()
+            stats = monitor.finish()
+        finally:
+            with self.lock:
+                self.processes.pop(proc_key, None)
+        if job is not None:
+            with self.lock:
+                job.stats.add_process(stats)
+        if self.cancel_event.is_set():
+            return False, stderr
+        if process.returncode != 0:
+            details = "".join(stderr.splitlines(keepends=True)[-20:]) if not self.debug else ""
+            self.log(f"❌ FFmpeg завершился с кодом {process.returncode}\n{details}")
+            return False, stderr
+        if self.debug:
+            self.log(stderr)
+        return True, stderr
+
+    def build_ladder_command(self, job: ConversionJob, audio_channels: int, bitrate: str) -> list[str]:
+        """Одна команда ffmpeg на все выходы лесенки (job.renditions → job.output_paths)."""
+        eff = job.settings
+        graph_args, video_args = build_ladder_args(
+            input_path=job.input_path,
+            video_info=job.video_info or {},
+            renditions=job.renditions,
+            encode_mode=eff.encode_mode,
+            qp_slider=eff.quality,
+            tonemap_mode=eff.tonemapping,
+            encoder=self.encoder_for(eff),
+            log=self.log,
+            tonemapper=eff.tonemapper,
+        )
+        audio_codec_args = build_audio_args(eff.skip_audio, audio_channels, bitrate, self.log)
+        subtitle_map_args, subtitle_codec_args, subtitle_metadata_args = build_subtitle_args(job.subtitles, self.log)
+
+        cmd = [
+            self.ffmpeg_path,
+            "-hide_banner",
+            "-nostats",
+            "-progress",
+            "pipe:1",
+            "-y",
+            *self._video_input_args(job),
+            "-i",
+            job.input_path,
+            *graph_args,
+        ]
+        for rendition, output_video_args, output in zip(job.renditions, video_args, job.output_paths):
+            cmd += [*output_video_args, "-map", f"0:a:{job.audio_track}", *audio_codec_args, "-map_metadata", "-1"]
+            if rendition.audio_only:
+                cmd += ["-sn"]
+            else:
+                cmd += [*subtitle_map_args, *subtitle_metadata_args, *video_stream_args(eff.codec), *subtitle_codec_args]
+            cmd.append(part_path_for(output))
+        return cmd
+
+    def _run_ladder(self, job: ConversionJob, audio_channels: int, bitrate: str) -> bool:
+        """Лесенка: одно декодирование, несколько выходов; в прогрессе — размер каждого выхода."""
+        cmd = self.build_ladder_command(job, audio_channels, bitrate)
+        parts = [(rendition.name, part_path_for(output)) for rendition, output in zip(job.renditions, job.output_paths)]
+
+        def output_sizes() -> dict:
+            sizes = {}
+            for name, part in parts:
+                try:
+                    sizes[name] = os.path.getsize(part)
+                except OSError:
+                    sizes[name] = 0
+            return {"outputs": sizes}
+
+        ok = self._run_ffmpeg(job, cmd, extra_progress=output_sizes)
+        if ok:
+            sizes = output_sizes()["outputs"]
+            self.log("🪜 " + ", ".join(f"{name}: {human_size(size)}" for name, size in sizes.items()) + "\n")
+        return ok
+
+    def _run_chunked(self, job: ConversionJob, audio_channels: int, bitrate: str) -> bool:
+        """
+        Кодирование одного длинного файла частями в несколько процессов ffmpeg.
+
+        1. Видеопоток без перекодирования режется сегмент-муксером примерно по
+           chunk_seconds; разрез происходит только на ключевых кадрах (обычно это
+           границы сцен/GOP), поэтому части не пересекаются и не теряют кадров.
+        2. Части кодируются параллельно (chunk_workers) с одинаковыми настройками.
+        3. Закодированные части склеиваются concat-демуксером без перекодирования,
+           аудио и субтитры берутся из исходника и муксятся один раз.
+
+        Рабочая папка — контрольная точка: её имя задаёт checkpoint_key, каждая
+        часть появляется в ней под своим именем только закодированной целиком.
+        При отмене, ошибке или сбое папка остаётся, и повторный запуск той же
+        задачи кодирует только недостающие части — теряется не больше одной
+        части на процесс. После успешной склейки папка удаляется.
+        """
+        video_args = self._build_job_video_args(job)
+        key = checkpoint_key(job.input_path, [*self._video_input_args(job), *video_args], self.chunk_seconds)
+        # concat-демуксер разрешает относительные пути от папки списка — нужен абсолютный
+        work_dir = os.path.abspath(os.path.join(os.path.dirname(job.output_path) or ".", f"{CHUNKS_PREFIX}{key}"))
+        os.makedirs(work_dir, exist_ok=True)
+        ok = self._run_chunked_in(job, audio_channels, bitrate, work_dir, video_args)
+        if ok and not self.cancel_event.is_set():
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return ok
+
+    def _split_chunks(self, job: ConversionJob, work_dir: str) -> bool:
+        """Нарезка видеопотока на части (src_*.mkv) и список их границ (segments.csv)."""
+        # остатки нарезки, прерванной на середине, — последняя часть могла остаться неполной
+        for name in os.listdir(work_dir):
+            if name.startswith("src_") or name == "segments.csv":
+                os.remove(os.path.join(work_dir, name))
+
+        duration = float(job.duration or 0.0)
+        cut_points = []
+        t = self.chunk_seconds
+        while t < duration - self.chunk_seconds / 2:
+            cut_points.append(f"{t:.3f}")
+            t += self.chunk_seconds
+
+        split_cmd = [
+            self.ffmpeg_path,
+            "-hide_banner",
+            "-nostats",
+            "-progress",
+            "pipe:1",
+            "-y",
+            "-i",
+            job.input_path,
+            "-map",
+            "0:v:0",
+            "-c",
+            "copy",
+            "-f",
+            "segment",
+            "-segment_times",
+            ",".join(cut_points),
+            "-reset_timestamps",
+            "1",
+            "-segment_format",
+            "matroska",
+            "-segment_list",
+            os.path.join(work_dir, "segments.csv"),
+            "-segment_list_type",
+            "csv",
+            os.path.join(work_dir, "src_%05d.mkv"),
+        ]
+        if not self._run_ffmpeg(job, split_cmd, proc_key=(job.key, "split"), position=lambda _t: 0.0, encode=False):
+            return False
+        # отметка о законченной нарезке: при продолжении её не нужно повторять
+        with open(os.path.join(work_dir, "split.done"), "w", encoding="utf-8"):
+            pass
+        return True
+
+    @staticmethod
+    def _chunk_durations(work_dir: str) -> dict[str, float]:
+        """Длительность частей по segments.csv (имя,начало,конец); пустой словарь, если списка нет."""
+        durations = {}
+        try:
+            with open(os.path.join(work_dir, "segments.csv"), newline="", encoding="utf-8") as f:
+                for row in csv.reader(f):
+                    if len(row) >= 3:
+                        durations[os.path.basename(row[0])] = max(0.0, float(row[2]) - float(row[1]))
+        except (OSError, ValueError):
+            pass
+        return durations
+
+    def _run_chunked_in(
+        self, job: ConversionJob, audio_channels: int, bitrate: str, work_dir: str, video_args: list[str]
+    ) -> bool:
+        resumed = os.path.isfile(os.path.join(work_dir, "split.done"))
+        if not resumed and not self._split_chunks(job, work_dir):
+            return False
+
+        sources = sorted(f for f in os.listdir(work_dir) if f.startswith("src_"))
+        if not sources:
+            self.log("❌ Не удалось разбить файл на части\n")
+            return False
+
+        def encoded_path(name: str) -> str:
+            return os.path.join(work_dir, name.replace("src_", "enc_", 1))
+
+        # готовые части прошлого запуска сразу засчитываются в прогресс
+        durations = self._chunk_durations(work_dir)
+        chunk_times: dict[int, float] = {
+            i: durations.get(name, 0.0) for i, name in enumerate(sources) if os.path.isfile(encoded_path(name))
+        }
+        chunk_lock = threading.Lock()
+        if resumed:
+            self.log(f"♻ Продолжение с контрольной точки: готово частей {len(chunk_times)} из {len(sources)}\n")
+        self.log(f"🧩 По частям: {len(sources)} частей по ~{self.chunk_seconds:.0f} с, параллельно {self.chunk_workers}\n")
+
+        def chunk_position(i: int):
+            def position(t: float) -> float:
+                with chunk_lock:
+                    chunk_times[i] = t
+                    return sum(chunk_times.values())
+            return position
+
+        def encode_chunk(i: int, name: str) -> bool:
+            if i in chunk_times:
+                return True
+            target = encoded_path(name)
+            # часть пишется во временный файл и получает своё имя только целиком
+            root, ext = os.path.splitext(target)
+            temp = f"{root}.tmp{ext}"
+            cmd = [
+                self.ffmpeg_path,
+                "-hide_banner",
+                "-nostats",
+                "-progress",
+                "pipe:1",
+                "-y",
+                *self._video_input_args(job),
+                "-i",
+                os.path.join(work_dir, name),
+                "-map",
+                "0:v:0",
+                *video_args,
+                "-an",
+                "-sn",
+                temp,
+            ]
+            if not self._run_ffmpeg(job, cmd, proc_key=(job.key, i), position=chunk_position(i)):
+                return False
+            os.replace(temp, target)
+            return True
+
+        with ThreadPoolExecutor(max_workers=self.chunk_workers, thread_name_prefix="chunk") as pool:
+            results = list(pool.map(encode_chunk, range(len(sources)), sources))
+        if not all(results) or self.cancel_event.is_set():
+            return False
+
+        list_path = os.path.join(work_dir, "concat.txt")
+        with open(list_path, "w", encoding="utf-8") as f:
+            for name in sources:
+                encoded = encoded_path(name).replace("'", "'\\''")
+                f.write(f"file '{encoded}'\n")
+
+        eff = job.settings
+        audio_codec_args = build_audio_args(eff.skip_audio, audio_channels, bitrate, self.log)
+        subtitle_map_args, subtitle_codec_args, subtitle_metadata_args = build_subtitle_args(job.subtitles, self.log, input_index=1)
+        concat_cmd = [
+            self.ffmpeg_path,
+            "-hide_banner",
+            "-nostats",
+            "-progress",
+            "pipe:1",
+            "-y",
+            "-f",
+            "concat",
+            "-safe",
+            "0",
+            "-i",
+            list_path,
+            "-i",
+            job.input_path,
+            "-map",
+            "0:v:0",
+            "-map",
+            f"1:a:{job.audio_track}",
+            *subtitle_map_args,
+            "-c:v",
+            "copy",
+            *audio_codec_args,
+            "-map_metadata",
+            "-1",
+            *subtitle_metadata_args,
+            *video_stream_args(self._output_codec(job)),
+            *subtitle_codec_args,
+            part_path_for(job.output_path),
+        ]
+        encoded_total = sum(chunk_times.values())
+        self.log("🧩 Склейка частей и муксинг аудио\n")
+        return self._run_ffmpeg(job, concat_cmd, proc_key=(job.key, "concat"), position=lambda _t: encoded_total, encode=False)
+
+    def _run_ffmpeg(
+        self, job: ConversionJob, cmd: list[str], proc_key=None, position=None, extra_progress=None, encode: bool = True
+    ) -> bool:
+        """
+        Запускает ffmpeg и транслирует его прогресс. proc_key — ключ процесса
+        (по умолчанию job.key; у частей файла свой ключ), position(t) — пересчёт
+        времени процесса в позицию всей задачи (для режима «по частям»),
+        extra_progress() — дополнительные поля события прогресса. Ресурсы
+        процесса добавляются в job.stats; кадры и fps — только если encode
+        (а не копирование потоков при нарезке и склейке частей).
+        """
+        proc_key = job.key if proc_key is None else proc_key
+        if self.cancel_event.is_set():
+            return False
+        try:
+            process = subprocess.Popen(
+                cmd,
+                stderr=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                text=True,
+                encoding="utf-8",
+                errors="replace",
+                creationflags=CREATE_NO_WINDOW,
+            )
+        except Exception as e:
+            self.log(f"❌ Не удалось запустить ffmpeg: {e}\n")
+            return False
+        monitor = ProcessMonitor(process)
+        with self.lock:
+            self.processes[proc_key] = process
+            self.job_positions.setdefault(job.key, 0.0)
+
+        # stderr — только для сообщений и ошибок: читаем его отдельным потоком,
+        # чтобы ffmpeg не заблокировался на заполненном канале.
+        stderr_tail: deque[str] = deque(maxlen=20)
+        stderr_thread = threading.Thread(target=self._drain_stderr, args=(process, stderr_tail), daemon=True)
+        stderr_thread.start()
+
+        total_duration = max(float(job.duration or 0.0), 1.0)
+        parser = FfmpegProgressParser()
+        frames_done, last_frame, last_moment = 0, 0, time.monotonic()
+
+        for line in process.stdout:
+            if self.cancel_event.is_set():
+                break
+
+            progress = parser.feed(line)
+            if progress is None or progress["time"] is None:
+                continue
+
+            # мгновенный fps по приросту кадров (ffmpeg сообщает среднее с начала)
+            frame, moment = progress["frame"], time.monotonic()
+            frames_done = frame if frame is not None else frames_done
+            if encode and frame is not None and frame > last_frame and moment - last_moment >= 0.25:
+                with self.lock:
+                    job.stats.fps_history.append((frame - last_frame) / (moment - last_moment))
+                last_frame, last_moment = frame, moment
+
+            current_time = max(progress["time"], 0.0)
+            if position:
+                current_time = position(current_time)
+            with self.lock:
+                self.job_positions[job.key] = min(current_time, total_duration)
+                if progress["speed"] is not None:
+                    self.job_speeds[proc_key] = progress["speed"]
+                overall = self.done_duration + sum(self.job_positions.values())
+                total_speed = sum(self.job_speeds.values())
+                active_jobs = len(self.processes)
+
+            row_progress = min(int(current_time / total_duration * 100), 100)
+            if self.all_jobs_duration > 0:
+                overall_progress = min(int(overall / self.all_jobs_duration * 100), 100)
+            else:
+                overall_progress = row_progress
+
+            # Оставшееся время считаем по суммарной скорости всех активных задач.
+            remaining = (self.all_jobs_duration - overall) / total_speed if total_speed > 0 else None
+
+            if self.on_progress:
+                self.on_progress(
+                    job,
+                    {
+                        **progress,
+                        "row_progress": row_progress,
+                        "overall_progress": overall_progress,
+                        "active_jobs": active_jobs,
+                        "total_speed": total_speed,
+                        "remaining": remaining,
+                        **(extra_progress() if extra_progress else {}),
+                    },
+                )
+
+        # cancel
+        if self.cancel_event.is_set():
+            try:
+                process.terminate()
+                time.sleep(0.3)
+            except Exception:
+                pass
+
+        stats = monitor.finish()
+        rc = process.returncode
+        stderr_thread.join(timeout=2)
+        with self.lock:
+            self.processes.pop(proc_key, None)
+            self.job_speeds.pop(proc_key, None)
+            job.stats.add_process(stats)
+            if encode:
+                job.stats.frames += frames_done
+        if self.cancel_event.is_set():
+            return False
+
+        if rc != 0:
+            details = "".join(stderr_tail) if not self.debug else ""
+            self.log(f"❌ FFmpeg завершился с кодом {rc}\n{details}")
+            return False
+
+        return True
+
+    def _drain_stderr(self, process: subprocess.Popen, tail: deque):
+        """Читает stderr ffmpeg: хранит последние строки для отчёта об ошибке, в debug пишет в лог."""
+        try:
+            for line in process.stderr:
+                tail.append(line)
+                if self.debug:
+                    self.log(line)
+        except Exception:
+            pass
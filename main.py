@@ -1,21 +1,62 @@
+import sys
+
+# Headless-режим: «main.py convert ...» запускает CLI (cli.py) без импорта wxPython.
+if __name__ == "__main__" and len(sys.argv) > 1:
+    from cli import main as cli_main
+
+    sys.exit(cli_main())
+
 import ctypes
-import json
 import os
-import re
 import subprocess
-import sys
 import threading
-import time
 import winreg
 import winsound
-from collections import Counter
-from dataclasses import dataclass
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import wx
-from mutagen.mp4 import MP4
 from wx.adv import AboutDialogInfo
 from wx.lib.agw import ultimatelistctrl as ULC
 
+from engine import (
+    CODECS,
+    DEFAULT_TONEMAPPER,
+    FFMPEG_PATH,
+    FFPROBE_PATH,
+    JOB_CANCELLED,
+    JOB_DONE,
+    JOB_FAILED,
+    JOB_MISSING,
+    JOB_NO_AUDIO,
+    JOB_PENDING,
+    JOB_RUNNING,
+    JOB_SEARCHING,
+    MPV_PATH,
+    PROBE_CACHE,
+    ConversionEngine,
+    ConversionJob,
+    JobStore,
+    TONEMAPPERS,
+    RowSettings,
+    default_queue_path,
+    default_report_path,
+    describe_encoders,
+    detect_capabilities,
+    format_time,
+    job_already_done,
+    get_resource_path,
+    human_size,
+    parse_audio_streams,
+    parse_audio_tracks,
+    parse_subtitle_tracks,
+    parse_video_info,
+    probe_media,
+    select_encoder,
+    summarize_jobs,
+    write_job_report,
+)
+
 # --- HiDPI (Windows only) ---
 if sys.platform.startswith("win"):
     try:
@@ -26,70 +67,10 @@ if sys.platform.startswith("win"):
 __VERSION__ = "0.3.2 test"
 
 
-def get_resource_path(relative_path: str) -> str:
-    """
-    PyInstaller создает временную папку, путь в sys._MEIPASS.
-    В обычном запуске берем текущую папку.
-    """
-    base_path = getattr(sys, "_MEIPASS", os.path.abspath("."))
-    return os.path.join(base_path, relative_path)
-
-
-FFMPEG_PATH = get_resource_path("ffmpeg.exe")
-FFPROBE_PATH = get_resource_path("ffprobe.exe")
-MPV_PATH = get_resource_path("mpv.exe")
-
-
-def get_ffmpeg_version(ffmpeg_path: str) -> dict:
-    try:
-        result = subprocess.run(
-            [ffmpeg_path, "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, creationflags=subprocess.CREATE_NO_WINDOW
-        )
-        output = result.stdout
-
-        if not output:
-            output = result.stderr
-
-        ffmpeg_version_match = re.search(r"ffmpeg version ([\w.-]+)", output)
-        ffmpeg_version = ffmpeg_version_match.group(1) if ffmpeg_version_match else "Unknown"
-
-        libavcodec_match = re.search(r"libavcodec\s+(\d+\.\s*\d+\.\s*\d+)", output)
-        libavcodec_version = libavcodec_match.group(1).replace(" ", "") if libavcodec_match else "Unknown"
-
-        return {"ffmpeg": ffmpeg_version, "libavcodec": libavcodec_version}
-    except FileNotFoundError:
-        return "FFmpeg не установлен"
-
-
-def check_nvenc_available(ffmpeg_path: str) -> bool:
-    """
-    Проверяет, доступен ли аппаратный энкодер NVIDIA NVENC (h264_nvenc).
-    Делает короткий тестовый прогон на синтетическом источнике: если энкодер
-    отсутствует или нет совместимой видеокарты, ffmpeg вернёт ненулевой код.
-    """
-    try:
-        result = subprocess.run(
-            [
-                ffmpeg_path,
-                "-hide_banner",
-                "-f",
-                "lavfi",
-                "-i",
-                "nullsrc=s=256x256:d=0.1",
-                "-c:v",
-                "h264_nvenc",
-                "-f",
-                "null",
-                "-",
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            creationflags=subprocess.CREATE_NO_WINDOW,
-            timeout=20,
-        )
-        return result.returncode == 0
-    except Exception:
-        return False
+# Период обновления интерфейса из фоновых потоков и ограничения лога.
+UI_REFRESH_MS = 100
+LOG_MAX_CHARS = 1_000_000
+LOG_BUFFER_MAX_LINES = 5000
 
 
 def save_reg(name: str, data: str):
@@ -116,398 +97,21 @@ def get_reg(name):
         return
 
 
-def copy_mp4_tags(source_path: str, dest_path: str) -> tuple[bool, str]:
-    """
-    Копирует MP4-теги из исходного файла в выходной.
-    Возвращает (успех, текст_ошибки); текст ошибки пустой при успехе.
-    """
-    try:
-        video = MP4(source_path)
-        new_video = MP4(dest_path)
-        for tag in video.tags:
-            new_video.tags[tag] = video.tags[tag]
-        new_video.save()
-        return True, ""
-    except Exception as e:
-        return False, str(e)
-
-
 def read_from_txt(path: str) -> str:
     with open(path, "r", encoding="utf-8") as f:
         return f.read()
 
 
-def fix_text_encoding(text: str) -> str:
-    """
-    Чинит частый случай mojibake: текст в UTF-8, ошибочно прочитанный как cp1251.
-    Возвращает исходную строку, если перекодировка не нужна или невозможна.
-    """
-    try:
-        repaired = text.encode("cp1251").decode("utf-8")
-    except Exception:
-        return text
-    if any(marker in text for marker in ("Ð", "Ñ", "Â", "Ã")) and repaired:
-        return repaired
-    return text
-
-
-def format_time(seconds: float) -> str:
-    m, s = divmod(int(seconds), 60)
-    h, m = divmod(m, 60)
-    return f"{h:02d}:{m:02d}:{s:02d}"
-
-
-def human_size(num_bytes: int) -> str:
-    try:
-        num = float(num_bytes)
-    except Exception:
-        return "?"
-    for unit in ["B", "KB", "MB", "GB", "TB"]:
-        if num < 1024.0:
-            return f"{num:.1f} {unit}" if unit != "B" else f"{int(num)} {unit}"
-        num /= 1024.0
-    return f"{num:.1f} PB"
-
-
-# --- Определение битрейта по количеству каналов ---
-def get_audio_bitrate(channels: int) -> str:
-    if channels <= 1:
-        return "128k"
-    if channels == 2:
-        return "192k"
-    if channels <= 6:
-        return "384k"
-    if channels >= 8:
-        return "512k"
-    return "256k"
-
-
-def run_ffprobe_json(args: list[str]) -> dict:
-    """
-    Унифицированный вызов ffprobe, возвращает JSON dict (или {}).
-    Консоль НЕ скрываем.
-    """
-    try:
-        p = subprocess.run(
-            args,
-            capture_output=True,
-            text=True,
-            encoding="utf-8",
-            errors="replace",
-            check=True,
-            creationflags=subprocess.CREATE_NO_WINDOW,
-        )
-        if not p.stdout.strip():
-            return {}
-        return json.loads(p.stdout)
-    except Exception:
-        return {}
-
-
-def probe_media(filepath: str) -> dict:
-    """
-    Один вызов ffprobe со всеми потоками и форматом.
-    Возвращает полный JSON (или {}); результат можно разобрать
-    функциями parse_* без повторных запусков ffprobe.
-    """
-    return run_ffprobe_json([
-        FFPROBE_PATH,
-        "-v",
-        "error",
-        "-show_streams",
-        "-show_format",
-        "-of",
-        "json",
-        filepath,
-    ])
-
-
-def _streams_of_type(probe: dict, codec_type: str) -> list[dict]:
-    """Потоки заданного типа (audio/video/subtitle) в порядке контейнера."""
-    return [s for s in (probe.get("streams") or []) if s.get("codec_type") == codec_type]
-
-
-def parse_audio_tracks(probe: dict) -> list[str]:
-    """
-    Возвращает список строк для Choice по разобранному ffprobe-JSON.
-    Важно: stream.index у ffprobe — это индекс потока в контейнере (может быть 1,2,3...),
-    а выбор у пользователя будет 0..N-1 (порядок аудио-стримов).
-    Мы показываем stream.index в тексте, но мапим по порядку (a:0, a:1...).
-    """
-    tracks: list[str] = []
-    for stream in _streams_of_type(probe, "audio"):
-        idx = stream.get("index", "?")
-        codec = stream.get("codec_name", "?")
-        ch = stream.get("channels", "?")
-        br = stream.get("bit_rate")
-        tags = stream.get("tags", {}) or {}
-
-        lang = tags.get("language", "und")
-        title_raw = (tags.get("title") or "").strip()
-        title = fix_text_encoding(title_raw)
-
-        if br:
-            try:
-                br_kbps = int(int(br) / 1000)
-            except Exception:
-                br_kbps = "?"
-        else:
-            br_kbps = "?"
-
-        desc_parts = [f"{idx}: {codec}", f"{ch}ch", f"{br_kbps} kbps", lang]
-        if title:
-            desc_parts.append(f"«{title}»")
-
-        desc = " (" + ", ".join(desc_parts[1:]) + ")"
-        tracks.append(f"{desc_parts[0]}{desc}")
-
-    return tracks
-
-
-def get_audio_tracks(filepath: str) -> list[str]:
-    return parse_audio_tracks(probe_media(filepath))
-
-
-def parse_subtitle_tracks(probe: dict) -> list[dict]:
-    """
-    Возвращает субтитры в порядке s:0, s:1... по разобранному ffprobe-JSON.
-    Для MP4 сохраняем только текстовые дорожки, которые ffmpeg умеет
-    перекодировать в mov_text.
-    """
-    text_codecs = {
-        "subrip",
-        "ass",
-        "ssa",
-        "webvtt",
-        "mov_text",
-        "text",
-    }
-
-    tracks: list[dict] = []
-    for subtitle_order, stream in enumerate(_streams_of_type(probe, "subtitle")):
-        idx = stream.get("index", "?")
-        codec = stream.get("codec_name", "?")
-        tags = stream.get("tags", {}) or {}
-        lang = tags.get("language", "und")
-        title_raw = (tags.get("title") or "").strip()
-        title = fix_text_encoding(title_raw)
-        supported = str(codec).lower() in text_codecs
-
-        desc_parts = [f"{idx}: {codec}", lang]
-        if title:
-            desc_parts.append(f"«{title}»")
-        if not supported:
-            desc_parts.append("не для MP4")
-
-        tracks.append({
-            "order": subtitle_order,
-            "codec": codec,
-            "language": lang,
-            "title": title,
-            "supported": supported,
-            "display": f"{desc_parts[0]} (" + ", ".join(desc_parts[1:]) + ")",
-        })
-
-    return tracks
-
-
-def get_subtitle_tracks(filepath: str) -> list[dict]:
-    return parse_subtitle_tracks(probe_media(filepath))
-
-
-def get_audio_channels(input_file: str, selected_track: int) -> int:
-    """
-    selected_track — это порядковый номер аудио-стрима среди аудио (a:0, a:1...),
-    то есть именно то, что Choice.GetSelection() возвращает.
-    """
-    data = run_ffprobe_json([
-        FFPROBE_PATH,
-        "-v",
-        "error",
-        "-select_streams",
-        f"a:{selected_track}",
-        "-show_entries",
-        "stream=channels",
-        "-of",
-        "json",
-        input_file,
-    ])
-    try:
-        return int((data.get("streams") or [{}])[0].get("channels") or 2)
-    except Exception:
-        return 2
-
-
-def parse_hdr_info(probe: dict) -> dict:
-    """
-    Упрощённый HDR анализ по первому видеопотоку из разобранного ffprobe-JSON.
-    """
-    result = {
-        "is_hdr": False,
-        "type": "SDR",
-        "requires_tonemap": False,
-        "pix_fmt": "?",
-        "color_transfer": "",
-        "color_primaries": "",
-        "color_space": "",
-        "dolby_profile": None,
-    }
-
-    streams = _streams_of_type(probe, "video")
-    if not streams:
-        return result
-
-    stream = streams[0]
-    tags = stream.get("tags", {}) or {}
-
-    color_primaries = (stream.get("color_primaries") or "").lower()
-    color_transfer = (stream.get("color_transfer") or "").lower()
-    color_space = (stream.get("color_space") or "").lower()
-    pix_fmt = stream.get("pix_fmt") or "?"
-
-    result.update({
-        "pix_fmt": pix_fmt,
-        "color_transfer": color_transfer,
-        "color_primaries": color_primaries,
-        "color_space": color_space,
-    })
-
-    # Dolby Vision (очень приблизительно)
-    dv_profile = None
-    for k, v in tags.items():
-        ks = str(k).lower()
-        vs = str(v).lower()
-        if "dolby" in ks or "dv" in ks:
-            if "profile" in vs or vs.isdigit():
-                dv_profile = v
-                break
-
-    if dv_profile:
-        result["is_hdr"] = True
-        result["type"] = f"Dolby Vision (P{dv_profile})"
-        result["dolby_profile"] = dv_profile
-        result["requires_tonemap"] = True
-        return result
-
-    side_data = stream.get("side_data_list", []) or []
-    if any("hdr10plus" in str(d).lower() for d in side_data):
-        result["is_hdr"] = True
-        result["type"] = "HDR10+"
-        result["requires_tonemap"] = True
-        return result
-
-    if "smpte2084" in color_transfer:
-        result["is_hdr"] = True
-        result["type"] = "HDR10 / PQ"
-        result["requires_tonemap"] = True
-    elif "arib-std-b67" in color_transfer or "hlg" in color_transfer:
-        result["is_hdr"] = True
-        result["type"] = "HLG"
-        result["requires_tonemap"] = False
-    elif "bt2020" in color_primaries:
-        result["is_hdr"] = True
-        result["type"] = "BT.2020 SDR"
-        result["requires_tonemap"] = False
-    else:
-        result["is_hdr"] = False
-        result["type"] = "SDR"
-        result["requires_tonemap"] = False
-
-    return result
-
-
-def get_hdr_info(file_path: str) -> dict:
-    return parse_hdr_info(probe_media(file_path))
-
-
-def parse_video_info(probe: dict) -> dict:
-    """Сводная информация о первом видеопотоке и контейнере из разобранного ffprobe-JSON."""
-    info = {
-        "codec": "?",
-        "width": "?",
-        "height": "?",
-        "fps": "?",
-        "aspect": "?",
-        "bitrate": "?",
-        "hdr_type": "SDR",
-        "requires_tonemap": False,
-        "duration": 0.0,
-        "size": 0,
-    }
-
-    videos = _streams_of_type(probe, "video")
-    stream = videos[0] if videos else {}
-    fmt = probe.get("format") or {}
-
-    info["codec"] = stream.get("codec_name", "?")
-    info["width"] = stream.get("width", "?")
-    info["height"] = stream.get("height", "?")
-    info["aspect"] = stream.get("display_aspect_ratio", "?")
-    info["size"] = int(fmt.get("size") or 0)
-
-    # FPS
-    fps_raw = stream.get("r_frame_rate", "0/0")
-    try:
-        num, den = fps_raw.split("/")
-        info["fps"] = round(float(num) / float(den), 2) if float(den) != 0 else "?"
-    except Exception:
-        info["fps"] = "?"
-
-    # bitrate
-    br = stream.get("bit_rate") or fmt.get("bit_rate")
-    if br:
-        try:
-            info["bitrate"] = f"{int(br) / 1_000_000:.2f} Мбит/с"
-        except Exception:
-            info["bitrate"] = "?"
-    else:
-        info["bitrate"] = "?"
-
-    # duration
-    try:
-        info["duration"] = float(fmt.get("duration") or 0.0)
-    except Exception:
-        info["duration"] = 0.0
-
-    hdr = parse_hdr_info(probe)
-    info["hdr_type"] = hdr["type"]
-    info["requires_tonemap"] = bool(hdr["requires_tonemap"])
-
-    return info
-
-
-def get_video_info(filepath: str) -> dict:
-    return parse_video_info(probe_media(filepath))
-
-
-def unique_output_path(save_folder: str, input_path: str, add_conv_suffix: bool = True, output_ext: str = ".mp4") -> str:
-    """
-    Возвращает уникальный путь для выходного файла.
-
-    :param save_folder: Папка для сохранения. Если не существует или пустая,
-                        файл создаётся рядом с input_path.
-    :param input_path: Путь к исходному файлу.
-    :param add_conv_suffix: Добавлять ли суффикс "_conv" к имени файла.
-    :param output_ext: Расширение выходного файла, по умолчанию ".mp4".
-    :return: Уникальный путь к выходному файлу.
-    """
-    input_dir = os.path.dirname(input_path)
-    input_name = os.path.splitext(os.path.basename(input_path))[0]
-
-    target_dir = save_folder if save_folder and os.path.isdir(save_folder) else input_dir
-
-    base_name = f"{input_name}_conv" if add_conv_suffix else input_name
-    out_path = os.path.join(target_dir, f"{base_name}{output_ext}")
-
-    if not os.path.exists(out_path):
-        return out_path
-
-    n = 2
-    while True:
-        candidate = os.path.join(target_dir, f"{base_name}_{n}{output_ext}")
-        if not os.path.exists(candidate):
-            return candidate
-        n += 1
+# Отображение статусов задач движка в строке списка: (текст статуса, значение прогресса).
+JOB_STATUS_LABELS = {
+    JOB_SEARCHING: ("🔎 Подбор качества...", 0),
+    JOB_RUNNING: ("⏳ Конвертация...", 0),
+    JOB_DONE: ("✅ Готово", 100),
+    JOB_CANCELLED: ("⏹ Отменено", 100),
+    JOB_FAILED: ("❌ Ошибка", None),
+    JOB_MISSING: ("❌ Нет файла", 0),
+    JOB_NO_AUDIO: ("❌ Нет аудио", 0),
+}
 
 
 # --- Drag&Drop класс ---
@@ -551,18 +155,34 @@ class SubtitleCheckPopup(wx.ComboPopup):
 
     def on_check(self, event):
         if self.combo:
-            self.combo.update_summary()
+            self.combo.on_checklist_changed()
         event.Skip()
 
 
+def subtitle_summary(total: int, checked: int) -> str:
+    if not total:
+        return "Нет субтитров"
+    if not checked:
+        return "Не выбраны"
+    return f"Выбраны: {checked}"
+
+
 class SubtitleCheckCombo(wx.ComboCtrl):
-    def __init__(self, parent, choices: list[str]):
+    """
+    Выбор субтитров галочками. Отмеченные пункты хранятся в самом контроле
+    (checked), поэтому их можно задать и прочитать до создания всплывающего
+    списка; on_change(checked) вызывается при изменении пользователем.
+    """
+
+    def __init__(self, parent, choices: list[str], checked: list[int] | None = None, on_change=None):
         super().__init__(parent, style=wx.CB_READONLY)
         self.choices = choices
+        self.checked = sorted({i for i in checked or [] if 0 <= i < len(choices)})
+        self.on_change = on_change
         self.popup = SubtitleCheckPopup()
         self.SetPopupControl(self.popup)
         self.popup.combo = self
-        self.SetValue("Нет субтитров" if not choices else "Не выбраны")
+        self.update_summary()
         wx.CallAfter(self.populate_popup)
 
     def populate_popup(self):
@@ -570,51 +190,148 @@ class SubtitleCheckCombo(wx.ComboCtrl):
         if not checklist:
             return
         checklist.Set(self.choices)
+        for i in self.checked:
+            checklist.Check(i)
         self.update_summary()
 
     def GetCheckedItems(self) -> list[int]:
-        checklist = self.popup.checklist
-        if not checklist:
-            return []
-        return [i for i in range(checklist.GetCount()) if checklist.IsChecked(i)]
+        return list(self.checked)
 
     def SetCheckedItems(self, indexes: list[int]):
+        self.checked = sorted({i for i in indexes if 0 <= i < len(self.choices)})
         checklist = self.popup.checklist
-        if not checklist:
-            return
-        wanted = set(indexes)
-        for i in range(checklist.GetCount()):
-            checklist.Check(i, i in wanted)
+        if checklist:
+            for i in range(checklist.GetCount()):
+                checklist.Check(i, i in self.checked)
         self.update_summary()
 
+    def on_checklist_changed(self):
+        checklist = self.popup.checklist
+        self.checked = [i for i in range(checklist.GetCount()) if checklist.IsChecked(i)]
+        self.update_summary()
+        if self.on_change:
+            self.on_change(self.checked)
+
     def update_summary(self):
-        checked = self.GetCheckedItems()
-        if not self.choices:
-            text = "Нет субтитров"
-        elif not checked:
-            text = "Не выбраны"
-        else:
-            text = f"Выбраны: {len(checked)}"
-        self.SetValue(text)
+        self.SetValue(subtitle_summary(len(self.choices), len(self.checked)))
+
 
+def progress_bar_text(value: int, cells: int = 10) -> str:
+    """Прогресс строки текстом: в виртуальном списке нет окон wx.Gauge."""
+    value = max(0, min(100, int(value or 0)))
+    filled = value * cells // 100
+    return f"{'█' * filled}{'░' * (cells - filled)} {value}%"
 
-@dataclass
-class RowSettings:
+
+class QueueRow:
+    """
+    Строка очереди: всё, из чего собирается задача (файл, результат анализа,
+    настройки, выбранные аудиодорожка и субтитры), и её отображаемое состояние
+    (статус, прогресс, итог последнего запуска). Не ссылается на виджеты: у тысяч
+    строк нет ни одного дочернего окна, редакторы создаются только для
+    выделенной строки. Меняется только в UI-потоке; задачи движка собираются
+    из строк при старте очереди (VideoConverter._make_job).
+
+    settings — собственные настройки строки (is_global — «как на панели»),
+    settings_text — их описание для колонки «Параметры». job_status,
+    output_file и output_paths — итог последнего запуска.
     """
-    Настройки кодирования строки.
 
-    is_global=True означает «использовать текущие настройки панели управления»;
-    в этом случае остальные поля игнорируются. Поле quality — значение слайдера:
-    QP (encode_mode=0) или битрейт в Мбит/с (encode_mode=1).
+    __slots__ = (
+        "path",
+        "resolution",
+        "bitrate",
+        "size_bytes",
+        "duration",
+        "video_info",
+        "audio_choices",
+        "audio_streams",
+        "audio_track",
+        "subtitle_tracks",
+        "subtitle_checked",
+        "settings",
+        "settings_text",
+        "status",
+        "progress",
+        "job_status",
+        "output_file",
+        "output_paths",
+    )
+
+    def __init__(
+        self,
+        path: str,
+        resolution: str,
+        bitrate: str,
+        size_bytes: int,
+        duration: float,
+        video_info: dict,
+        audio_choices: list[str],
+        audio_streams: list[dict],
+        subtitle_tracks: list[dict],
+    ):
+        self.path = path
+        self.resolution = resolution
+        self.bitrate = bitrate
+        self.size_bytes = size_bytes
+        self.duration = duration
+        self.video_info = video_info
+        self.audio_choices = audio_choices
+        self.audio_streams = audio_streams
+        self.audio_track: int | None = 0 if audio_choices else None
+        self.subtitle_tracks = subtitle_tracks
+        self.subtitle_checked: list[int] = []
+        self.settings = RowSettings()
+        self.settings_text = "⚙️Глобальные"
+        self.status = "Ожидает"
+        self.progress = 0
+        self.job_status = JOB_PENDING
+        self.output_file: str | None = None
+        self.output_paths: list[str] = []
+
+
+class QueueListCtrl(ULC.UltimateListCtrl):
+    """
+    Виртуальный список очереди: строки не хранятся в контроле, тексты ячеек
+    запрашиваются у модели (row_at(индекс) -> QueueRow) только для строк,
+    которые сейчас рисуются. column_fields — поле QueueRow для каждой колонки.
     """
 
-    is_global: bool = True
-    encode_mode: int = 0
-    quality: int = 22
-    limit_res: bool = False
-    tonemapping: int = 0
-    skip_video: bool = False
-    skip_audio: bool = False
+    def __init__(self, parent, columns: list[str], agwStyle: int):
+        super().__init__(parent, agwStyle=agwStyle | ULC.ULC_VIRTUAL)
+        self.row_at = lambda index: None
+        self._custom_attr = ULC.UltimateListItemAttr(colBack=wx.Colour(255, 251, 235))
+        self.column_fields = columns
+
+    def OnGetItemText(self, item, col):
+        row: QueueRow | None = self.row_at(item)
+        if row is None:
+            return ""
+        column = self.column_fields[col]
+        if column == "name":
+            return os.path.basename(row.path)
+        if column == "size":
+            return human_size(row.size_bytes)
+        if column == "duration":
+            return format_time(row.duration)
+        if column == "audio":
+            track = row.audio_track
+            return row.audio_choices[track] if track is not None and track < len(row.audio_choices) else ""
+        if column == "subtitles":
+            return subtitle_summary(len(row.subtitle_tracks), len(row.subtitle_checked))
+        if column == "progress":
+            return progress_bar_text(row.progress)
+        return getattr(row, column)
+
+    def OnGetItemToolTip(self, item, col):
+        return ""
+
+    def OnGetItemTextColour(self, item, col):
+        return None
+
+    def OnGetItemAttr(self, item):
+        row: QueueRow | None = self.row_at(item)
+        return self._custom_attr if row is not None and not row.settings.is_global else None
 
 
 # --- Основное окно приложения ---
@@ -638,30 +355,59 @@ class VideoConverter(wx.Frame):
         )
         self.Bind(wx.EVT_CLOSE, self.on_close)
 
+        # Канал обновлений UI: фоновые потоки только складывают сюда последнее
+        # состояние (строк, общего прогресса) и текст лога, а таймер в UI-потоке
+        # применяет его с частотой UI_REFRESH_MS — без потока wx.CallAfter на каждую строку.
+        self._ui_lock = threading.Lock()
+        self._pending_log: deque[str] = deque(maxlen=LOG_BUFFER_MAX_LINES)
+        self._pending_log_dropped = 0
+        self._pending_rows: dict[int, dict] = {}
+        self._pending_overall: dict = {}
+
         panel = wx.Panel(self)
         panel.SetDropTarget(FileDropTarget(self))
 
         # состояние
-        # row_widgets ключуется стабильным uid (не индексом строки).
+        # rows (QueueRow) ключуются стабильным uid (не индексом строки).
         # row_order хранит uid в порядке отображения списка — это источник
         # правды для соответствия «индекс строки -> uid».
-        self.row_widgets: dict[int, dict] = {}
+        self.rows: dict[int, QueueRow] = {}
         self.row_order: list[int] = []
+        # редакторы аудио и субтитров существуют только у выделенной строки (editor_uid)
+        self.editor_uid: int | None = None
+        self.audio_editor: wx.Choice | None = None
+        self.subtitle_editor: SubtitleCheckCombo | None = None
         self._next_row_uid = 0
         self.converting = False
-        self.process: subprocess.Popen | None = None
-        self.cancel_event = threading.Event()
         self.queue_thread: threading.Thread | None = None
-        self.all_jobs_duration = 0.0
-        self.done_duration = 0.0
-        self.current_output_file: str | None = None
         self.save_folder: str | None = None
+        # Конвертация выполняется движком (engine.py); интерфейс только
+        # собирает задачи из строк и отображает статусы/прогресс.
+        self.engine = ConversionEngine(log=self.append_log, on_status=self._on_job_status, on_progress=self._on_job_progress)
+        # Постоянная очередь: каждая смена статуса пишется движком сразу, состав
+        # списка — по таймеру, если он изменился (queue_dirty). pending_restore —
+        # задачи прошлого сеанса, ждущие анализа файла (нормализованный путь -> задача).
+        self.job_store = JobStore(default_queue_path())
+        self.engine.store = self.job_store
+        self.queue_dirty = False
+        self.pending_restore: dict[str, ConversionJob] = {}
+        self.max_jobs = 1
+        # фоновый анализ файлов: число потоков ffprobe, порядок добавления строк
+        # и «поколение» списка (увеличивается при очистке для отмены анализа)
+        self.probe_workers = min(8, os.cpu_count() or 1)
+        self.probe_in_order = True
+        self.probe_generation = 0
 
         self.qp_value = 22
         self.bitrate_value = 8
+        self.vmaf_value = 93
         self.log_visible = False
         self.global_settings: RowSettings | None = None
-        self.nvenc_available = True
+        # видеоэнкодер: выбранный пользователем ("auto" — самый быстрый рабочий)
+        # и фактически используемые для каждого кодека; список рабочих приходит из фоновой проверки
+        self.encoder_preference = "auto"
+        self.encoders: dict[str, str] = {}
+        self.working_encoders: list[dict] = []
 
         # layout
         vbox = wx.BoxSizer(wx.VERTICAL)
@@ -711,13 +457,17 @@ class VideoConverter(wx.Frame):
 
         vbox.Add(top, 0, wx.EXPAND)
 
-        # UltimateListCtrl - список файлов
-        self.list = ULC.UltimateListCtrl(
+        # UltimateListCtrl - список файлов (виртуальный: тексты строк берутся из self.rows)
+        self.list = QueueListCtrl(
             panel,
+            columns=["name", "resolution", "bitrate", "size", "duration", "audio", "subtitles", "settings_text", "status", "progress"],
             agwStyle=(
-                wx.LC_REPORT | wx.LC_HRULES | wx.LC_VRULES | wx.LC_NO_SORT_HEADER | ULC.ULC_HAS_VARIABLE_ROW_HEIGHT | ULC.ULC_SHOW_TOOLTIPS
+                wx.LC_REPORT | wx.LC_HRULES | wx.LC_VRULES | wx.LC_NO_SORT_HEADER | ULC.ULC_USER_ROW_HEIGHT | ULC.ULC_SHOW_TOOLTIPS
             ),
         )
+        # высота строки — под редакторы аудио и субтитров выделенной строки
+        self.list.SetUserLineHeight(self.FromDIP(26))
+        self.list.row_at = self._row_at
 
         self.list.InsertColumn(self.COL_FILE, "Файл", width=self.FromDIP(360))
         self.list.InsertColumn(self.COL_RES, "Разрешение", width=self.FromDIP(110))
@@ -727,7 +477,7 @@ class VideoConverter(wx.Frame):
         self.list.InsertColumn(self.COL_AUDIO, "Аудио дорожка", width=self.FromDIP(280))
         self.list.InsertColumn(self.COL_SUBTITLES, "Субтитры", width=self.FromDIP(240))
         self.list.InsertColumn(self.COL_SETTINGS, "Параметры", width=self.FromDIP(170))
-        self.list.InsertColumn(self.COL_STATUS, "Статус", width=self.FromDIP(110))
+        self.list.InsertColumn(self.COL_STATUS, "Статус", width=self.FromDIP(170))
         self.list.InsertColumn(self.COL_PROGRESS, "Прогресс", width=self.FromDIP(160))
         self.list.SetColumnShown(self.COL_SUBTITLES, False)
 
@@ -736,6 +486,8 @@ class VideoConverter(wx.Frame):
         self.list.Bind(wx.EVT_LIST_ITEM_SELECTED, self.on_item_select)
         self.list.Bind(wx.EVT_LIST_ITEM_RIGHT_CLICK, self.on_right_click)
         self.list.Bind(wx.EVT_LIST_ITEM_DESELECTED, self.on_item_deselect)
+        self.list.Bind(wx.EVT_LIST_COL_END_DRAG, self.on_list_layout)
+        self.list.Bind(wx.EVT_SIZE, self.on_list_layout)
 
         vbox.Add(self.list, 1, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, self.FromDIP(5))
 
@@ -746,15 +498,15 @@ class VideoConverter(wx.Frame):
         self.encode_mode = wx.RadioBox(
             panel,
             label="Режим кодирования",
-            choices=["🎯 Постоянное качество (QP)", "📦 Постоянный битрейт (CBR)"],
-            majorDimension=2,
+            choices=["🎯 Постоянное качество (QP)", "📦 Постоянный битрейт (CBR)", "🔎 Целевое качество (VMAF)"],
+            majorDimension=3,
             style=wx.RA_SPECIFY_COLS | wx.NO_BORDER,
         )
         self.encode_mode.SetSelection(0)
         self.encode_mode.Bind(wx.EVT_RADIOBOX, self.on_mode_change)
 
         # чтобы RadioBox не раздувал строку и выглядел аккуратно
-        self.encode_mode.SetMinSize(self.FromDIP(wx.Size(430, -1)))
+        self.encode_mode.SetMinSize(self.FromDIP(wx.Size(630, -1)))
         self.encode_mode.SetToolTip("""QP — уровень качества видео для NVENC.
 Меньше значение = лучше качество и больше размер файла.
 Больше значение = сильнее сжатие и меньше размер файла.
@@ -763,7 +515,12 @@ class VideoConverter(wx.Frame):
 CBR — постоянный битрейт видео.
 Чем выше значение, тем лучше качество и больше размер файла.
 Чем ниже значение, тем сильнее сжатие и меньше размер файла.
-Подходит, когда нужен предсказуемый размер или потоковая передача.""")
+Подходит, когда нужен предсказуемый размер или потоковая передача.
+
+Целевое качество — QP подбирается для каждого файла отдельно:
+несколько коротких фрагментов кодируются с разными QP и сравниваются
+с исходником по метрике VMAF. Выбирается самый экономный QP,
+при котором оценка не ниже заданной. Обычно разумный диапазон: 90–96""")
 
         encode_row.Add(self.encode_mode, 0, wx.ALL | wx.ALIGN_TOP, self.FromDIP(5))
 
@@ -803,10 +560,44 @@ CBR — постоянный битрейт видео.
         self.tonemapping_label = wx.StaticText(panel, label="HDR→SDR:")
         options_box.Add(self.tonemapping_label, 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, self.FromDIP(2))
 
-        self.choice_tonemap = wx.Choice(panel, choices=["Авто", "Вкл", "Выкл"])
+        self.choice_tonemap = wx.Choice(panel, choices=["Авто", "Вкл", "Выкл", "Сохранить HDR"])
         self.choice_tonemap.SetSelection(0)
+        self.choice_tonemap.SetToolTip(
+            "Авто — тонмаппинг HDR10/HDR10+/Dolby Vision в SDR, остальное без изменений.\n"
+            "Вкл — всегда тонмаппинг в SDR.  Выкл — без тонмаппинга.\n"
+            "Сохранить HDR — 10 бит с исходными цветовыми метаданными (mastering display,\n"
+            "MaxCLL/MaxFALL), без медленного тонмаппинга. Только для HEVC и AV1:\n"
+            "для H.264 работает как «Авто»."
+        )
         self.choice_tonemap.Bind(wx.EVT_CHOICE, self.on_tonemapping)
-        options_box.Add(self.choice_tonemap, 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, self.FromDIP(10))
+        options_box.Add(self.choice_tonemap, 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, self.FromDIP(4))
+
+        # способы тонмаппинга: до проверки ffmpeg доступен только эталонный zscale
+        self.tonemapper_names = [DEFAULT_TONEMAPPER]
+        self.choice_tonemapper = wx.Choice(panel, choices=[TONEMAPPERS[DEFAULT_TONEMAPPER].label])
+        self.choice_tonemapper.SetSelection(0)
+        self.choice_tonemapper.SetToolTip(
+            "Способ тонмаппинга HDR→SDR.\n"
+            "zscale — эталонное качество, медленно (float на CPU).\n"
+            "3D LUT — та же кривая, запечённая в таблицу: в 1,5–2 раза быстрее, на глаз без отличий.\n"
+            "libplacebo/OpenCL — на видеокарте, доступны, если их поддерживают ffmpeg и драйвер."
+        )
+        self.choice_tonemapper.Bind(wx.EVT_CHOICE, self.on_tonemapping)
+        options_box.Add(self.choice_tonemapper, 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, self.FromDIP(10))
+
+        self.codec_label = wx.StaticText(panel, label="Кодек:")
+        options_box.Add(self.codec_label, 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, self.FromDIP(2))
+
+        self.choice_codec = wx.Choice(panel, choices=[spec.label for spec in CODECS.values()])
+        self.choice_codec.SetSelection(0)
+        self.choice_codec.SetToolTip(
+            "Выходной видеокодек.\n"
+            "H.264 — совместим со всеми устройствами.\n"
+            "HEVC и AV1 — файлы на 30–50% меньше при том же качестве, кодирование медленнее;\n"
+            "10-битные исходники остаются 10-битными (если тонмаппинг выключен, HDR сохраняется)."
+        )
+        self.choice_codec.Bind(wx.EVT_CHOICE, self.on_codec)
+        options_box.Add(self.choice_codec, 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, self.FromDIP(10))
 
         self.chk_skip_video = wx.CheckBox(panel, label="не конв. видео")
         self.chk_skip_video.SetToolTip(wx.ToolTip("Не конвертировать видео"))
@@ -820,6 +611,17 @@ CBR — постоянный битрейт видео.
         self.chk_skip_audio.Bind(wx.EVT_CHECKBOX, self.on_skip_audio)
         options_box.Add(self.chk_skip_audio, 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, self.FromDIP(5))
 
+        self.chk_smart_copy = wx.CheckBox(panel, label="авто-copy")
+        self.chk_smart_copy.SetToolTip(
+            wx.ToolTip(
+                "Не перекодировать потоки, которые уже подходят: видео в выбранном кодеке, yuv420p SDR "
+                "(в пределах ограничения разрешения) и аудио AAC копируются как есть."
+            )
+        )
+        self.chk_smart_copy.SetValue(True)
+        self.chk_smart_copy.Bind(wx.EVT_CHECKBOX, self.on_smart_copy)
+        options_box.Add(self.chk_smart_copy, 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, self.FromDIP(5))
+
         self.chk_copy_tags = wx.CheckBox(panel, label="копировать теги")
         self.chk_copy_tags.SetToolTip(
             wx.ToolTip("Скопировать теги из исходного файла mp4 в cконвертированный файл. Это глобальная настройка.")
@@ -827,6 +629,17 @@ CBR — постоянный битрейт видео.
         self.chk_copy_tags.SetValue(False)
         options_box.Add(self.chk_copy_tags, 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, self.FromDIP(5))
 
+        self.chk_chunked = wx.CheckBox(panel, label="по частям")
+        self.chk_chunked.SetToolTip(
+            wx.ToolTip(
+                "Кодировать длинные файлы частями в несколько процессов и склеивать без перекодирования.\n"
+                "Ускоряет программное кодирование (libx264) на многоядерных процессорах.\n"
+                "После отмены или сбоя повторный запуск кодирует только недостающие части."
+            )
+        )
+        self.chk_chunked.SetValue(False)
+        options_box.Add(self.chk_chunked, 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, self.FromDIP(5))
+
         self.chk_save_subtitles = wx.CheckBox(panel, label="сохранить субтитры")
         self.chk_save_subtitles.SetToolTip(wx.ToolTip("Показать колонку субтитров и сохранить отмеченные дорожки в MP4."))
         self.chk_save_subtitles.SetValue(False)
@@ -849,7 +662,32 @@ CBR — постоянный битрейт видео.
         self.btn_toggle_log.SetToolTip("Показать/Скрыть лог")
         self.btn_toggle_log.Bind(wx.EVT_BUTTON, self.on_toggle_log)
 
+        self.jobs_label = wx.StaticText(panel, label="Параллельно:")
+        self.spin_jobs = wx.SpinCtrl(panel, min=1, max=max(1, os.cpu_count() or 1), initial=1, size=self.FromDIP(wx.Size(60, -1)))
+        self.spin_jobs.SetToolTip(
+            "Количество файлов, конвертируемых одновременно.\n"
+            "Для CPU (libx264) имеет смысл на многоядерных процессорах и коротких файлах.\n"
+            "Для NVENC число одновременных сессий ограничено драйвером видеокарты."
+        )
+        self.spin_jobs.Bind(wx.EVT_SPINCTRL, self.on_max_jobs)
+
+        self.encoder_label = wx.StaticText(panel, label="Энкодер:")
+        self.choice_encoder = wx.Choice(panel, choices=["Авто"], size=self.FromDIP(wx.Size(190, -1)))
+        self.choice_encoder.SetSelection(0)
+        self.choice_encoder.Disable()
+        self.choice_encoder.SetToolTip(
+            "Видеоэнкодер. «Авто» — самый быстрый из работающих на этом компьютере\n"
+            "(по результатам короткого тестового кодирования при первом запуске).\n"
+            "Выбор относится к кодеку энкодера, для остальных кодеков — «Авто».\n"
+            "Если видеокарта недоступна, используется CPU (libx264 / libx265 / SVT-AV1)."
+        )
+        self.choice_encoder.Bind(wx.EVT_CHOICE, self.on_encoder)
+
         btn_box.Add(self.btn_start, 1, wx.ALL | wx.EXPAND, self.FromDIP(5))
+        btn_box.Add(self.encoder_label, 0, wx.LEFT | wx.ALIGN_CENTER_VERTICAL, self.FromDIP(5))
+        btn_box.Add(self.choice_encoder, 0, wx.ALL | wx.ALIGN_CENTER_VERTICAL, self.FromDIP(5))
+        btn_box.Add(self.jobs_label, 0, wx.LEFT | wx.ALIGN_CENTER_VERTICAL, self.FromDIP(5))
+        btn_box.Add(self.spin_jobs, 0, wx.ALL | wx.ALIGN_CENTER_VERTICAL, self.FromDIP(5))
         btn_box.Add(self.btn_toggle_log, 0, wx.ALL, self.FromDIP(5))
         vbox.Add(btn_box, 0, wx.EXPAND)
 
@@ -882,25 +720,21 @@ CBR — постоянный битрейт видео.
 
         # проверка ffmpeg/ffprobe
         if not os.path.isfile(FFMPEG_PATH):
-            self.log.AppendText("❌ Не найден ffmpeg.exe\n")
+            self.append_log("❌ Не найден ffmpeg.exe\n")
             self.btn_start.Disable()
         if not os.path.isfile(FFPROBE_PATH):
-            self.log.AppendText("❌ Не найден ffprobe.exe\n")
+            self.append_log("❌ Не найден ffprobe.exe\n")
             self.btn_start.Disable()
-        ffmpeg_ver = get_ffmpeg_version(FFMPEG_PATH)
-        if ffmpeg_ver != "FFmpeg не установлен":
-            self.log.AppendText(f"✅ FFmpeg: {ffmpeg_ver['ffmpeg']}, Libavcodec: {ffmpeg_ver['libavcodec']}\n")
-
-        # проверка аппаратного энкодера NVENC
+        # Версия ffmpeg и наличие NVENC определяются в фоне (с кэшем), чтобы окно
+        # появлялось сразу; до ответа конвертацию не запускаем.
+        self.tools_found = os.path.isfile(FFMPEG_PATH) and os.path.isfile(FFPROBE_PATH)
+        self.capabilities_ready = False
         if os.path.isfile(FFMPEG_PATH):
-            self.nvenc_available = check_nvenc_available(FFMPEG_PATH)
-            if self.nvenc_available:
-                self.log.AppendText("✅ NVENC (NVIDIA) доступен: используется аппаратное ускорение (h264_nvenc)\n")
-            else:
-                self.log.AppendText(
-                    "⚠ NVENC недоступен (нет видеокарты NVIDIA или поддержки).\n"
-                    "   Будет использовано программное кодирование на CPU (libx264) — медленнее.\n"
-                )
+            self.btn_start.Disable()
+            self.btn_start.SetToolTip("Проверка ffmpeg и NVENC...")
+            threading.Thread(target=self._detect_capabilities_worker, daemon=True).start()
+        if self.tools_found:
+            self.restore_queue()
 
         # загрузка папки для сохранения
         _save_path = get_reg("save_path")
@@ -908,8 +742,139 @@ CBR — постоянный битрейт видео.
             self.save_folder_txt.SetValue(_save_path)
             self.save_folder = _save_path
 
+        # загрузка числа параллельных задач
+        _max_jobs = get_reg("max_jobs")
+        if _max_jobs and str(_max_jobs).isdigit():
+            self.spin_jobs.SetValue(int(_max_jobs))
+        self.max_jobs = self.spin_jobs.GetValue()
+
+        # предпочтительный видеоэнкодер (применяется после проверки ffmpeg)
+        self.encoder_preference = get_reg("encoder") or "auto"
+
+        # параметры фонового анализа (необязательные ключи реестра)
+        _probe_workers = get_reg("probe_workers")
+        if _probe_workers and str(_probe_workers).isdigit():
+            self.probe_workers = max(1, int(_probe_workers))
+        if get_reg("probe_order") == "completion":
+            self.probe_in_order = False
+
+        self.ui_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_ui_timer, self.ui_timer)
+        self.ui_timer.Start(UI_REFRESH_MS)
+
         self.Show()
 
+    def _detect_capabilities_worker(self):
+        """Фоновый поток: возможности ffmpeg (из кэша или проверкой)."""
+        try:
+            capabilities = detect_capabilities(FFMPEG_PATH)
+        except Exception as e:
+            self.append_log(f"⚠ Не удалось проверить ffmpeg: {e}\n")
+            capabilities = {"version": None, "encoders": [], "nvenc": False, "cached": False}
+        wx.CallAfter(self._on_capabilities, capabilities)
+
+    def _on_capabilities(self, capabilities: dict):
+        """UI-поток: применяет результат проверки ffmpeg и разрешает конвертацию."""
+        version = capabilities.get("version")
+        if version:
+            self.append_log(f"✅ FFmpeg: {version['ffmpeg']}, Libavcodec: {version['libavcodec']}\n")
+
+        # рабочие энкодеры всех кодеков и их скорость в тестовом прогоне
+        self.working_encoders = list(capabilities.get("encoders") or [])
+        self.append_log(f"🧪 Энкодеры: {describe_encoders(capabilities)}\n")
+        if not any(e["kind"] != "cpu" for e in self.working_encoders):
+            self.append_log(
+                "⚠ Аппаратные энкодеры недоступны (нет поддерживаемой видеокарты или драйвера).\n"
+                "   Будет использовано программное кодирование на CPU — медленнее.\n"
+            )
+        self.choice_encoder.Set(["Авто"] + [f"{e['name']} · {e['fps']:.0f} fps" for e in self.working_encoders])
+        names = [e["name"] for e in self.working_encoders]
+        self.choice_encoder.SetSelection(names.index(self.encoder_preference) + 1 if self.encoder_preference in names else 0)
+        self.choice_encoder.Enable()
+        self._apply_encoder_choice()
+
+        tonemappers = [name for name in capabilities.get("tonemappers") or [] if name in TONEMAPPERS]
+        self.tonemapper_names = tonemappers or [DEFAULT_TONEMAPPER]
+        self.choice_tonemapper.Set([TONEMAPPERS[name].label for name in self.tonemapper_names])
+        self.choice_tonemapper.SetSelection(0)
+
+        self.capabilities_ready = True
+        self.btn_start.SetToolTip("")
+        if self.tools_found:
+            self.btn_start.Enable()
+
+    # --- UI updates ---
+    def append_log(self, text: str):
+        """Потокобезопасно добавляет текст в лог (выводится пачкой по таймеру)."""
+        with self._ui_lock:
+            if len(self._pending_log) == self._pending_log.maxlen:
+                self._pending_log_dropped += 1
+            self._pending_log.append(text)
+
+    def _post_row(self, uid: int, status: str | None = None, value: int | None = None, job: tuple | None = None):
+        """
+        Запоминает последнее состояние строки (по uid); промежуточные значения
+        схлопываются. job — (статус задачи, выходные файлы) для QueueRow.
+        """
+        with self._ui_lock:
+            pending = self._pending_rows.setdefault(uid, {})
+            if status is not None:
+                pending["status"] = status
+            if value is not None:
+                pending["value"] = value
+            if job is not None:
+                pending["job"] = job
+
+    def _post_overall(self, value: int | None = None, label: str | None = None):
+        """Запоминает последнее значение общего прогресса и/или текст статуса."""
+        with self._ui_lock:
+            if value is not None:
+                self._pending_overall["value"] = value
+            if label is not None:
+                self._pending_overall["label"] = label
+
+    def on_ui_timer(self, event):
+        with self._ui_lock:
+            log_lines, self._pending_log = list(self._pending_log), deque(maxlen=LOG_BUFFER_MAX_LINES)
+            dropped, self._pending_log_dropped = self._pending_log_dropped, 0
+            rows, self._pending_rows = self._pending_rows, {}
+            overall, self._pending_overall = self._pending_overall, {}
+
+        if log_lines:
+            if dropped:
+                log_lines.insert(0, f"… пропущено строк лога: {dropped}\n")
+            self.log.AppendText("".join(log_lines))
+            # лог — кольцевой буфер: при переполнении отбрасываем старое начало
+            length = self.log.GetLastPosition()
+            if length > LOG_MAX_CHARS:
+                self.log.Remove(0, length - LOG_MAX_CHARS * 3 // 4)
+
+        for uid, pending in rows.items():
+            record = self.rows.get(uid)
+            if record is None:
+                continue  # строка уже удалена
+            if "status" in pending:
+                record.status = pending["status"]
+            if "value" in pending:
+                record.progress = pending["value"]
+            if "job" in pending:
+                record.job_status, record.output_paths = pending["job"]
+                if record.job_status == JOB_DONE and record.output_paths:
+                    record.output_file = record.output_paths[0]
+        if rows:
+            self._refresh_visible_rows()
+        if self.editor_uid is not None:
+            self._place_row_editors()
+
+        if "value" in overall:
+            self.progress.SetValue(overall["value"])
+        if "label" in overall:
+            self.progress_label.SetLabel(overall["label"])
+
+        # пока восстанавливается прошлая очередь, неполный список не должен её затереть
+        if self.queue_dirty and not self.converting and not self.pending_restore:
+            self.save_queue()
+
     # --- UI actions ---
     def browse_files(self, event):
         with wx.FileDialog(
@@ -925,31 +890,93 @@ CBR — постоянный битрейт видео.
         # ffprobe-анализ медленный — выполняем его в фоне, чтобы не блокировать UI.
         # Виджеты строк и лог создаются в UI-потоке через wx.CallAfter.
         if self.converting:
-            self.log.AppendText("\n⚠ Нельзя добавлять файлы во время конвертации.\n")
+            self.append_log("\n⚠ Нельзя добавлять файлы во время конвертации.\n")
             return
         valid_paths = [p for p in paths if p and os.path.isfile(p)]
         if not valid_paths:
             return
-        threading.Thread(target=self._probe_files_worker, args=(valid_paths,), daemon=True).start()
+        threading.Thread(
+            target=self._probe_files_worker,
+            args=(valid_paths, self.probe_generation, self.probe_workers, self.probe_in_order),
+            daemon=True,
+        ).start()
+
+    @staticmethod
+    def _probe_file(path: str) -> tuple[list[str], list[dict], dict, list[dict]]:
+        probe = probe_media(path)  # один вызов ffprobe вместо четырёх
+        return parse_audio_tracks(probe), parse_subtitle_tracks(probe), parse_video_info(probe), parse_audio_streams(probe)
+
+    def _probe_files_worker(self, paths: list[str], generation: int, workers: int, in_order: bool):
+        """
+        Фоновый поток: анализирует файлы ffprobe пулом потоков (ffprobe — отдельный
+        процесс, поэтому GIL не мешает) и передаёт результаты в UI-поток.
 
-    def _probe_files_worker(self, paths: list[str]):
-        """Фоновый поток: анализирует файлы ffprobe и передаёт результат в UI-поток."""
-        for path in paths:
-            try:
-                probe = probe_media(path)  # один вызов ffprobe вместо четырёх
-                tracks = parse_audio_tracks(probe)
-                subtitles = parse_subtitle_tracks(probe)
-                info = parse_video_info(probe)
-            except Exception as e:
-                wx.CallAfter(self.log.AppendText, f"⚠ Не удалось проанализировать файл {path}: {e}\n")
-                continue
-            wx.CallAfter(self._on_file_probed, path, tracks, subtitles, info)
+        in_order=True — строки добавляются в исходном порядке файлов,
+        иначе — по мере готовности. Если список очищен (сменилось поколение
+        probe_generation), необработанные файлы отменяются.
+        """
+        hits_before, misses_before = PROBE_CACHE.stats() if PROBE_CACHE else (0, 0)
+        ready: dict[int, tuple] = {}
+        next_index = 0
+        cancelled = False
+
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ffprobe") as pool:
+            futures = {pool.submit(self._probe_file, path): i for i, path in enumerate(paths)}
+            for future in as_completed(futures):
+                if generation != self.probe_generation:
+                    cancelled = True
+                    for f in futures:
+                        f.cancel()
+                    break
+
+                i = futures[future]
+                path = paths[i]
+                try:
+                    result = (path, *future.result())
+                except Exception as e:
+                    self.append_log(f"⚠ Не удалось проанализировать файл {path}: {e}\n")
+                    self.pending_restore.pop(os.path.normcase(path), None)
+                    result = None
+
+                if not in_order:
+                    if result:
+                        wx.CallAfter(self._on_file_probed, *result, generation=generation)
+                    continue
 
-    def _on_file_probed(self, path: str, tracks: list[str], subtitles: list[dict], info: dict):
+                ready[i] = result
+                while next_index in ready:
+                    result = ready.pop(next_index)
+                    next_index += 1
+                    if result:
+                        wx.CallAfter(self._on_file_probed, *result, generation=generation)
+
+        if PROBE_CACHE:
+            PROBE_CACHE.flush()
+        if cancelled:
+            self.append_log("⏹ Анализ файлов прерван: список очищен.\n")
+            return
+        if PROBE_CACHE:
+            hits, misses = PROBE_CACHE.stats()
+            self.append_log(
+                f"🗃 Кэш ffprobe: попаданий {hits - hits_before}, промахов {misses - misses_before} "
+                f"(всего за сеанс: {hits}/{misses})\n",
+            )
+
+    def _on_file_probed(
+        self,
+        path: str,
+        tracks: list[str],
+        subtitles: list[dict],
+        info: dict,
+        audio_streams: list[dict],
+        generation: int = 0,
+    ):
         """Выполняется в UI-потоке: пишет лог и создаёт строку для проанализированного файла."""
-        self.log.AppendText(f"{'-' * 30}\nДобавлен файл: {path}\n")
+        if generation != self.probe_generation:
+            return  # список очищен после запуска анализа
+        self.append_log(f"{'-' * 30}\nДобавлен файл: {path}\n")
 
-        self.log.AppendText(
+        self.append_log(
             "🎥 Видео:\n"
             f"🔹Кодек: {info['codec']}\n"
             f"🔹Разрешение: {info['width']}×{info['height']}\n"
@@ -961,7 +988,7 @@ CBR — постоянный битрейт видео.
         )
         subtitle_types = Counter(str(track.get("codec", "?")) for track in subtitles)
         subtitle_info = ", ".join(f"{codec}: {count}" for codec, count in subtitle_types.items()) if subtitle_types else "нет"
-        self.log.AppendText(f"💬 Субтитры: {len(subtitles)} ({subtitle_info})\n")
+        self.append_log(f"💬 Субтитры: {len(subtitles)} ({subtitle_info})\n")
 
         self.add_row(
             path=path,
@@ -972,13 +999,23 @@ CBR — постоянный битрейт видео.
             audio_choices=tracks,
             subtitle_tracks=subtitles,
             video_info=info,
+            audio_streams=audio_streams,
         )
 
-    def _widgets_at(self, row: int) -> dict | None:
-        """Виджеты строки по индексу отображения (через стабильный uid из row_order)."""
+    def _row_at(self, row: int) -> QueueRow | None:
+        """Строка по индексу отображения (через стабильный uid из row_order)."""
         if row is None or row < 0 or row >= len(self.row_order):
             return None
-        return self.row_widgets.get(self.row_order[row])
+        return self.rows.get(self.row_order[row])
+
+    def _refresh_visible_rows(self):
+        """Перерисовывает только видимые строки: остальные запросят тексты при прокрутке."""
+        count = self.list.GetItemCount()
+        if not count:
+            return
+        top = max(0, self.list.GetTopItem())
+        # GetCountPerPage у ULC может вернуть дробное число строк
+        self.list.RefreshItems(top, min(count - 1, top + int(self.list.GetCountPerPage()) + 1))
 
     def on_remove_selected(self, event):
         if self.converting:
@@ -996,69 +1033,29 @@ CBR — постоянный битрейт видео.
             wx.MessageBox("Нельзя очищать список во время конвертации.", "Внимание", wx.OK | wx.ICON_WARNING)
             return
 
-        # уничтожаем виджеты
-        for w in self.row_widgets.values():
-            for key in ("choice", "subtitles", "gauge"):
-                try:
-                    ctrl = w.get(key)
-                    if ctrl:
-                        ctrl.Destroy()
-                except Exception:
-                    pass
-
+        self._destroy_row_editors()
+        self.probe_generation += 1  # отменяет незавершённый фоновый анализ
         self.list.DeleteAllItems()
-        self.row_widgets.clear()
+        self.rows.clear()
         self.row_order.clear()
-        self.log.AppendText("\n🧹 Список очищен.\n")
+        self.pending_restore.clear()
+        self.queue_dirty = True
+        self.append_log("\n🧹 Список очищен.\n")
 
     def delete_row(self, row: int):
         if row < 0 or row >= len(self.row_order):
             return
         uid = self.row_order[row]
-        w = self.row_widgets.get(uid)
-        if w:
-            for key in ("choice", "subtitles", "gauge"):
-                try:
-                    if w.get(key):
-                        w[key].Destroy()
-                except Exception:
-                    pass
+        if uid == self.editor_uid:
+            self._destroy_row_editors()
 
+        # у виртуального списка нет окон строк: остальные строки не переиндексируются,
+        # контрол лишь сдвигает выделение и запрашивает тексты заново
         self.list.DeleteItem(row)
         self.row_order.pop(row)
-        self.row_widgets.pop(uid, None)
-        self._reindex_item_windows()
-
-    def _reindex_item_windows(self):
-        """
-        После DeleteItem UltimateListCtrl не пересчитывает _itemId у встроенных
-        виджетов оставшихся строк. Из-за этого у сдвинувшихся строк остаётся
-        устаревший _itemId (у последней — равный GetItemCount()), и при получении
-        фокуса (например, открытии выпадающего списка аудио) OnSetFocus падает
-        с «invalid item index in GetItemState».
-
-        Чиним точечно: сопоставляем каждый встроенный виджет с его текущим
-        индексом строки и обновляем _itemId у соответствующих элементов ULC.
-        """
-        try:
-            items_with_window = self.list._mainWin._itemWithWindow
-        except AttributeError:
-            return
-
-        widget_to_row: dict[int, int] = {}
-        for row in range(self.list.GetItemCount()):
-            widgets = self._widgets_at(row)
-            if not widgets:
-                continue
-            for key in ("choice", "subtitles", "gauge"):
-                ctrl = widgets.get(key)
-                if ctrl is not None:
-                    widget_to_row[id(ctrl)] = row
-
-        for item in items_with_window:
-            wnd = getattr(item, "_wnd", None)
-            if wnd is not None and id(wnd) in widget_to_row:
-                item._itemId = widget_to_row[id(wnd)]
+        self.rows.pop(uid, None)
+        self._place_row_editors()
+        self.queue_dirty = True
 
     def on_mode_change(self, event):
         mode = self.encode_mode.GetSelection()
@@ -1068,12 +1065,18 @@ CBR — постоянный битрейт видео.
             self.qp_slider.SetValue(22)
             self.qp_label.SetLabel("QP = 22")
             self.qp_value = 22
-        else:
+        elif mode == 1:
             self.slider_label.SetLabel("Битрейт (Мбит/с):")
             self.qp_slider.SetRange(2, 25)
             self.qp_slider.SetValue(8)
             self.qp_label.SetLabel("Битрейт = 8.0 Мбит/с")
             self.bitrate_value = 8
+        else:
+            self.slider_label.SetLabel("Цель, VMAF:")
+            self.qp_slider.SetRange(80, 99)
+            self.qp_slider.SetValue(93)
+            self.qp_label.SetLabel("VMAF ≥ 93")
+            self.vmaf_value = 93
 
         self.save_settings_to_sel_rows_and_update_list()
 
@@ -1083,9 +1086,12 @@ CBR — постоянный битрейт видео.
         if mode == 0:
             self.qp_value = val
             self.qp_label.SetLabel(f"QP = {val}")
-        else:
+        elif mode == 1:
             self.bitrate_value = val
             self.qp_label.SetLabel(f"Битрейт = {val:.1f} Мбит/с")
+        else:
+            self.vmaf_value = val
+            self.qp_label.SetLabel(f"VMAF ≥ {val}")
 
         self.save_settings_to_sel_rows_and_update_list()
 
@@ -1097,12 +1103,18 @@ CBR — постоянный битрейт видео.
             self.qp_slider.SetValue(self.global_settings.quality)
             self.qp_label.SetLabel(f"QP = {self.global_settings.quality}")
             self.qp_value = self.global_settings.quality
-        else:
+        elif mode == 1:
             self.slider_label.SetLabel("Битрейт (Мбит/с):")
             self.qp_slider.SetRange(2, 25)
             self.qp_slider.SetValue(self.global_settings.quality)
             self.qp_label.SetLabel(f"Битрейт = {self.global_settings.quality}")
             self.bitrate_value = self.global_settings.quality
+        else:
+            self.slider_label.SetLabel("Цель, VMAF:")
+            self.qp_slider.SetRange(80, 99)
+            self.qp_slider.SetValue(self.global_settings.quality)
+            self.qp_label.SetLabel(f"VMAF ≥ {self.global_settings.quality}")
+            self.vmaf_value = self.global_settings.quality
 
     def on_toggle_log(self, event):
         if self.log_visible:
@@ -1133,27 +1145,19 @@ CBR — постоянный битрейт видео.
 
     def on_save_subtitles(self, event):
         enabled = self.chk_save_subtitles.GetValue()
-        if enabled:
-            for row in range(self.list.GetItemCount()):
-                self.create_subtitle_widget(row)
-        else:
-            for widgets in self.row_widgets.values():
-                subtitles = widgets.get("subtitles")
-                if subtitles:
-                    try:
-                        subtitles.Destroy()
-                    except Exception:
-                        pass
-                widgets["subtitles"] = None
-
         self.list.SetColumnShown(self.COL_SUBTITLES, enabled)
         self.Layout()
+        # выбор субтитров в строках сохраняется; редактор — только у выделенной строки
+        self._show_row_editors(self.editor_uid)
 
     def on_skip_video(self, event):
         if self.chk_skip_video.GetValue():
             self.chk_limit_res.Disable()
             self.tonemapping_label.Disable()
             self.choice_tonemap.Disable()
+            self.choice_tonemapper.Disable()
+            self.codec_label.Disable()
+            self.choice_codec.Disable()
             self.slider_label.Disable()
             self.qp_slider.Disable()
             self.encode_mode.Disable()
@@ -1161,6 +1165,9 @@ CBR — постоянный битрейт видео.
             self.chk_limit_res.Enable()
             self.tonemapping_label.Enable()
             self.choice_tonemap.Enable()
+            self.choice_tonemapper.Enable()
+            self.codec_label.Enable()
+            self.choice_codec.Enable()
             self.slider_label.Enable()
             self.qp_slider.Enable()
             self.encode_mode.Enable()
@@ -1175,12 +1182,12 @@ CBR — постоянный битрейт видео.
         row = self.list.GetFirstSelected()
         if row == -1:
             return
-        widgets = self._widgets_at(row)
-        if not widgets:
+        record = self._row_at(row)
+        if not record:
             return
-        path = widgets.get("path")
+        path = record.path
         if os.path.isfile(path):
-            audio_stream_num = widgets.get("choice").GetSelection() + 1
+            audio_stream_num = (record.audio_track or 0) + 1
             subprocess.Popen(
                 [
                     MPV_PATH,
@@ -1222,11 +1229,11 @@ CBR — постоянный битрейт видео.
         # Пункты меню
         play_item = menu.Append(wx.ID_ANY, "▶ Воспроизвести")
         play_converted_item = menu.Append(wx.ID_ANY, "▶ Воспроизвести сконвертированный файл")
-        widgets = self._widgets_at(item)
-        if not widgets:
+        record = self._row_at(item)
+        if not record:
             menu.Destroy()
             return
-        if self.list.GetItem(item, self.COL_STATUS).GetText() == "✅ Готово" and "output_file" in widgets:
+        if record.job_status == JOB_DONE and record.output_file:
             play_converted_item.Enable()
         else:
             play_converted_item.Enable(False)
@@ -1237,8 +1244,7 @@ CBR — постоянный битрейт видео.
         self.Bind(wx.EVT_MENU, lambda e: wx.CallAfter(self.apply_to_other_files, item), apply_item)
         menu.AppendSeparator()
 
-        settings_obj = widgets.get("settings")
-        if settings_obj and not settings_obj.is_global:
+        if not record.settings.is_global:
             reset_convert_settings_item = menu.Append(wx.ID_ANY, "🔄 Сбросить настройки конвертации")
             menu.AppendSeparator()
             self.Bind(wx.EVT_MENU, lambda e: wx.CallAfter(self.reset_convert_settings, e), reset_convert_settings_item)
@@ -1273,11 +1279,11 @@ CBR — постоянный битрейт видео.
         if row == -1:
             return
 
-        widgets = self._widgets_at(row)
-        if not widgets:
+        record = self._row_at(row)
+        if not record:
             return
 
-        path = widgets.get("path")
+        path = record.path
         if path and os.path.isfile(path):
             subprocess.Popen(f'explorer /select,"{path}"')
 
@@ -1286,10 +1292,10 @@ CBR — постоянный битрейт видео.
         row = self.list.GetFirstSelected()
         if row == -1:
             return
-        widgets = self._widgets_at(row)
-        if not widgets:
+        record = self._row_at(row)
+        if not record:
             return
-        path = widgets.get("output_file", "")
+        path = record.output_file
         if path and os.path.isfile(path):
             subprocess.Popen(f'explorer /select,"{path}"')
 
@@ -1297,11 +1303,11 @@ CBR — постоянный битрейт видео.
         row = self.list.GetFirstSelected()
         if row == -1:
             return
-        widgets = self._widgets_at(row)
-        if not widgets:
+        record = self._row_at(row)
+        if not record:
             return
-        if self.list.GetItem(row, self.COL_STATUS).GetText() == "✅ Готово" and "output_file" in widgets:
-            output_file = widgets.get("output_file")
+        if record.job_status == JOB_DONE and record.output_file:
+            output_file = record.output_file
             if os.path.isfile(output_file):
                 subprocess.Popen(
                     [
@@ -1322,41 +1328,35 @@ CBR — постоянный битрейт видео.
         if self.converting:
             return
 
-        source = self._widgets_at(source_row)
+        source = self._row_at(source_row)
         if not source:
             return
 
-        source_choice: wx.Choice | None = source.get("choice")
-        audio_index = source_choice.GetSelection() if source_choice else wx.NOT_FOUND
-
+        audio_index = source.audio_track
         save_subtitles = self.chk_save_subtitles.GetValue()
-        source_subtitles: SubtitleCheckCombo | None = source.get("subtitles")
-        subtitle_indexes = source_subtitles.GetCheckedItems() if (save_subtitles and source_subtitles) else []
+        subtitle_indexes = list(source.subtitle_checked) if save_subtitles else []
 
         applied = 0
-        for row in range(self.list.GetItemCount()):
-            if row == source_row:
-                continue
-            widgets = self._widgets_at(row)
-            if not widgets:
+        for row, uid in enumerate(self.row_order):
+            record = self.rows.get(uid)
+            if row == source_row or record is None:
                 continue
 
             # Аудио дорожка по номеру
-            choice: wx.Choice | None = widgets.get("choice")
-            if choice and audio_index != wx.NOT_FOUND and audio_index < choice.GetCount():
-                choice.SetSelection(audio_index)
+            if audio_index is not None and audio_index < len(record.audio_choices):
+                record.audio_track = audio_index
 
             # Субтитры по номеру
             if save_subtitles:
-                self.create_subtitle_widget(row)
-                subtitles: SubtitleCheckCombo | None = widgets.get("subtitles")
-                if subtitles:
-                    track_count = len(widgets.get("subtitle_tracks") or [])
-                    subtitles.SetCheckedItems([i for i in subtitle_indexes if i < track_count])
+                record.subtitle_checked = [i for i in subtitle_indexes if i < len(record.subtitle_tracks)]
 
             applied += 1
 
-        self.log.AppendText(
+        self._refresh_visible_rows()
+        self._show_row_editors(self.editor_uid)
+        self.queue_dirty = True
+
+        self.append_log(
             f"\n↪ Настройки дорожек применены к остальным файлам ({applied}).\n"
         )
 
@@ -1371,180 +1371,303 @@ CBR — постоянный битрейт видео.
         audio_choices: list[str],
         subtitle_tracks: list[dict],
         video_info: dict | None = None,
+        audio_streams: list[dict] | None = None,
     ):
-        row = self.list.GetItemCount()
-
-        filename = os.path.basename(path)
-        self.list.InsertStringItem(row, filename)
-
-        self.list.SetStringItem(row, self.COL_RES, resolution)
-        self.list.SetStringItem(row, self.COL_BR, bitrate)
-        self.list.SetStringItem(row, self.COL_TIME, format_time(duration))
-        self.list.SetStringItem(row, self.COL_SIZE, human_size(size_bytes))
-        self.list.SetStringItem(row, self.COL_STATUS, "Ожидает")
-        self.list.SetStringItem(row, self.COL_SETTINGS, "⚙️Глобальные")
-
-        choice = wx.Choice(self.list, choices=audio_choices)
-        if audio_choices:
-            choice.SetSelection(0)
-        self.list.SetItemWindow(row, self.COL_AUDIO, choice, expand=True)
-
-        gauge = wx.Gauge(self.list, range=100, size=self.FromDIP(wx.Size(-1, 18)), style=wx.GA_HORIZONTAL)
-        gauge.SetValue(0)
-        self.list.SetItemWindow(row, self.COL_PROGRESS, gauge, expand=True)
-
         uid = self._next_row_uid
         self._next_row_uid += 1
         self.row_order.append(uid)
-        self.row_widgets[uid] = {
-            "path": path,
-            "choice": choice,
-            "subtitles": None,
-            "subtitle_tracks": subtitle_tracks,
-            "gauge": gauge,
-            "duration": float(duration or 0.0),
-            "info": video_info or {},
-            "settings": RowSettings(),
-        }
+        self.rows[uid] = QueueRow(
+            path=path,
+            resolution=resolution,
+            bitrate=bitrate,
+            size_bytes=int(size_bytes or 0),
+            duration=float(duration or 0.0),
+            video_info=video_info or {},
+            audio_choices=audio_choices,
+            audio_streams=audio_streams or [],
+            subtitle_tracks=subtitle_tracks,
+        )
+        restored = self.pending_restore.pop(os.path.normcase(path), None)
+        if restored:
+            self._apply_restored_job(uid, restored)
+        self.list.SetItemCount(len(self.row_order))
+        self.queue_dirty = True
+
+    def _apply_restored_job(self, uid: int, job: ConversionJob):
+        """Настройки, аудиодорожка и субтитры строки из задачи прошлого сеанса."""
+        record = self.rows[uid]
+        if not job.settings.is_global:
+            record.settings = job.settings
+            record.settings_text = self.get_row_settings_string(job.settings)
+        if job.audio_track is not None and job.audio_track < len(record.audio_choices):
+            record.audio_track = job.audio_track
+        if job.subtitles:
+            orders = {track.get("order") for track in job.subtitles}
+            record.subtitle_checked = [i for i, track in enumerate(record.subtitle_tracks) if track.get("order") in orders]
+
+    # --- Row editors ---
+    def _show_row_editors(self, uid: int | None):
+        """
+        Создаёт редакторы аудиодорожки и субтитров для строки uid (прежние
+        уничтожаются). У остальных строк выбор хранится в QueueRow и рисуется текстом.
+        """
+        self._destroy_row_editors()
+        record = self.rows.get(uid) if uid is not None else None
+        if record is None:
+            return
+        # встроенные окна живут на внутренней области списка, как и у SetItemWindow
+        parent = self.list._mainWin
+        self.editor_uid = uid
+        self.audio_editor = wx.Choice(parent, choices=record.audio_choices)
+        if record.audio_track is not None:
+            self.audio_editor.SetSelection(record.audio_track)
+        self.audio_editor.Bind(wx.EVT_CHOICE, self.on_row_audio_choice)
         if self.chk_save_subtitles.GetValue():
-            self.create_subtitle_widget(row)
+            self.subtitle_editor = SubtitleCheckCombo(
+                parent,
+                choices=[track["display"] for track in record.subtitle_tracks],
+                checked=record.subtitle_checked,
+                on_change=self.on_row_subtitles_checked,
+            )
+        for editor in (self.audio_editor, self.subtitle_editor):
+            if editor:
+                editor.Enable(not self.converting)
+        self._place_row_editors()
+
+    def _destroy_row_editors(self):
+        for editor in (self.audio_editor, self.subtitle_editor):
+            if editor:
+                try:
+                    editor.Destroy()
+                except RuntimeError:
+                    pass
+        self.editor_uid = None
+        self.audio_editor = None
+        self.subtitle_editor = None
+
+    def _place_row_editors(self):
+        """Ставит редакторы поверх ячеек их строки; вне видимой области — прячет."""
+        if self.editor_uid is None:
+            return
+        try:
+            row = self.row_order.index(self.editor_uid)
+        except ValueError:
+            self._destroy_row_editors()
+            return
+        top = self.list.GetTopItem()
+        visible = top <= row <= top + int(self.list.GetCountPerPage())
+        line = self.list._mainWin.GetItemRect(row) if visible else None
+        for col, editor in ((self.COL_AUDIO, self.audio_editor), (self.COL_SUBTITLES, self.subtitle_editor)):
+            if not editor:
+                continue
+            if line is None or not self.list.IsColumnShown(col):
+                editor.Hide()
+                continue
+            x = line.x + sum(self.list.GetColumnWidth(c) for c in range(col) if self.list.IsColumnShown(c))
+            rect = wx.Rect(x + 1, line.y + 1, self.list.GetColumnWidth(col) - 2, line.height - 2)
+            if editor.GetRect() != rect:
+                editor.SetSize(rect)
+            editor.Show()
 
-    def create_subtitle_widget(self, row: int):
-        widgets = self._widgets_at(row)
-        if not widgets or widgets.get("subtitles"):
+    def on_list_layout(self, event):
+        event.Skip()
+        wx.CallAfter(self._place_row_editors)
+
+    def on_row_audio_choice(self, event):
+        record = self.rows.get(self.editor_uid)
+        if record is not None:
+            record.audio_track = event.GetSelection()
+            self.queue_dirty = True
+
+    def on_row_subtitles_checked(self, checked: list[int]):
+        record = self.rows.get(self.editor_uid)
+        if record is not None:
+            record.subtitle_checked = list(checked)
+            self.queue_dirty = True
+
+    # --- Persistent queue ---
+    def restore_queue(self):
+        """
+        Очередь прошлого сеанса: неполные результаты задач, прерванных сбоем,
+        удаляются, незавершённые задачи снова добавляются в список со своими
+        настройками (готовые — нет).
+        """
+        if not self.job_store.available:
+            self.append_log("⚠ Постоянная очередь недоступна, задачи не будут сохраняться\n")
             return
-        subtitle_choices = [track["display"] for track in widgets.get("subtitle_tracks", [])]
-        subtitles = SubtitleCheckCombo(self.list, choices=subtitle_choices)
-        self.list.SetItemWindow(row, self.COL_SUBTITLES, subtitles, expand=True)
-        widgets["subtitles"] = subtitles
+        jobs = [
+            job
+            for job in self.job_store.recover(self.append_log)
+            if not job_already_done(job) and os.path.isfile(job.input_path)
+        ]
+        if not jobs:
+            return
+        self.pending_restore = {os.path.normcase(job.input_path): job for job in jobs}
+        self.append_log(f"♻ Восстановлено задач: {len(jobs)}\n")
+        self.add_files([job.input_path for job in jobs])
+
+    def _queue_snapshot(self) -> list[ConversionJob]:
+        """
+        Задачи в порядке списка для сохранения: собственные настройки строк
+        (глобальные остаются глобальными), статус и выходы последнего запуска.
+        """
+        jobs = []
+        for uid in self.row_order:
+            record = self.rows.get(uid)
+            if record is None:
+                continue
+            tracks = record.subtitle_tracks
+            jobs.append(
+                ConversionJob(
+                    key=uid,
+                    input_path=record.path,
+                    settings=record.settings,
+                    audio_track=record.audio_track,
+                    subtitles=[tracks[i] for i in record.subtitle_checked if i < len(tracks)],
+                    output_paths=list(record.output_paths),
+                    status=record.job_status,
+                )
+            )
+        return jobs
+
+    def save_queue(self):
+        self.queue_dirty = False
+        self.job_store.replace_all(self._queue_snapshot())
 
     # --- Queue ---
     def on_convert(self, event):
         if self.converting:
             self.cancel_conversion()
             return
+        if self.queue_thread is not None and self.queue_thread.is_alive():
+            # прежний запуск ещё сворачивает пул задач: новый делил бы с ним состояние движка
+            self.append_log("⏳ Предыдущая очередь ещё останавливается.\n")
+            return
 
-        if not self.row_widgets:
-            self.log.AppendText("\n⚠ Нет файлов в очереди.\n")
+        if not self.rows:
+            self.append_log("\n⚠ Нет файлов в очереди.\n")
             return
 
-        self.all_jobs_duration = sum(float(w.get("duration") or 0.0) for w in self.row_widgets.values())
-        self.done_duration = 0.0
-        self.cancel_event.clear()
         self.converting = True
 
         self.btn_start.SetLabel("⏹ Отмена")
         self.progress.SetValue(0)
         self.progress_label.SetLabel("Прогресс: 0%")
-        self.log.AppendText(f"{'-' * 30}\n▶ Запуск очереди...\n")
+        self.append_log(f"{'-' * 30}\n▶ Запуск очереди...\n")
 
         self.disable_interface()
 
-        self.queue_thread = threading.Thread(target=self.queue_worker, daemon=True)
+        # Снимок очереди собирается здесь, в потоке интерфейса: рабочий поток
+        # получает готовые задачи и не обращается ни к виджетам, ни к записям строк.
+        jobs = [job for job in (self._make_job(uid) for uid in self.row_order) if job]
+        # состав очереди — до запуска: статусы задач движок дописывает по ключу (uid)
+        self.save_queue()
+        self.engine.encoders = dict(self.encoders)
+        self.engine.max_jobs = self.max_jobs
+        self.engine.debug = self.chk_debug.GetValue()
+        self.engine.cancel_event.clear()
+
+        self.queue_thread = threading.Thread(target=self.queue_worker, args=(jobs,), daemon=True)
         self.queue_thread.start()
 
-    def queue_worker(self):
-        self.current_output_file = None
+    def queue_worker(self, jobs: list[ConversionJob]):
         try:
-            # Снимок порядка строк (uid) на момент старта; во время конвертации
-            # добавление/удаление строк заблокировано, поэтому индексы стабильны.
-            for row, uid in enumerate(list(self.row_order)):
-                if self.cancel_event.is_set():
-                    break
+            self.engine.run(jobs)
 
-                widgets = self.row_widgets.get(uid)
-                if not widgets:
-                    continue
-                path = widgets.get("path")
-                duration = float(widgets.get("duration") or 0.0)
-                gauge: wx.Gauge | None = widgets.get("gauge")
-                choice: wx.Choice | None = widgets.get("choice")
-                if not path or not os.path.isfile(path):
-                    wx.CallAfter(self.list.SetStringItem, row, self.COL_STATUS, "❌ Нет файла")
-                    if gauge:
-                        wx.CallAfter(gauge.SetValue, 0)
-                    continue
-
-                selected_track = choice.GetSelection() if choice else wx.NOT_FOUND
-                if selected_track == wx.NOT_FOUND:
-                    wx.CallAfter(self.list.SetStringItem, row, self.COL_STATUS, "❌ Нет аудио")
-                    if gauge:
-                        wx.CallAfter(gauge.SetValue, 0)
-                    continue
-
-                audio_channels = get_audio_channels(path, selected_track)
-                bitrate = get_audio_bitrate(audio_channels)
-                output_file = unique_output_path(self.save_folder, path, self.toggle_suffix.GetValue())
-                selected_subtitles = self.get_selected_subtitles(widgets) if self.chk_save_subtitles.GetValue() else []
-
-                wx.CallAfter(self.list.SetStringItem, row, self.COL_STATUS, "⏳ Конвертация...")
-                if gauge:
-                    wx.CallAfter(gauge.SetValue, 0)
-
-                wx.CallAfter(self.log.AppendText, f"\n{'-' * 30}\nНачало конвертации...\n🎬 Файл: {path}\n➡ Выход: {output_file}\n")
-                self.current_output_file = output_file
-
-                settings = widgets["settings"]
-
-                ok = self.run_ffmpeg_with_progress(
-                    input_path=path,
-                    output_path=output_file,
-                    selected_track=selected_track,
-                    bitrate=bitrate,
-                    audio_channels=audio_channels,
-                    selected_subtitles=selected_subtitles,
-                    duration=duration,
-                    gauge=gauge,
-                    settings=settings,
-                    video_info=widgets.get("info") or {},
-                )
-
-                if ok and not self.cancel_event.is_set():
-                    widgets.update({"output_file": output_file})
-                    if self.chk_copy_tags.GetValue() and os.path.splitext(path)[1].lower() == ".mp4":
-                        tags_ok, tags_err = copy_mp4_tags(path, output_file)
-                        if tags_ok:
-                            wx.CallAfter(self.log.AppendText, "📌 Теги скопированы\n")
-                        else:
-                            wx.CallAfter(self.log.AppendText, f"⚠ Не удалось скопировать теги: {tags_err}\n")
-                    wx.CallAfter(self.list.SetStringItem, row, self.COL_STATUS, "✅ Готово")
-                    wx.CallAfter(gauge.SetValue, 100)
-                    wx.CallAfter(self.log.AppendText, "\n ✅ Конвертация завершена\n")
-                    self.done_duration += duration
-                elif self.cancel_event.is_set():
-                    wx.CallAfter(self.list.SetStringItem, row, self.COL_STATUS, "⏹ Отменено")
-                    wx.CallAfter(gauge.SetValue, 100)
-                    break
-                else:
-                    wx.CallAfter(self.list.SetStringItem, row, self.COL_STATUS, "❌ Ошибка")
-                    self.done_duration += duration
-
-            if self.cancel_event.is_set():
-                wx.CallAfter(self.progress_label.SetLabel, "⏹ Очередь остановлена пользователем")
+            summary = summarize_jobs(jobs)
+            if summary:
+                self.append_log(summary)
+                try:
+                    report_path = default_report_path()
+                    write_job_report(report_path, jobs, {"encoders": self.engine.encoders, "max_jobs": self.engine.max_jobs})
+                    self.append_log(f"💾 Отчёт о ресурсах: {report_path}\n")
+                except OSError as e:
+                    self.append_log(f"⚠ Не удалось сохранить отчёт о ресурсах: {e}\n")
+
+            if self.engine.cancel_event.is_set():
+                self._post_overall(label="⏹ Очередь остановлена пользователем")
             else:
-                wx.CallAfter(self.progress.SetValue, 100)
-                wx.CallAfter(self.progress_label.SetLabel, "✅ Очередь завершена")
+                self._post_overall(value=100, label="✅ Очередь завершена")
                 winsound.PlaySound(get_resource_path("sound.wav"), winsound.SND_FILENAME | winsound.SND_ASYNC)
 
         finally:
-            self.converting = False
-            self.process = None
-            wx.CallAfter(self.btn_start.SetLabel, "▶ Начать конвертацию")
-            wx.CallAfter(self.progress.SetValue, 0)
-            wx.CallAfter(self.enable_interface)
+            self._post_overall(value=0)
+            wx.CallAfter(self._on_queue_finished)
+
+    def _on_queue_finished(self):
+        """UI-поток: engine.run() вернулся — только теперь можно начинать новую очередь."""
+        if not self:
+            return  # окно уже закрыто
+        self.converting = False
+        self.btn_start.SetLabel("▶ Начать конвертацию")
+        self.btn_start.Enable()
+        self.enable_interface()
+
+    def _make_job(self, uid: int) -> ConversionJob | None:
+        """Собирает задачу движка из записи строки (вызывается в потоке интерфейса)."""
+        record = self.rows.get(uid)
+        if record is None:
+            return None
+        settings = record.settings
+        return ConversionJob(
+            key=uid,
+            input_path=record.path,
+            # действующие настройки: строки или текущие значения панели управления
+            settings=settings if not settings.is_global else self.get_current_settings(),
+            audio_track=record.audio_track,
+            subtitles=self.get_selected_subtitles(record) if self.chk_save_subtitles.GetValue() else [],
+            duration=record.duration,
+            video_info=record.video_info,
+            audio_streams=record.audio_streams,
+            save_folder=self.save_folder,
+            add_suffix=self.toggle_suffix.GetValue(),
+            copy_tags=self.chk_copy_tags.GetValue(),
+            chunked=self.chk_chunked.GetValue(),
+        )
+
+    def _on_job_status(self, job: ConversionJob):
+        """Обратный вызов движка (рабочий поток): статус задачи -> строка списка."""
+        status, value = JOB_STATUS_LABELS.get(job.status, (None, None))
+        # запись строки обновит таймер интерфейса
+        self._post_row(job.key, status=status, value=value, job=(job.status, list(job.output_paths)))
+
+    def _on_job_progress(self, job: ConversionJob, progress: dict):
+        """Обратный вызов движка (рабочий поток): прогресс задачи и очереди."""
+        # размер выходного файла и текущий битрейт — в статусе строки
+        status = None
+        if progress["size"] is not None:
+            status = f"⏳ {human_size(progress['size'])}"
+            if progress["bitrate"] is not None:
+                status += f" · {progress['bitrate'] / 1000:.1f} Мбит/с"
+        self._post_row(job.key, status=status, value=progress["row_progress"])
+
+        overall_progress = progress["overall_progress"]
+        remaining_time = format_time(progress["remaining"]) if progress["remaining"] is not None else "?"
+        if progress["active_jobs"] > 1:
+            label = (
+                f"Очередь: {overall_progress}% │ Задач: {progress['active_jobs']} │ "
+                f"⚡ {progress['total_speed']:.2f}x │ ⏲ {remaining_time}"
+            )
+        else:
+            current_speed = f"{progress['speed']:.2f}" if progress["speed"] is not None else "?"
+            current_fps = f"{progress['fps']:.1f}" if progress["fps"] is not None else "?"
+            label = (
+                f"Очередь: {overall_progress}% │ Файл: {progress['row_progress']}% │ ⚡ {current_speed}x │ "
+                f"🎞️ {current_fps} fps | ⏲ {remaining_time}"
+            )
+        self._post_overall(value=overall_progress, label=label)
 
     def on_item_select(self, event):
         self.global_settings = self.get_current_settings()
+        row = event.GetIndex()
+        if 0 <= row < len(self.row_order) and self.row_order[row] != self.editor_uid:
+            self._show_row_editors(self.row_order[row])
 
-    def get_selected_subtitles(self, widgets: dict) -> list[dict]:
-        subtitle_list: SubtitleCheckCombo | None = widgets.get("subtitles")
-        subtitle_tracks = widgets.get("subtitle_tracks") or []
-        if not subtitle_list:
-            return []
-
+    def get_selected_subtitles(self, record: QueueRow) -> list[dict]:
+        subtitle_tracks = record.subtitle_tracks
         selected: list[dict] = []
         skipped: list[str] = []
-        checked_items = set(subtitle_list.GetCheckedItems())
+        checked_items = set(record.subtitle_checked)
         for i, track in enumerate(subtitle_tracks):
             if i not in checked_items:
                 continue
@@ -1554,311 +1677,22 @@ CBR — постоянный битрейт видео.
                 skipped.append(track.get("display", str(track.get("order", i))))
 
         for item in skipped:
-            wx.CallAfter(self.log.AppendText, f"⚠ Субтитры пропущены, MP4 не поддерживает: {item}\n")
+            self.append_log(f"⚠ Субтитры пропущены, MP4 не поддерживает: {item}\n")
 
         return selected
 
     # --- FFmpeg ---
-    def _resolve_effective_settings(self, settings: RowSettings) -> RowSettings:
-        """
-        Возвращает действующие настройки кодирования: либо настройки строки
-        (если они не «глобальные»), либо текущие значения панели управления.
-        """
-        return settings if not settings.is_global else self.get_current_settings()
-
-    def _build_audio_args(self, skip_audio: bool, audio_channels: int, bitrate: str) -> list[str]:
-        if skip_audio:
-            wx.CallAfter(self.log.AppendText, "🎵 Аудио: copy\n")
-            return ["-c:a", "copy"]
-        wx.CallAfter(self.log.AppendText, f"🎵 Аудио: AAC, {audio_channels}ch, {bitrate}\n")
-        return ["-c:a", "aac", "-ac", str(audio_channels), "-b:a", bitrate]
-
-    def _build_subtitle_args(self, selected_subtitles: list[dict]) -> tuple[list[str], list[str], list[str]]:
-        """Возвращает (map_args, codec_args, metadata_args) для субтитров."""
-        subtitle_map_args: list[str] = []
-        subtitle_codec_args: list[str] = ["-sn"]
-        subtitle_metadata_args: list[str] = []
-        if selected_subtitles:
-            for output_subtitle_index, track in enumerate(selected_subtitles):
-                subtitle_map_args.extend(["-map", f"0:s:{track['order']}"])
-                language = str(track.get("language") or "und")
-                title = str(track.get("title") or "").strip()
-                if language:
-                    subtitle_metadata_args.extend([f"-metadata:s:s:{output_subtitle_index}", f"language={language}"])
-                if title:
-                    subtitle_metadata_args.extend([f"-metadata:s:s:{output_subtitle_index}", f"title={title}"])
-                    subtitle_metadata_args.extend([f"-metadata:s:s:{output_subtitle_index}", f"handler_name={title}"])
-            subtitle_codec_args = ["-c:s", "mov_text"]
-            wx.CallAfter(self.log.AppendText, f"💬 Субтитры: {len(selected_subtitles)} дорожк(и), mov_text\n")
-        else:
-            wx.CallAfter(self.log.AppendText, "💬 Субтитры: нет\n")
-        return subtitle_map_args, subtitle_codec_args, subtitle_metadata_args
-
-    def _build_video_args(
-        self,
-        input_path: str,
-        video_info: dict,
-        skip_video: bool,
-        encode_mode: int,
-        qp_slider: int,
-        limit_res: bool,
-        tonemap_mode: int,
-    ) -> list[str]:
-        """
-        Возвращает аргументы видео для ffmpeg: либо ["-c:v", "copy"], либо
-        полный набор фильтров/энкодера (NVENC или CPU-фолбэк).
-        """
-        if skip_video:
-            wx.CallAfter(self.log.AppendText, "🎥 Видео: copy\n")
-            return ["-c:v", "copy"]
-
-        # Используем данные, собранные при добавлении файла (кэш), без повторного запуска ffprobe.
-        if "requires_tonemap" in video_info:
-            hdr_type = video_info.get("hdr_type") or "SDR"
-            auto_tonemap = bool(video_info.get("requires_tonemap"))
-        else:
-            hdr = get_hdr_info(input_path)
-            hdr_type = hdr["type"]
-            auto_tonemap = bool(hdr["requires_tonemap"])
-
-        if tonemap_mode == 2:
-            needs_tonemap = False
-        elif tonemap_mode == 1:
-            needs_tonemap = True
-        else:
-            needs_tonemap = auto_tonemap
-
-        wx.CallAfter(self.log.AppendText, f"🎨 Видео: {hdr_type}, tonemap={'on' if needs_tonemap else 'off'}\n")
-
-        scale_filter = ""
-        if limit_res:
-            try:
-                w = int(video_info.get("width") or 0)
-                h = int(video_info.get("height") or 0)
-            except Exception:
-                w, h = 0, 0
-            if not (w and h):
-                vinfo = get_video_info(input_path)
-                try:
-                    w = int(vinfo.get("width") or 0)
-                    h = int(vinfo.get("height") or 0)
-                except Exception:
-                    w, h = 0, 0
-            if w > 1920 or h > 1080:
-                scale_filter = ",scale='if(gt(iw,1920),1920,iw):if(gt(ih,1080),1080,ih):force_original_aspect_ratio=decrease'"
-
-        if needs_tonemap:
-            vf_filter = (
-                "zscale=t=linear:npl=30,format=gbrpf32le,"
-                "zscale=p=bt709,tonemap=hable:param=1.5:desat=0,"
-                "zscale=t=bt709:m=bt709:r=pc,format=yuv420p"
-                f"{scale_filter}"
-            )
-        else:
-            vf_filter = f"format=yuv420p{scale_filter}"
-
-        if self.nvenc_available:
-            if encode_mode == 0:
-                rc_args = ["-rc", "vbr", "-cq", str(qp_slider), "-b:v", "0", "-qmin", "0"]
-                wx.CallAfter(self.log.AppendText, f"🎯 Режим: NVENC, QP={qp_slider}\n")
-            else:
-                target_bitrate = f"{int(qp_slider * 1000)}k"
-                rc_args = ["-b:v", target_bitrate, "-maxrate", target_bitrate, "-bufsize", "2M"]
-                wx.CallAfter(self.log.AppendText, f"📦 Режим: NVENC, CBR={target_bitrate}\n")
-            video_encoder_args = [
-                "-c:v", "h264_nvenc",
-                "-preset", "p4",
-                *rc_args,
-                "-profile:v", "high",
-                "-tune", "hq",
-                "-b_ref_mode", "middle",
-                "-spatial_aq", "1",
-            ]
-        else:
-            # Программный фолбэк на CPU, если аппаратный NVENC недоступен.
-            if encode_mode == 0:
-                rc_args = ["-crf", str(qp_slider)]
-                wx.CallAfter(self.log.AppendText, f"🎯 Режим: CPU (libx264), CRF={qp_slider}\n")
-            else:
-                target_bitrate = f"{int(qp_slider * 1000)}k"
-                rc_args = ["-b:v", target_bitrate, "-maxrate", target_bitrate, "-bufsize", "2M"]
-                wx.CallAfter(self.log.AppendText, f"📦 Режим: CPU (libx264), CBR={target_bitrate}\n")
-            video_encoder_args = [
-                "-c:v", "libx264",
-                "-preset", "medium",
-                *rc_args,
-                "-profile:v", "high",
-            ]
-
-        return ["-pix_fmt", "yuv420p", "-vf", vf_filter, *video_encoder_args]
-
-    def run_ffmpeg_with_progress(
-        self,
-        input_path: str,
-        output_path: str,
-        selected_track: int,
-        bitrate: str,
-        audio_channels: int,
-        selected_subtitles: list[dict],
-        duration: float,
-        gauge: wx.Gauge | None,
-        settings: RowSettings,
-        video_info: dict | None = None,
-    ) -> bool:
-        video_info = video_info or {}
-        eff = self._resolve_effective_settings(settings)
-
-        audio_codec_args = self._build_audio_args(eff.skip_audio, audio_channels, bitrate)
-        subtitle_map_args, subtitle_codec_args, subtitle_metadata_args = self._build_subtitle_args(selected_subtitles)
-        video_args = self._build_video_args(
-            input_path=input_path,
-            video_info=video_info,
-            skip_video=eff.skip_video,
-            encode_mode=eff.encode_mode,
-            qp_slider=eff.quality,
-            limit_res=eff.limit_res,
-            tonemap_mode=eff.tonemapping,
-        )
-
-        cmd = [
-            FFMPEG_PATH,
-            "-hide_banner",
-            "-y",
-            "-i",
-            input_path,
-            "-map",
-            "0:v:0",
-            "-map",
-            f"0:a:{selected_track}",
-            *subtitle_map_args,
-            *video_args,
-            *audio_codec_args,
-            "-map_metadata",
-            "-1",
-            *subtitle_metadata_args,
-            "-bsf:v",  # удаление скрытых субтитров (Closed captions EIA-608/CEA-608)
-            "filter_units=remove_types=6",
-            *subtitle_codec_args,
-            output_path,
-        ]
-        try:
-            self.process = subprocess.Popen(
-                cmd,
-                stderr=subprocess.PIPE,
-                stdout=subprocess.DEVNULL,
-                text=True,
-                encoding="utf-8",
-                errors="replace",
-                creationflags=subprocess.CREATE_NO_WINDOW,
-            )
-        except Exception as e:
-            wx.CallAfter(self.log.AppendText, f"❌ Не удалось запустить ffmpeg: {e}\n")
-            return False
-
-        total_duration = max(float(duration or 0.0), 1.0)
-        time_regex = re.compile(r"time=(\d+):(\d+):(\d+\.\d+)")
-        speed_regex = re.compile(r"speed=\s*([\d\.]+)x")
-        fps_regex = re.compile(r"fps=\s*([\d\.]+)")
-
-        current_speed = "?"
-        current_fps = "?"
-
-        for line in self.process.stderr:
-            if self.cancel_event.is_set():
-                break
-
-            if self.chk_debug.GetValue():
-                wx.CallAfter(self.log.AppendText, line)
-
-            m = time_regex.search(line)
-            if not m:
-                continue
-
-            h, mm, ss = m.groups()
-            current_time = int(h) * 3600 + int(mm) * 60 + float(ss)
-
-            row_progress = min(int(current_time / total_duration * 100), 100)
-
-            overall = self.done_duration + current_time
-            if self.all_jobs_duration > 0:
-                overall_progress = min(int(overall / self.all_jobs_duration * 100), 100)
-            else:
-                overall_progress = row_progress
-
-            sm = speed_regex.search(line)
-            if sm:
-                current_speed = sm.group(1)
-            fm = fps_regex.search(line)
-            if fm:
-                current_fps = fm.group(1)
-
-            seconds_to_convert = self.all_jobs_duration - overall
-            try:
-                remaining_time = format_time(seconds_to_convert / float(current_speed))
-            except Exception:
-                remaining_time = "?"
-
-            wx.CallAfter(self.progress.SetValue, overall_progress)
-            if gauge:
-                wx.CallAfter(gauge.SetValue, row_progress)
-
-            wx.CallAfter(
-                self.progress_label.SetLabel,
-                f"Очередь: {overall_progress}% │ Файл: {row_progress}% │ ⚡ {current_speed}x │ 🎞️ {current_fps} fps | ⏲ {remaining_time}",
-            )
-
-        # cancel
-        if self.cancel_event.is_set():
-            try:
-                self.process.terminate()
-                time.sleep(0.3)
-            except Exception:
-                pass
-
-        rc = self.process.wait() if self.process else -1
-        if self.cancel_event.is_set():
-            return False
-
-        if rc != 0:
-            wx.CallAfter(self.log.AppendText, f"❌ FFmpeg завершился с кодом {rc}\n")
-            return False
-
-        return True
-
     # --- Cancel / close ---
     def cancel_conversion(self):
-        self.cancel_event.set()
-        if self.process and self.process.poll() is None:
-            try:
-                self.log.AppendText("\n⏹ Отмена конвертации...\n")
-                self.process.terminate()
-                time.sleep(0.5)
-                try:
-                    if self.process.poll() is None and sys.platform.startswith("win"):
-                        subprocess.run(
-                            ["taskkill", "/F", "/T", "/PID", str(self.process.pid)],
-                            stdout=subprocess.DEVNULL,
-                            stderr=subprocess.DEVNULL,
-                        )
-                except Exception:
-                    pass
-                self.log.AppendText("⏹ Остановлено.\n")
-            except Exception as e:
-                self.log.AppendText(f"⚠ Ошибка при завершении процесса: {e}\n")
-
-        # удалить текущий неполный файл
-        if self.current_output_file and os.path.exists(self.current_output_file):
-            try:
-                os.remove(self.current_output_file)
-                self.log.AppendText(f"🗑 Удалён неполный файл: {os.path.basename(self.current_output_file)}\n")
-            except Exception as e:
-                self.log.AppendText(f"⚠ Не удалось удалить {self.current_output_file}: {e}\n")
-
-        self.process = None
-        self.converting = False
-        wx.CallAfter(self.progress.SetValue, 0)
-        wx.CallAfter(self.btn_start.SetLabel, "▶ Начать конвертацию")
-        wx.CallAfter(self.progress_label.SetLabel, "⏹ Отменено пользователем")
+        """
+        Останавливает очередь. converting остаётся True, а кнопка — выключенной,
+        пока рабочий поток не выйдет из engine.run() (_on_queue_finished): у пула
+        ещё есть задачи, и новый запуск делил бы с ними процессы и файлы движка.
+        """
+        self.btn_start.Disable()
+        self.btn_start.SetLabel("⏳ Остановка...")
+        self.engine.cancel()
+        self._post_overall(value=0, label="⏹ Отменено пользователем")
 
     def on_close(self, event):
         if self.converting:
@@ -1871,6 +1705,12 @@ CBR — постоянный битрейт видео.
                 event.Veto()
                 return
             self.cancel_conversion()
+            # дать пулу свернуться: отменённые задачи удаляют свои временные файлы
+            if self.queue_thread is not None:
+                self.queue_thread.join(timeout=10)
+        self.ui_timer.Stop()
+        if not self.pending_restore:
+            self.save_queue()
         self.Destroy()
 
     def _conversion_locked_controls(self) -> list:
@@ -1889,18 +1729,24 @@ CBR — постоянный битрейт видео.
             self.chk_limit_res,
             self.tonemapping_label,
             self.choice_tonemap,
+            self.choice_tonemapper,
+            self.codec_label,
+            self.choice_codec,
             self.chk_skip_video,
             self.chk_skip_audio,
+            self.chk_smart_copy,
             self.chk_copy_tags,
+            self.chk_chunked,
+            self.jobs_label,
+            self.spin_jobs,
+            self.choice_encoder,
         ]
 
     def _set_rows_enabled(self, enabled: bool):
-        """Блокирует/разблокирует виджеты выбора дорожек в строках списка."""
-        for widgets in self.row_widgets.values():
-            for key in ("choice", "subtitles"):
-                ctrl = widgets.get(key)
-                if ctrl:
-                    ctrl.Enable(enabled)
+        """Блокирует/разблокирует редакторы выбора дорожек (они есть только у выделенной строки)."""
+        for editor in (self.audio_editor, self.subtitle_editor):
+            if editor:
+                editor.Enable(enabled)
 
     def disable_interface(self):
         for ctrl in self._conversion_locked_controls():
@@ -1917,6 +1763,9 @@ CBR — постоянный битрейт видео.
                 self.chk_limit_res,
                 self.tonemapping_label,
                 self.choice_tonemap,
+                self.choice_tonemapper,
+                self.codec_label,
+                self.choice_codec,
                 self.slider_label,
                 self.qp_slider,
                 self.encode_mode,
@@ -1944,6 +1793,9 @@ CBR — постоянный битрейт видео.
             tonemapping=self.choice_tonemap.GetSelection(),
             skip_video=self.chk_skip_video.GetValue(),
             skip_audio=self.chk_skip_audio.GetValue(),
+            smart_copy=self.chk_smart_copy.GetValue(),
+            codec=list(CODECS)[self.choice_codec.GetSelection()],
+            tonemapper=self.tonemapper_names[max(self.choice_tonemapper.GetSelection(), 0)],
         )
 
     def reset_global_settings(self):
@@ -1953,19 +1805,27 @@ CBR — постоянный битрейт видео.
             self.on_mode_and_qp_reset()
             self.chk_limit_res.SetValue(self.global_settings.limit_res)
             self.choice_tonemap.SetSelection(self.global_settings.tonemapping)
+            self.choice_codec.SetSelection(list(CODECS).index(self.global_settings.codec))
+            if self.global_settings.tonemapper in self.tonemapper_names:
+                self.choice_tonemapper.SetSelection(self.tonemapper_names.index(self.global_settings.tonemapper))
             self.chk_skip_video.SetValue(self.global_settings.skip_video)
             if self.global_settings.skip_video:
                 self.on_skip_video(None)
             self.chk_skip_audio.SetValue(self.global_settings.skip_audio)
+            self.chk_smart_copy.SetValue(self.global_settings.smart_copy)
 
-    def get_row_settings_string(self, row: int, settings: RowSettings):
+    def get_row_settings_string(self, settings: RowSettings) -> str:
         if settings.skip_video:
             video_str = "В: не конв."
         else:
             if settings.encode_mode == 0:
                 video_str = f"QP={settings.quality}"
-            else:
+            elif settings.encode_mode == 1:
                 video_str = f"CBR={settings.quality}"
+            else:
+                video_str = f"VMAF≥{settings.quality}"
+            if settings.codec != "h264":
+                video_str = f"{CODECS[settings.codec].label}, {video_str}"
             if settings.limit_res:
                 video_str += ", fullHD"
             tm_string = settings.tonemapping
@@ -1975,36 +1835,70 @@ CBR — постоянный битрейт видео.
                 video_str += ", TM=вкл"
             elif tm_string == 0:
                 video_str += ", TM=auto"
+            elif tm_string == 3:
+                video_str += ", HDR"
+            if tm_string in (0, 1) and settings.tonemapper != DEFAULT_TONEMAPPER:
+                video_str += f" ({settings.tonemapper})"
 
         if settings.skip_audio:
             audio_str = ", А: не конв."
         else:
             audio_str = ""
-        return f"{video_str}{audio_str}"
+        copy_str = "" if settings.smart_copy else ", без авто-copy"
+        return f"{video_str}{audio_str}{copy_str}"
 
     def save_settings_to_sel_rows_and_update_list(self):
         item_index = self.list.GetFirstSelected()
         while item_index != -1:
             settings = self.get_current_settings()
-            widgets = self._widgets_at(item_index)
-            if widgets:
-                widgets["settings"] = settings
-            self.list.SetStringItem(item_index, self.COL_SETTINGS, self.get_row_settings_string(item_index, settings))
-            self.list.SetItemBackgroundColour(item_index, wx.Colour(255, 251, 235))
-            self.list.Refresh()
+            record = self._row_at(item_index)
+            if record:
+                record.settings = settings
+                record.settings_text = self.get_row_settings_string(settings)
+                self.list.RefreshItem(item_index)
+                self.queue_dirty = True
             item_index = self.list.GetNextSelected(item_index)
 
+    def _apply_encoder_choice(self):
+        selection = self.choice_encoder.GetSelection()
+        preferred = self.working_encoders[selection - 1]["name"] if selection > 0 else None
+        capabilities = {"encoders": self.working_encoders}
+        chosen = []
+        for codec, spec in CODECS.items():
+            encoder, fps = select_encoder(capabilities, codec, preferred)
+            self.encoders[codec] = encoder
+            chosen.append(f"{spec.label} — {encoder}" + (f" ({fps:.0f} fps)" if fps else ""))
+        self.append_log(f"✅ Видеоэнкодеры: {', '.join(chosen)}\n")
+
+    def on_encoder(self, event):
+        selection = self.choice_encoder.GetSelection()
+        self.encoder_preference = self.working_encoders[selection - 1]["name"] if selection > 0 else "auto"
+        save_reg("encoder", self.encoder_preference)
+        self._apply_encoder_choice()
+
+    def on_max_jobs(self, event):
+        self.max_jobs = self.spin_jobs.GetValue()
+        save_reg("max_jobs", str(self.max_jobs))
+
     def on_limit_res(self, event):
         self.save_settings_to_sel_rows_and_update_list()
 
     def on_tonemapping(self, event):
         self.save_settings_to_sel_rows_and_update_list()
 
+    def on_codec(self, event):
+        self.save_settings_to_sel_rows_and_update_list()
+
     def on_skip_audio(self, event):
         self.save_settings_to_sel_rows_and_update_list()
 
+    def on_smart_copy(self, event):
+        self.save_settings_to_sel_rows_and_update_list()
+
     def on_item_deselect(self, event):
         self.reset_global_settings()
+        if self.list.GetFirstSelected() == -1:
+            self._destroy_row_editors()
 
     def on_clear_save_folder(self, event):
         self.save_folder_txt.SetValue("")
@@ -2014,13 +1908,13 @@ CBR — постоянный битрейт видео.
         item_index = self.list.GetFirstSelected()
         if item_index == -1:
             return
-        widgets = self._widgets_at(item_index)
-        if not widgets:
+        record = self._row_at(item_index)
+        if not record:
             return
-        widgets["settings"] = RowSettings()
-        self.list.SetStringItem(item_index, self.COL_SETTINGS, "⚙️Глобальные")
-        self.list.SetItemBackgroundColour(item_index, wx.Colour(255, 255, 255))
-        self.list.Refresh()
+        record.settings = RowSettings()
+        record.settings_text = "⚙️Глобальные"
+        self.list.RefreshItem(item_index)
+        self.queue_dirty = True
 
     def on_info_page(self, event):
         description = """\
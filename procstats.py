@@ -0,0 +1,258 @@
+"""
+Замер ресурсов дочернего процесса (ffmpeg): процессорное время, пиковая память
+и объём ввода-вывода. Без сторонних зависимостей: на Linux данные берутся из
+/proc/<pid>, на Windows — через WinAPI (ctypes), на остальных POSIX-системах
+только из os.wait4 при завершении.
+
+    monitor = ProcessMonitor(proc)
+    ...
+    stats = monitor.finish()  # ждёт завершения процесса
+"""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+
+_IS_WINDOWS = sys.platform.startswith("win")
+_HAS_PROC = os.path.isdir("/proc/self")
+
+
+@dataclass
+class ProcessStats:
+    """Итоговые показатели процесса. Объёмы — в байтах, время — в секундах."""
+
+    wall_time: float = 0.0
+    cpu_user: float = 0.0
+    cpu_system: float = 0.0
+    peak_rss: int = 0
+    read_bytes: int = 0
+    write_bytes: int = 0
+
+    @property
+    def cpu_time(self) -> float:
+        return self.cpu_user + self.cpu_system
+
+    @property
+    def cpu_percent(self) -> float:
+        """Загрузка CPU: 100% — одно ядро целиком."""
+        return 100.0 * self.cpu_time / self.wall_time if self.wall_time > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        data = asdict(self)
+        data["cpu_time"] = self.cpu_time
+        data["cpu_percent"] = self.cpu_percent
+        return data
+
+
+# --- Linux: /proc ---
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") and _HAS_PROC else 100
+
+
+def _sample_proc(pid: int) -> dict | None:
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            # имя процесса в скобках может содержать пробелы — режем по последней ')'
+            fields = f.read().rsplit(b")", 1)[1].split()
+    except OSError:
+        return None
+    sample = {
+        "cpu_user": int(fields[11]) / _CLK_TCK,
+        "cpu_system": int(fields[12]) / _CLK_TCK,
+    }
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="ascii", errors="replace") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    sample["peak_rss"] = int(line.split()[1]) * 1024
+                elif line.startswith("VmRSS:"):
+                    sample["rss"] = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        # rchar/wchar учитывают и сетевые ФС (NAS), в отличие от read_bytes/write_bytes
+        with open(f"/proc/{pid}/io", "r", encoding="ascii", errors="replace") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key == "rchar":
+                    sample["read_bytes"] = int(value)
+                elif key == "wchar":
+                    sample["write_bytes"] = int(value)
+    except OSError:
+        pass
+    return sample
+
+
+# --- Windows: WinAPI ---
+if _IS_WINDOWS:
+    import ctypes
+    from ctypes import wintypes
+
+    class _FILETIME(ctypes.Structure):
+        _fields_ = [("low", wintypes.DWORD), ("high", wintypes.DWORD)]
+
+    class _PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    class _IO_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ("ReadOperationCount", ctypes.c_ulonglong),
+            ("WriteOperationCount", ctypes.c_ulonglong),
+            ("OtherOperationCount", ctypes.c_ulonglong),
+            ("ReadTransferCount", ctypes.c_ulonglong),
+            ("WriteTransferCount", ctypes.c_ulonglong),
+            ("OtherTransferCount", ctypes.c_ulonglong),
+        ]
+
+    _kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    _kernel32.GetProcessTimes.argtypes = [wintypes.HANDLE] + [ctypes.POINTER(_FILETIME)] * 4
+    _kernel32.GetProcessTimes.restype = wintypes.BOOL
+    _kernel32.K32GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(_PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+    _kernel32.K32GetProcessMemoryInfo.restype = wintypes.BOOL
+    _kernel32.GetProcessIoCounters.argtypes = [wintypes.HANDLE, ctypes.POINTER(_IO_COUNTERS)]
+    _kernel32.GetProcessIoCounters.restype = wintypes.BOOL
+
+    def _filetime_seconds(ft: "_FILETIME") -> float:
+        return ((ft.high << 32) | ft.low) / 10_000_000
+
+    def _sample_windows(proc: subprocess.Popen) -> dict | None:
+        # Popen держит дескриптор процесса открытым и после его завершения,
+        # поэтому итоговые значения можно прочитать уже после wait().
+        handle = getattr(proc, "_handle", None)
+        if handle is None:
+            return None
+        handle = wintypes.HANDLE(int(handle))
+        creation, exit_, kernel, user = _FILETIME(), _FILETIME(), _FILETIME(), _FILETIME()
+        if not _kernel32.GetProcessTimes(handle, creation, exit_, kernel, user):
+            return None
+        sample = {"cpu_user": _filetime_seconds(user), "cpu_system": _filetime_seconds(kernel)}
+        mem = _PROCESS_MEMORY_COUNTERS()
+        mem.cb = ctypes.sizeof(mem)
+        if _kernel32.K32GetProcessMemoryInfo(handle, ctypes.byref(mem), mem.cb):
+            sample["peak_rss"] = int(mem.PeakWorkingSetSize)
+            sample["rss"] = int(mem.WorkingSetSize)
+        io = _IO_COUNTERS()
+        if _kernel32.GetProcessIoCounters(handle, ctypes.byref(io)):
+            sample["read_bytes"] = int(io.ReadTransferCount)
+            sample["write_bytes"] = int(io.WriteTransferCount)
+        return sample
+
+
+def sample_process(proc: subprocess.Popen) -> dict | None:
+    """
+    Мгновенный срез показателей процесса (cpu_user, cpu_system, rss, peak_rss,
+    read_bytes, write_bytes — что удалось получить) или None.
+    """
+    try:
+        if _IS_WINDOWS:
+            return _sample_windows(proc)
+        if _HAS_PROC:
+            return _sample_proc(proc.pid)
+    except Exception:
+        return None
+    return None
+
+
+class ProcessMonitor:
+    """
+    Фоновый опрос процесса раз в interval секунд: пиковая память на Linux
+    доступна только пока процесс жив, а текущие значения нужны для «живой»
+    статистики. finish() ждёт завершения и возвращает точный итог.
+
+    На POSIX finish() забирает процесс через os.wait4 (ради итоговых CPU и
+    пиковой памяти), держа внутреннюю блокировку Popen так же, как это делает
+    Popen.wait(). Поэтому poll(), terminate() и kill() из других потоков
+    безопасны: пока процесс не забран, poll() возвращает None, а после —
+    код возврата из Popen.returncode; waitpid по этому pid больше никто не вызывает.
+    """
+
+    def __init__(self, proc: subprocess.Popen, interval: float = 0.5):
+        self.proc = proc
+        self.interval = interval
+        self.stats = ProcessStats()
+        self.rss = 0
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._update(sample_process(proc))
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="procstats")
+        self._thread.start()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self._update(sample_process(self.proc))
+
+    def _update(self, sample: dict | None):
+        with self._lock:
+            self.stats.wall_time = time.monotonic() - self._started
+            if not sample:
+                return
+            # значения только растут: последний живой срез может оказаться полнее итогового
+            self.stats.cpu_user = max(self.stats.cpu_user, sample.get("cpu_user", 0.0))
+            self.stats.cpu_system = max(self.stats.cpu_system, sample.get("cpu_system", 0.0))
+            self.stats.read_bytes = max(self.stats.read_bytes, sample.get("read_bytes", 0))
+            self.stats.write_bytes = max(self.stats.write_bytes, sample.get("write_bytes", 0))
+            self.rss = sample.get("rss", self.rss)
+            self.stats.peak_rss = max(self.stats.peak_rss, sample.get("peak_rss", 0), self.rss)
+
+    def snapshot(self) -> ProcessStats:
+        """Текущие накопленные значения (для отображения во время работы)."""
+        with self._lock:
+            return ProcessStats(**asdict(self.stats))
+
+    def finish(self) -> ProcessStats:
+        """Ждёт завершения процесса, останавливает опрос и возвращает итог."""
+        if _IS_WINDOWS or not hasattr(os, "wait4"):
+            self.proc.wait()
+            self._update(sample_process(self.proc))
+        else:
+            self._reap_posix()
+        self._stop.set()
+        self._thread.join()
+        return self.snapshot()
+
+    def _reap_posix(self):
+        pid = self.proc.pid
+        lock = getattr(self.proc, "_waitpid_lock", None)
+        if lock is None:
+            # другая реализация Popen: ждём её средствами, остаются значения опроса
+            self.proc.wait()
+            self._update(None)
+            return
+        with lock:
+            if self.proc.returncode is not None:
+                # уже забран самим Popen
+                usage = None
+            else:
+                try:
+                    if hasattr(os, "waitid"):
+                        # дождаться выхода, не забирая процесс: у «зомби» ещё читаются CPU и I/O
+                        os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+                        self._update(sample_process(self.proc))
+                    _, status, usage = os.wait4(pid, 0)
+                except ChildProcessError:
+                    usage = None
+                else:
+                    # сразу, не отпуская блокировку: дальше Popen pid не трогает
+                    self.proc.returncode = os.waitstatus_to_exitcode(status)
+        if usage is None:
+            # код возврата получает сам Popen; остаются значения опроса
+            self.proc.wait()
+            self._update(None)
+            return
+        # ru_maxrss: килобайты на Linux, байты на macOS
+        peak = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+        self._update({"cpu_user": usage.ru_utime, "cpu_system": usage.ru_stime, "peak_rss": peak})
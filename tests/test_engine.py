@@ -0,0 +1,233 @@
+"""
+Чистые функции движка, от которых зависит итоговая команда ffmpeg.
+Таблицы случаев: (входные данные, ожидаемый результат).
+"""
+
+import unittest
+
+from engine import (
+    AUDIO_ONLY_EXT,
+    FfmpegProgressParser,
+    Rendition,
+    RowSettings,
+    decide_stream_copy,
+    optimize_filter_chain,
+    parse_ladder,
+)
+
+SCALE = "scale=-2:720"
+
+
+class OptimizeFilterChainTests(unittest.TestCase):
+    CASES = [
+        # (фильтры, -pix_fmt, ожидаемая цепочка)
+        ([], None, []),
+        ([SCALE], "yuv420p", [SCALE]),
+        ([SCALE, "format=yuv420p"], None, [SCALE, "format=yuv420p"]),
+        # подряд идущие format= сливаются в последний
+        (["format=p010le", "format=yuv420p"], None, ["format=yuv420p"]),
+        (["format=gbrpf32le", "format=p010le", "format=yuv420p"], None, ["format=yuv420p"]),
+        ([SCALE, "format=p010le", "format=yuv420p", "setsar=1"], None, [SCALE, "format=yuv420p", "setsar=1"]),
+        # разделённые другим фильтром — оба нужны
+        (["format=p010le", SCALE, "format=yuv420p"], None, ["format=p010le", SCALE, "format=yuv420p"]),
+        # завершающий format= убирается, только если формат выхода задан -pix_fmt
+        ([SCALE, "format=yuv420p"], "yuv420p", [SCALE]),
+        (["format=yuv420p"], "yuv420p", []),
+        (["format=p010le", "format=yuv420p"], "yuv420p", []),
+        (["format=yuv420p", SCALE], "yuv420p", ["format=yuv420p", SCALE]),
+        # format= после hwdownload задаёт формат выгрузки из видеопамяти — остаётся
+        (["hwdownload", "format=p010le", "format=yuv420p"], None, ["hwdownload", "format=p010le", "format=yuv420p"]),
+        (["hwdownload", "format=nv12"], "yuv420p", ["hwdownload", "format=nv12"]),
+        (["hwdownload", "format=p010le", SCALE, "format=yuv420p"], "yuv420p", ["hwdownload", "format=p010le", SCALE]),
+    ]
+
+    def test_cases(self):
+        for filters, pix_fmt, expected in self.CASES:
+            with self.subTest(filters=filters, pix_fmt=pix_fmt):
+                self.assertEqual(optimize_filter_chain(filters, pix_fmt), expected)
+
+    def test_input_is_not_modified(self):
+        filters = ["format=p010le", "format=yuv420p"]
+        optimize_filter_chain(filters, "yuv420p")
+        self.assertEqual(filters, ["format=p010le", "format=yuv420p"])
+
+
+def feed_lines(parser: FfmpegProgressParser, text: str) -> list[dict]:
+    return [block for block in map(parser.feed, text.splitlines()) if block is not None]
+
+
+class FfmpegProgressParserTests(unittest.TestCase):
+    BLOCK = (
+        "frame=250\nfps=49.80\nstream_0_0_q=23.0\nbitrate= 812.3kbits/s\ntotal_size=1015808\n"
+        "out_time_us=10000000\nout_time_ms=10000000\nout_time=00:00:10.000000\ndup_frames=0\n"
+        "drop_frames=0\nspeed=1.99x\nprogress=continue\n"
+    )
+    EMPTY = {"time": None, "frame": None, "fps": None, "speed": None, "size": None, "bitrate": None, "end": False}
+
+    def test_full_block(self):
+        (block,) = feed_lines(FfmpegProgressParser(), self.BLOCK)
+        self.assertEqual(
+            block,
+            {"time": 10.0, "frame": 250, "fps": 49.8, "speed": 1.99, "size": 1015808, "bitrate": 812.3, "end": False},
+        )
+
+    CASES = [
+        # (строки блока без progress=, ожидаемые поля)
+        ("out_time_us=1500000", {"time": 1.5}),
+        # старые сборки: out_time_ms тоже в микросекундах
+        ("out_time_ms=2500000", {"time": 2.5}),
+        ("out_time_us=N/A\nout_time_ms=3000000", {"time": 3.0}),
+        ("out_time_us=0\nout_time_ms=N/A", {"time": 0.0}),
+        ("out_time_us=N/A", {}),
+        ("speed=N/A\nbitrate=N/A\ntotal_size=N/A\nfps=N/A\nframe=N/A", {}),
+        ("speed=0x\nfps=0.00\nframe=0", {"speed": 0.0, "fps": 0.0, "frame": 0}),
+        ("speed=   2.5x\nbitrate=  1200.0kbits/s", {"speed": 2.5, "bitrate": 1200.0}),
+        ("total_size=abc\nframe=", {}),
+    ]
+
+    def test_fields(self):
+        for lines, fields in self.CASES:
+            with self.subTest(lines=lines):
+                (block,) = feed_lines(FfmpegProgressParser(), f"{lines}\nprogress=continue")
+                self.assertEqual(block, {**self.EMPTY, **fields})
+
+    def test_end_block(self):
+        (block,) = feed_lines(FfmpegProgressParser(), "frame=10\nprogress=end")
+        self.assertTrue(block["end"])
+        self.assertEqual(block["frame"], 10)
+
+    def test_blocks_are_independent(self):
+        blocks = feed_lines(FfmpegProgressParser(), f"{self.BLOCK}frame=260\nprogress=end\n")
+        self.assertEqual(len(blocks), 2)
+        self.assertEqual(blocks[1], {**self.EMPTY, "frame": 260, "end": True})
+
+    def test_returns_only_on_progress_line(self):
+        parser = FfmpegProgressParser()
+        for line in ("frame=1", "", "   ", "garbage without separator", "fps=25"):
+            with self.subTest(line=line):
+                self.assertIsNone(parser.feed(line))
+        self.assertEqual(parser.feed("progress=continue\r\n"), {**self.EMPTY, "frame": 1, "fps": 25.0})
+
+
+class ParseLadderTests(unittest.TestCase):
+    CASES = [
+        # (описание, ожидаемые выходы)
+        (
+            "1080p,720p:24,audio",
+            [Rendition("1080p", 1080), Rendition("720p", 720, 24), Rendition("audio", audio_only=True)],
+        ),
+        ("720p", [Rendition("720p", 720)]),
+        ("source:20,480p", [Rendition("source", None, 20), Rendition("480p", 480)]),
+        ("2160p,1440p", [Rendition("2160p", 2160), Rendition("1440p", 1440)]),
+        # регистр, пробелы и пустые элементы не мешают
+        (" 1080P , Source ,, ", [Rendition("1080p", 1080), Rendition("source")]),
+        ("audio,360p", [Rendition("audio", audio_only=True), Rendition("360p", 360)]),
+    ]
+
+    ERRORS = [
+        "",
+        "audio",
+        "audio:5",
+        "4k",
+        "99p",
+        "10800p",
+        "720",
+        "720p:high",
+        "720p:-5",
+        "720p,720p:20",
+        "audio,audio,720p",
+    ]
+
+    def test_valid(self):
+        for spec, expected in self.CASES:
+            with self.subTest(spec=spec):
+                self.assertEqual(parse_ladder(spec), expected)
+
+    def test_invalid(self):
+        for spec in self.ERRORS:
+            with self.subTest(spec=spec):
+                with self.assertRaises(ValueError):
+                    parse_ladder(spec)
+
+    def test_output_extensions(self):
+        self.assertEqual([r.output_ext for r in parse_ladder("720p,audio")], [".mp4", AUDIO_ONLY_EXT])
+
+
+H264_720P = {"codec": "h264", "pix_fmt": "yuv420p", "hdr_type": "SDR", "width": 1280, "height": 720, "bit_rate": 4_000_000}
+HEVC_HDR10 = {"codec": "hevc", "pix_fmt": "yuv420p10le", "hdr_type": "HDR10", "width": 3840, "height": 2160, "bit_rate": 20_000_000}
+AAC_STEREO = {"codec": "aac", "channels": 2}
+
+
+def video(base: dict, **changes) -> dict:
+    return {**base, **changes}
+
+
+class DecideStreamCopyTests(unittest.TestCase):
+    VIDEO_CASES = [
+        # (описание, сведения о видео, настройки, копировать видео)
+        ("h264 SDR в h264", H264_720P, RowSettings(), True),
+        ("другой кодек", video(H264_720P, codec="mpeg4"), RowSettings(), False),
+        ("h264 в hevc", H264_720P, RowSettings(codec="hevc"), False),
+        ("4:2:2", video(H264_720P, pix_fmt="yuv422p"), RowSettings(), False),
+        ("10 бит в h264", video(H264_720P, pix_fmt="yuv420p10le"), RowSettings(), False),
+        ("10 бит SDR в hevc", video(HEVC_HDR10, hdr_type="SDR"), RowSettings(codec="hevc"), True),
+        ("HDR в h264", video(H264_720P, hdr_type="HDR10"), RowSettings(), False),
+        # HDR копируется только в 10-битный кодек и только если HDR сохраняется
+        ("HDR10, авто", HEVC_HDR10, RowSettings(codec="hevc"), False),
+        ("HDR10, сохранить HDR", HEVC_HDR10, RowSettings(codec="hevc", tonemapping=3), True),
+        ("HDR10, тонмаппинг выключен", HEVC_HDR10, RowSettings(codec="hevc", tonemapping=2), True),
+        ("Dolby Vision, сохранить HDR", video(HEVC_HDR10, hdr_type="Dolby Vision"), RowSettings(codec="hevc", tonemapping=3), False),
+        ("тонмаппинг принудительно", H264_720P, RowSettings(tonemapping=1), False),
+        ("ограничение FullHD, 720p", H264_720P, RowSettings(limit_res=True), True),
+        ("ограничение FullHD, ровно 1080p", video(H264_720P, width=1920, height=1080), RowSettings(limit_res=True), True),
+        ("ограничение FullHD, 4K", video(H264_720P, width=3840, height=2160), RowSettings(limit_res=True), False),
+        ("ограничение FullHD, размер неизвестен", video(H264_720P, width=None, height=None), RowSettings(limit_res=True), False),
+        ("4K без ограничения", video(H264_720P, width=3840, height=2160), RowSettings(), True),
+        ("CBR выше битрейта исходника", H264_720P, RowSettings(encode_mode=1, quality=8), True),
+        ("CBR ниже битрейта исходника", H264_720P, RowSettings(encode_mode=1, quality=2), False),
+        ("CBR, битрейт неизвестен", video(H264_720P, bit_rate=None), RowSettings(encode_mode=1, quality=8), False),
+        ("пустые сведения", {}, RowSettings(), False),
+    ]
+
+    AUDIO_CASES = [
+        # (описание, аудиопоток, копировать аудио)
+        ("AAC стерео", AAC_STEREO, True),
+        ("AAC 7.1", {"codec": "aac", "channels": 8}, True),
+        ("AAC, каналов больше 8", {"codec": "aac", "channels": 10}, False),
+        ("AAC, каналы неизвестны", {"codec": "aac"}, False),
+        ("AC-3", {"codec": "ac3", "channels": 6}, False),
+        ("кодек в верхнем регистре", {"codec": "AAC", "channels": 2}, True),
+    ]
+
+    def test_video(self):
+        for name, info, settings, expected in self.VIDEO_CASES:
+            with self.subTest(name):
+                copy_video, _, reasons = decide_stream_copy(info, AAC_STEREO, settings)
+                self.assertEqual(copy_video, expected)
+                self.assertTrue(any(reason.startswith("видео") for reason in reasons))
+
+    def test_audio(self):
+        for name, stream, expected in self.AUDIO_CASES:
+            with self.subTest(name):
+                _, copy_audio, reasons = decide_stream_copy(H264_720P, stream, RowSettings())
+                self.assertEqual(copy_audio, expected)
+                self.assertTrue(any(reason.startswith("аудио") for reason in reasons))
+
+    def test_smart_copy_off_keeps_explicit_choice(self):
+        for skip_video, skip_audio in ((False, False), (True, False), (False, True)):
+            with self.subTest(skip_video=skip_video, skip_audio=skip_audio):
+                settings = RowSettings(smart_copy=False, skip_video=skip_video, skip_audio=skip_audio)
+                self.assertEqual(decide_stream_copy(H264_720P, AAC_STEREO, settings), (skip_video, skip_audio, []))
+
+    def test_explicit_copy_is_not_reconsidered(self):
+        settings = RowSettings(skip_video=True, skip_audio=True)
+        self.assertEqual(decide_stream_copy(video(H264_720P, codec="mpeg4"), {"codec": "mp3"}, settings), (True, True, []))
+
+    def test_no_audio_stream(self):
+        copy_video, copy_audio, reasons = decide_stream_copy(H264_720P, None, RowSettings())
+        self.assertEqual((copy_video, copy_audio), (True, False))
+        self.assertFalse(any(reason.startswith("аудио") for reason in reasons))
+
+
+if __name__ == "__main__":
+    unittest.main()
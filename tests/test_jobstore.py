@@ -0,0 +1,238 @@
+"""
+Постоянная очередь (JobStore) и её разбор после сбоя: recover(),
+job_already_done() и open_state() из cli. Нужны только временная база
+SQLite и временные файлы — ни wx, ни ffmpeg.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import cli
+from engine import (
+    JOB_CANCELLED,
+    JOB_DONE,
+    JOB_FAILED,
+    JOB_PENDING,
+    JOB_RUNNING,
+    JOB_SEARCHING,
+    ConversionJob,
+    JobStore,
+    RowSettings,
+    job_already_done,
+    part_path_for,
+)
+
+
+def touch(path: str, data: bytes = b"data") -> str:
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+class JobStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = self._tmp.name
+        self.db_path = os.path.join(self.dir, "queue.sqlite3")
+        self.store = JobStore(self.db_path)
+        self.assertTrue(self.store.available)
+
+    def tearDown(self):
+        if self.store._conn is not None:
+            self.store._conn.close()
+        self._tmp.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    def job(self, key: int, status: str = JOB_PENDING, outputs: list[str] | None = None, **kwargs) -> ConversionJob:
+        outputs = outputs or []
+        kwargs.setdefault("settings", RowSettings())
+        return ConversionJob(
+            key=key,
+            input_path=self.path(f"in{key}.mkv"),
+            status=status,
+            output_path=outputs[0] if outputs else None,
+            output_paths=outputs,
+            **kwargs,
+        )
+
+
+class RecoverTests(JobStoreTestCase):
+    def test_active_jobs_become_pending_and_lose_partial_outputs(self):
+        for status in (JOB_RUNNING, JOB_SEARCHING):
+            with self.subTest(status=status):
+                output = self.path(f"{status}_conv.mp4")
+                part = touch(part_path_for(output))
+                self.store.replace_all([self.job(0, status, [output])])
+
+                logged = []
+                (job,) = self.store.recover(logged.append)
+
+                self.assertEqual(job.status, JOB_PENDING)
+                self.assertEqual(job.output_paths, [])
+                self.assertIsNone(job.output_path)
+                self.assertFalse(os.path.exists(part))
+                self.assertFalse(os.path.exists(output))
+                self.assertTrue(any(os.path.basename(part) in line for line in logged))
+                # новое состояние записано в базу, а не только возвращено
+                (stored,) = self.store.load()
+                self.assertEqual((stored.status, stored.output_paths), (JOB_PENDING, []))
+
+    def test_all_ladder_outputs_are_discarded(self):
+        outputs = [self.path("a_conv_1080p.mp4"), self.path("a_conv_720p.mp4"), self.path("a_conv_audio.m4a")]
+        parts = [touch(part_path_for(output)) for output in outputs]
+        self.store.replace_all([self.job(0, JOB_RUNNING, outputs)])
+
+        self.store.recover()
+
+        self.assertEqual([p for p in parts if os.path.exists(p)], [])
+
+    def test_finished_statuses_are_kept(self):
+        done_output = touch(self.path("done_conv.mp4"))
+        jobs = [
+            self.job(0, JOB_DONE, [done_output]),
+            self.job(1, JOB_FAILED),
+            self.job(2, JOB_CANCELLED),
+            self.job(3, JOB_PENDING),
+        ]
+        self.store.replace_all(jobs)
+
+        recovered = self.store.recover()
+
+        self.assertEqual([job.status for job in recovered], [JOB_DONE, JOB_FAILED, JOB_CANCELLED, JOB_PENDING])
+        self.assertEqual(recovered[0].output_paths, [done_output])
+        self.assertTrue(os.path.isfile(done_output))
+
+    def test_missing_part_is_not_an_error(self):
+        self.store.replace_all([self.job(0, JOB_RUNNING, [self.path("gone_conv.mp4")])])
+        logged = []
+
+        (job,) = self.store.recover(logged.append)
+
+        self.assertEqual(job.status, JOB_PENDING)
+        self.assertEqual(logged, [])
+
+
+class JobAlreadyDoneTests(JobStoreTestCase):
+    def test_done_with_all_outputs(self):
+        outputs = [touch(self.path("a_720p.mp4")), touch(self.path("a_audio.m4a"))]
+        self.assertTrue(job_already_done(self.job(0, JOB_DONE, outputs)))
+
+    def test_done_with_missing_output_is_requeued(self):
+        outputs = [touch(self.path("a_720p.mp4")), self.path("deleted_audio.m4a")]
+        self.assertFalse(job_already_done(self.job(0, JOB_DONE, outputs)))
+
+    def test_done_without_outputs(self):
+        self.assertFalse(job_already_done(self.job(0, JOB_DONE)))
+
+    def test_other_statuses(self):
+        output = touch(self.path("a_conv.mp4"))
+        for status in (JOB_PENDING, JOB_RUNNING, JOB_FAILED, JOB_CANCELLED):
+            with self.subTest(status=status):
+                self.assertFalse(job_already_done(self.job(0, status, [output])))
+
+
+class StoredJobDataTests(JobStoreTestCase):
+    def test_round_trip(self):
+        settings = RowSettings(is_global=False, encode_mode=1, quality=8, codec="hevc")
+        subtitles = [{"order": 2, "display": "eng", "supported": True}]
+        job = self.job(0, settings=settings, audio_track=1, subtitles=subtitles, add_suffix=False, chunked=True)
+        self.store.replace_all([job])
+
+        (loaded,) = self.store.load()
+
+        self.assertEqual(loaded.settings, settings)
+        self.assertEqual(loaded.audio_track, 1)
+        self.assertEqual(loaded.subtitles, subtitles)
+        self.assertFalse(loaded.add_suffix)
+        self.assertTrue(loaded.chunked)
+
+    def test_unknown_settings_fields_are_dropped(self):
+        self.store.replace_all([self.job(0)])
+        with sqlite3.connect(self.db_path) as conn:
+            (data,) = conn.execute("SELECT data FROM jobs").fetchone()
+            data = json.loads(data)
+            # очередь, сохранённая другой версией программы
+            data["settings"].update(is_global=False, quality=30, removed_option=True)
+            conn.execute("UPDATE jobs SET data=?", (json.dumps(data),))
+
+        (loaded,) = self.store.load()
+
+        self.assertEqual(loaded.settings, RowSettings(is_global=False, quality=30))
+
+    def test_broken_row_is_skipped(self):
+        self.store.replace_all([self.job(0), self.job(1)])
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("UPDATE jobs SET data='{not json' WHERE key=0")
+
+        self.assertEqual([job.key for job in self.store.load()], [1])
+
+    def test_append_keeps_queue_order(self):
+        self.store.replace_all([self.job(5), self.job(3)])
+        self.store.append([self.job(7)])
+        self.store.append([self.job(1), self.job(9)])
+
+        self.assertEqual([job.key for job in self.store.load()], [5, 3, 7, 1, 9])
+
+    def test_set_status_updates_outputs(self):
+        job = self.job(0)
+        self.store.replace_all([job])
+        job.status, job.output_paths = JOB_RUNNING, [self.path("a_conv.mp4")]
+        self.store.set_status(job)
+
+        (loaded,) = self.store.load()
+
+        self.assertEqual((loaded.status, loaded.output_paths), (JOB_RUNNING, job.output_paths))
+
+    def test_unusable_database_disables_store(self):
+        store = JobStore(os.path.join(self.dir, "missing", "queue.sqlite3"))
+
+        self.assertFalse(store.available)
+        store.replace_all([self.job(0)])
+        self.assertEqual(store.recover(), [])
+
+
+class OpenStateTests(JobStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.reporter = cli.Reporter(as_json=False, quiet=True)
+
+    def open_state(self, state):
+        return cli.open_state(argparse.Namespace(state=state), self.reporter)
+
+    def test_without_state(self):
+        self.assertEqual(self.open_state(None), (None, []))
+
+    def test_returns_only_done_jobs_with_outputs(self):
+        done_output = touch(self.path("done_conv.mp4"))
+        running_output = self.path("running_conv.mp4")
+        touch(part_path_for(running_output))
+        self.store.replace_all(
+            [
+                self.job(0, JOB_DONE, [done_output]),
+                self.job(1, JOB_DONE, [self.path("deleted_conv.mp4")]),
+                self.job(2, JOB_RUNNING, [running_output]),
+                self.job(3, JOB_FAILED),
+            ]
+        )
+
+        store, done = self.open_state(self.db_path)
+        try:
+            self.assertEqual([job.key for job in done], [0])
+            self.assertFalse(os.path.exists(part_path_for(running_output)))
+            statuses = {job.key: job.status for job in store.load()}
+            self.assertEqual(statuses, {0: JOB_DONE, 1: JOB_DONE, 2: JOB_PENDING, 3: JOB_FAILED})
+        finally:
+            store._conn.close()
+
+    def test_unusable_state_file(self):
+        self.assertEqual(self.open_state(os.path.join(self.dir, "missing", "queue.sqlite3")), (None, []))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+Фильтр слежения (cli.WatchIgnore) вместе с FolderWatcher: собственные
+результаты не должны снова попадать в очередь, как бы ни был задан -o.
+"""
+
+import os
+import tempfile
+import unittest
+
+import cli
+from engine import part_path_for, reserve_output_path
+from watcher import FolderWatcher
+
+
+class WatchIgnoreTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._cwd = os.getcwd()
+        os.chdir(self._tmp.name)
+        os.mkdir("in")
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def ready(self, skip: cli.WatchIgnore) -> list[str]:
+        watcher = FolderWatcher(["in"], settle=0, include_existing=True, ignore=skip, use_inotify=False)
+        try:
+            return [os.path.basename(path) for path in watcher.poll(timeout=0)]
+        finally:
+            watcher.close()
+
+    def write(self, path: str):
+        with open(path, "wb") as f:
+            f.write(b"data")
+
+    def test_output_in_watched_folder_with_relative_output_dir(self):
+        # watch in -o in: выход строится от относительной папки, наблюдатель видит абсолютный путь
+        self.write(os.path.join("in", "x.mp4"))
+        output = reserve_output_path("in", os.path.join("in", "x.mp4"))
+        self.assertFalse(os.path.isabs(output))
+        skip = cli.WatchIgnore()
+        skip.add_outputs([output])
+        # ffmpeg дописал временный файл, и он получил итоговое имя
+        self.write(part_path_for(output))
+        os.replace(part_path_for(output), output)
+
+        self.assertEqual(self.ready(skip), ["x.mp4"])
+
+    def test_unrelated_files_are_taken(self):
+        for name in ("a.mkv", "b.mp4"):
+            self.write(os.path.join("in", name))
+        skip = cli.WatchIgnore()
+        skip.add_outputs([os.path.join("out", "a_conv.mp4")])
+
+        self.assertEqual(self.ready(skip), ["a.mkv", "b.mp4"])
+
+    def test_parts_and_finished_inputs_are_skipped(self):
+        for name in ("done.mkv", "new.mkv", "new_conv.vcpart.mp4"):
+            self.write(os.path.join("in", name))
+        skip = cli.WatchIgnore([os.path.join("in", "done.mkv")])
+
+        self.assertEqual(self.ready(skip), ["new.mkv"])
+
+    def test_path_spelling_does_not_matter(self):
+        skip = cli.WatchIgnore()
+        skip.add_outputs([os.path.join("in", ".", "x_conv.mp4")])
+
+        self.assertTrue(skip(os.path.abspath(os.path.join("in", "x_conv.mp4"))))
+        if os.path.normcase("A") == "a":
+            self.assertTrue(skip(os.path.abspath(os.path.join("IN", "X_CONV.MP4"))))
+
+
+if __name__ == "__main__":
+    unittest.main()
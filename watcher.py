@@ -0,0 +1,313 @@
+"""
+Слежение за папками: новые медиафайлы отдаются, только когда их запись
+закончена (размер и время изменения не меняются settle секунд). Без сторонних
+зависимостей: на Linux — inotify через ctypes, в остальных случаях (другие ОС,
+сетевые ФС, где inotify не видит чужих записей) — периодический опрос.
+
+    watcher = FolderWatcher(["/mnt/ingest"], settle=10)
+    while True:
+        for path in watcher.poll(timeout=1.0):
+            ...
+
+После начального обхода inotify сообщает имена изменившихся файлов, поэтому
+папка с тысячами файлов не перечитывается на каждое событие; проверяются
+только файлы, запись которых ещё не закончилась.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+DEFAULT_EXTENSIONS = (".mkv", ".mp4", ".mov", ".avi")
+DEFAULT_SETTLE_SECONDS = 10.0
+DEFAULT_POLL_INTERVAL = 5.0
+
+# --- Linux: inotify ---
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# IN_MODIFY не нужен: он приходит на каждую запись, а окончание записи и так
+# отслеживается по размеру; для копирования по сети хватает CREATE + CLOSE_WRITE.
+_WATCH_MASK = IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+_LIBC = _load_libc()
+
+
+def inotify_available() -> bool:
+    return _LIBC is not None
+
+
+class InotifyWatcher:
+    """
+    Источник изменений на inotify. changes(timeout) возвращает (пути
+    изменившихся файлов, нужен_полный_обход): полный обход нужен после
+    переполнения очереди событий ядра или удаления/переноса наблюдаемой папки.
+    """
+
+    def __init__(self, folders: list[str], recursive: bool = False):
+        if _LIBC is None:
+            raise OSError("inotify недоступен")
+        self.recursive = recursive
+        self.fd = _LIBC.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self.dirs: dict[int, str] = {}
+        for folder in folders:
+            self._add_tree(folder)
+
+    def _add(self, folder: str):
+        wd = _LIBC.inotify_add_watch(self.fd, os.fsencode(folder), _WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            # ENOSPC — исчерпан fs.inotify.max_user_watches
+            raise OSError(err, f"inotify_add_watch: {os.strerror(err)}", folder)
+        self.dirs[wd] = folder
+
+    def _add_tree(self, folder: str):
+        self._add(folder)
+        if not self.recursive:
+            return
+        for root, dirs, _ in os.walk(folder):
+            for name in dirs:
+                try:
+                    self._add(os.path.join(root, name))
+                except OSError:
+                    pass
+
+    def changes(self, timeout: float) -> tuple[set[str], bool]:
+        paths: set[str] = set()
+        rescan = False
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return paths, rescan
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset : offset + length].split(b"\0", 1)[0]
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    rescan = True
+                    continue
+                folder = self.dirs.get(wd)
+                if folder is None:
+                    continue
+                if mask & IN_IGNORED or mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    self.dirs.pop(wd, None)
+                    rescan = True
+                    continue
+                path = os.path.join(folder, os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    if self.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                        try:
+                            self._add_tree(path)
+                        except OSError:
+                            pass
+                        # файлы могли появиться в папке раньше, чем на неё поставлено наблюдение
+                        rescan = True
+                    continue
+                paths.add(path)
+        return paths, rescan
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher:
+    """Источник изменений на опросе: раз в interval секунд обход папок и сравнение (размер, mtime)."""
+
+    def __init__(self, folders: list[str], recursive: bool = False, interval: float = DEFAULT_POLL_INTERVAL):
+        self.folders = list(folders)
+        self.recursive = recursive
+        self.interval = interval
+        self.snapshot = self._scan()
+        self.next_scan = time.monotonic() + interval
+
+    def _scan(self) -> dict[str, tuple[int, float]]:
+        result = {}
+        for path, st in iter_files(self.folders, self.recursive):
+            result[path] = (st.st_size, st.st_mtime)
+        return result
+
+    def changes(self, timeout: float) -> tuple[set[str], bool]:
+        wait = self.next_scan - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set(), False
+        time.sleep(max(wait, 0.0))
+        self.next_scan = time.monotonic() + self.interval
+        current = self._scan()
+        changed = {path for path, state in current.items() if self.snapshot.get(path) != state}
+        self.snapshot = current
+        return changed, False
+
+    def close(self):
+        pass
+
+
+def iter_files(folders: list[str], recursive: bool = False):
+    """(путь, os.stat_result) обычных файлов в папках; ошибки доступа пропускаются."""
+    stack = list(folders)
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive:
+                                stack.append(entry.path)
+                        elif entry.is_file():
+                            yield entry.path, entry.stat()
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+
+class FolderWatcher:
+    """
+    Новые файлы в папках, запись которых закончена. Файл считается готовым,
+    когда он не пустой, а его размер и mtime не менялись settle секунд.
+    Каждый файл отдаётся один раз (повторно — только если он потом изменился).
+
+    include_existing — отдать и файлы, лежавшие в папке до запуска;
+    ignore(path) — отбросить файл (например, собственные результаты конвертации);
+    use_inotify=False — принудительно опрос (сетевые папки, смонтированные по SMB/NFS:
+    inotify на клиенте не видит записей с других машин).
+    """
+
+    def __init__(
+        self,
+        folders: list[str],
+        extensions: tuple[str, ...] = DEFAULT_EXTENSIONS,
+        settle: float = DEFAULT_SETTLE_SECONDS,
+        recursive: bool = False,
+        include_existing: bool = False,
+        ignore=None,
+        use_inotify: bool = True,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+    ):
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.settle = settle
+        self.recursive = recursive
+        self.ignore = ignore
+        # путь → (размер, mtime, момент последнего изменения)
+        self.pending: dict[str, tuple[int, float, float]] = {}
+        # отданные файлы и их (размер, mtime) на момент выдачи
+        self.delivered: dict[str, tuple[int, float]] = {}
+
+        self.source = None
+        if use_inotify and inotify_available():
+            try:
+                self.source = InotifyWatcher(self.folders, recursive)
+            except OSError:
+                self.source = None
+        if self.source is None:
+            self.source = PollingWatcher(self.folders, recursive, poll_interval)
+        self.mode = "inotify" if isinstance(self.source, InotifyWatcher) else "polling"
+
+        existing = list(iter_files(self.folders, recursive))
+        now = time.monotonic()
+        for path, st in existing:
+            if not self._wanted(path):
+                continue
+            if include_existing:
+                self.pending[path] = (st.st_size, st.st_mtime, now)
+            else:
+                self.delivered[path] = (st.st_size, st.st_mtime)
+
+    def _wanted(self, path: str) -> bool:
+        name = os.path.basename(path)
+        return not name.startswith(".") and name.lower().endswith(self.extensions)
+
+    def _track(self, path: str):
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.pending.pop(path, None)
+            return
+        state = (st.st_size, st.st_mtime)
+        if self.delivered.get(path) == state:
+            return
+        previous = self.pending.get(path)
+        if previous is None or previous[:2] != state:
+            self.pending[path] = (*state, time.monotonic())
+
+    def _rescan(self):
+        for path, st in iter_files(self.folders, self.recursive):
+            if self._wanted(path) and self.delivered.get(path) != (st.st_size, st.st_mtime):
+                self._track(path)
+
+    def poll(self, timeout: float = 1.0) -> list[str]:
+        """Ждёт изменений до timeout секунд и возвращает файлы, ставшие готовыми."""
+        changed, rescan = self.source.changes(timeout)
+        if rescan:
+            self._rescan()
+        for path in changed:
+            if self._wanted(path):
+                self._track(path)
+
+        ready = []
+        now = time.monotonic()
+        for path, (size, mtime, changed_at) in list(self.pending.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                # удалён или переименован до окончания записи
+                del self.pending[path]
+                continue
+            if (st.st_size, st.st_mtime) != (size, mtime):
+                self.pending[path] = (st.st_size, st.st_mtime, now)
+                continue
+            if size == 0 or now - changed_at < self.settle:
+                continue
+            del self.pending[path]
+            self.delivered[path] = (size, mtime)
+            if self.ignore and self.ignore(path):
+                continue
+            ready.append(path)
+        return sorted(ready)
+
+    def close(self):
+        self.source.close()